@@ -0,0 +1,75 @@
+import os, json, tempfile
+import logging
+from utils import sha256_file
+
+logging.basicConfig()
+
+logger = logging.getLogger("BuildManifest")
+logger.setLevel(logging.INFO)
+
+# Record of the last generation, used to only reprocess the projects that changed.
+# For each project it stores the inputs (deployment version, engine, quantization, role,
+# export hash), the files derived from them with their hash, and the files written to the output.
+# Paths are stored relative to the directory of the manifest.
+class BuildManifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.projects = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.projects = json.load(file)['projects']
+            except (OSError, ValueError, KeyError):
+                logger.warning(f"Invalid build manifest {path}, all projects will be processed")
+
+    def _abspath(self, rel_path):
+        return os.path.join(self.base_dir, rel_path)
+
+    def _relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def project_ids(self):
+        return list(self.projects.keys())
+
+    def get_inputs(self, project_id):
+        return dict(self.projects[str(project_id)]['inputs'])
+
+    # True if the project was processed with the same inputs and its derived files are intact.
+    # Only the keys given in inputs are compared, the export hash is not known before downloading.
+    def is_up_to_date(self, project_id, inputs):
+        entry = self.projects.get(str(project_id))
+        if entry is None:
+            return False
+        if any(entry['inputs'].get(key) != value for key, value in inputs.items()):
+            return False
+        for rel_path, digest in entry['artifacts'].items():
+            path = self._abspath(rel_path)
+            if not os.path.isfile(path) or sha256_file(path) != digest:
+                logger.info(f"{path} changed since last run")
+                return False
+        return True
+
+    def set_project(self, project_id, inputs, artifacts, outputs):
+        self.projects[str(project_id)] = {
+            "inputs": inputs,
+            "artifacts": {self._relpath(path): sha256_file(path) for path in artifacts},
+            "outputs": [self._relpath(path) for path in outputs],
+        }
+
+    # Delete the output files of a project and forget it
+    def remove_project(self, project_id):
+        entry = self.projects.pop(str(project_id), None)
+        if entry is None:
+            return
+        for rel_path in entry['outputs']:
+            path = self._abspath(rel_path)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.base_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as file:
+            json.dump({"projects": self.projects}, file, indent=2)
+        os.replace(tmp_path, self.path)
@@ -1,157 +1,372 @@
-import requests, json, time, re, os
+import requests, json, time, re, os, threading, random
 import logging
+from instrumentation import metrics
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logging.basicConfig()
 
 logger = logging.getLogger("EIDownload")
 logger.setLevel(logging.INFO)
 
+# Size of the chunks written to disk while streaming an export
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Minimum number of seconds between two download progress messages
+DOWNLOAD_LOG_INTERVAL = 2
+# Maximum number of seconds before a waiting build job notices that the run was aborted
+ABORT_CHECK_INTERVAL = 0.2
+
+STUDIO_API_URL = "https://studio.edgeimpulse.com/v1/api"
+# Number of job stdout lines requested per poll (newest first)
+STDOUT_PAGE_SIZE = 100
+# Number of last job stdout lines kept to find the new ones when the line count is not reported
+STDOUT_CURSOR_LINES = 5
+# Pages of the job stdout requested by one poll at most, when the API does not report the line count
+STDOUT_MAX_PAGES = 20
+
+def format_throughput(nbytes, seconds):
+    return f"{nbytes / max(seconds, 1e-6) / (1024 * 1024):.2f} MB/s"
+
+# Shared HTTP layer for the Studio API: one pooled keep-alive session for all projects
+class StudioClient:
+
+    def __init__(self, pool_size = 10, timeout = 60, retries = 5, backoff_factor = 0.5, base_url = STUDIO_API_URL):
+        self.base_url = base_url
+        # (connect, read) timeout, applied to every request
+        self.timeout = (min(10, timeout), timeout)
+
+        # Retry on rate limiting and server errors with exponential backoff.
+        # POST is left out so a build job is never started twice.
+        retry = Retry(
+            total = retries,
+            backoff_factor = backoff_factor,
+            status_forcelist = [429, 500, 502, 503, 504],
+            respect_retry_after_header = True,
+            raise_on_status = False,
+        )
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size, max_retries = retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, path, api_key, accept = "application/json", **kwargs):
+        headers = {
+            "x-api-key": api_key,
+            "Accept": accept,
+            "Content-Type": "application/json",
+        }
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+
+    # Send a request and return the decoded JSON body, raise if the API reports an error
+    def request_json(self, method, path, api_key, **kwargs):
+        response = self.request(method, path, api_key, **kwargs)
+        body = json.loads(response.text)
+        if (not body['success']):
+            raise Exception(body['error'])
+        return body
+
+    def close(self):
+        self.session.close()
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+# Client used by EIDownload instances created without an explicit client
+def get_default_client():
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = StudioClient()
+        return _default_client
+
+# Engine and model type parameters of the Studio deployment API
+def deployment_type(eon, quantized):
+    engine = 'tflite-eon' if eon else 'tflite'
+    model_type = 'int8' if quantized else 'float32'
+    return engine, model_type
+
 class EIDownload:
 
-    def __init__(self, api_key, project_id = None):
+    def __init__(self, api_key, project_id = None, abort_event = None, client = None, poller = None):
         self.api_key = api_key
+        self.client = client if client is not None else get_default_client()
+        # Optional JobPoller shared with other projects to wait for builds
+        self.poller = poller
+        # Optional threading.Event, set by the caller to stop waiting for builds
+        self.abort_event = abort_event
+        # Version of the last deployment returned by download_model
+        self.deployment_version = None
         if project_id is None:
             self.project_id = self.set_project_id()
             logger.info("Project ID is " + str(self.project_id))
         else:
             self.project_id = project_id
 
+    def aborted(self):
+        return self.abort_event is not None and self.abort_event.is_set()
+
     def get_project_id(self):
         return self.project_id
 
     def set_project_id(self):
-        url = f"https://studio.edgeimpulse.com/v1/api/projects"
-        headers = {
-            "x-api-key": self.api_key,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
-
-        response = requests.request("GET", url, headers=headers)
-        body = json.loads(response.text)
-        if (not body['success']):
-            raise Exception(body['error'])
+        body = self.client.request_json("GET", "/projects", self.api_key)
 
         return body['projects'][0]['id']
 
 
-    def download_model(self, out_directory, eon=True, quantized=True, force_build=False):
+    def download_model(self, out_directory, eon=True, quantized=True, force_build=False, cache=None):
         if self.project_id is None:
             raise Exception('Project ID is not set')
 
-        if eon:
-            engine = 'tflite-eon'
-        else:
-            engine = 'tflite'
-
-        if quantized:
-            model_type = 'int8'
-        else:
-            model_type = 'float32'
+        engine, model_type = deployment_type(eon, quantized)
 
         # Check if build is available first
-        if force_build or not self.build_available(engine, model_type):
+        deployment = self.get_deployment(engine, model_type)
+        if force_build or not deployment['hasDeployment']:
             logger.info("No build artefact found for project " + str(self.project_id) + ", will build library first.")
-            job_id = self.build_model(engine, model_type)
-            self.wait_for_job_completion(job_id)
+            if cache is not None:
+                cache.invalidate(self.project_id, engine, model_type)
+            with metrics.span("build", category="project", project_id=self.project_id):
+                job_id = self.build_model(engine, model_type)
+                self.wait_for_job_completion(job_id)
+            metrics.count("builds")
             logger.info('Build OK')
+            deployment = self.get_deployment(engine, model_type)
+
+        # The deployment version changes with every build, it is part of the cache key
+        version = deployment.get('version')
+        self.deployment_version = version
+        if cache is not None and version is None:
+            logger.warning("No deployment version reported for project " + str(self.project_id) + ", not using the cache")
+            cache = None
+        if cache is not None:
+            cached_path = cache.get(self.project_id, engine, model_type, version, out_directory)
+            if cached_path is not None:
+                metrics.count("cache_hits")
+                return cached_path
 
-        url = f"https://studio.edgeimpulse.com/v1/api/{self.project_id}/deployment/download"
         querystring = {
             "type": "zip",
             "modelType": model_type,
             "engine": engine
         }
-        headers = {
-            "x-api-key": self.api_key,
-            "Accept": "application/zip",
-            "Content-Type": "application/json",
-        }
-        response = requests.request("GET", url, headers=headers, params=querystring)
+        with metrics.span("download", category="project", project_id=self.project_id):
+            # Stream the archive to disk so memory use does not depend on the export size
+            response = self.client.request("GET", f"/{self.project_id}/deployment/download", self.api_key, accept="application/zip", params=querystring, stream=True)
+            if not response.ok:
+                raise Exception(f"Download failed for project {self.project_id}: HTTP {response.status_code} {response.text}")
+
+            d = response.headers['Content-Disposition']
+            fname = re.findall("filename\*?=(.+)", d)[0].replace('utf-8\'\'', '')
+            total_size = int(response.headers.get('Content-Length', 0))
+
+            downloaded = 0
+            start_time = time.time()
+            last_log_time = start_time
+            with open(os.path.join(out_directory, fname), 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if self.aborted():
+                        response.close()
+                        raise Exception(f"Aborted while downloading project {self.project_id}")
+                    f.write(chunk)
+                    downloaded += len(chunk)
 
-        d = response.headers['Content-Disposition']
-        fname = re.findall("filename\*?=(.+)", d)[0].replace('utf-8\'\'', '')
+                    now = time.time()
+                    if now - last_log_time >= DOWNLOAD_LOG_INTERVAL:
+                        last_log_time = now
+                        progress = f" ({100 * downloaded // total_size}%)" if total_size else ""
+                        logger.info(f"Project {self.project_id}: {downloaded} Bytes downloaded{progress}, {format_throughput(downloaded, now - start_time)}")
+            response.close()
+        metrics.count("bytes_downloaded", downloaded)
 
-        with open(os.path.join(out_directory, fname), 'wb') as f:
-            f.write(response.content)
-        logger.info('Export ZIP saved in: ' + os.path.join(out_directory, fname) + ' (' + str(len(response.content)) + ' Bytes)')
+        logger.info('Export ZIP saved in: ' + os.path.join(out_directory, fname) + ' (' + str(downloaded) + ' Bytes, ' + format_throughput(downloaded, time.time() - start_time) + ')')
+
+        if cache is not None:
+            cache.put(self.project_id, engine, model_type, version, os.path.join(out_directory, fname))
 
         return os.path.join(out_directory, fname)
 
-    def build_available(self, engine, model_type):
-        url = f"https://studio.edgeimpulse.com/v1/api/{self.project_id}/deployment"
+    def get_deployment(self, engine, model_type):
         querystring = {"type": "zip", "modelType": model_type, "engine": engine}
-        headers = {
-            "x-api-key": self.api_key,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
+        return self.client.request_json("GET", f"/{self.project_id}/deployment", self.api_key, params=querystring)
 
-        response = requests.request("GET", url, headers=headers, params=querystring)
-        body = json.loads(response.text)
-        if (not body['success']):
-            raise Exception(body['error'])
+    # Version of the current build, None if there is no build yet. Nothing is downloaded.
+    def get_deployment_version(self, eon=True, quantized=True):
+        deployment = self.get_deployment(*deployment_type(eon, quantized))
+        if not deployment['hasDeployment']:
+            return None
+        return deployment.get('version')
 
-        return body['hasDeployment']
+    def build_available(self, engine, model_type):
+        return self.get_deployment(engine, model_type)['hasDeployment']
 
 
     def build_model(self, engine, model_type):
-        url = f"https://studio.edgeimpulse.com/v1/api/{self.project_id}/jobs/build-ondevice-model"
         querystring = {"type": "zip"}
         payload = {"engine": engine, "modelType": model_type}
-        headers = {
-            "x-api-key": self.api_key,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
-        response = requests.request("POST", url, json=payload, headers=headers, params=querystring)
-        body = json.loads(response.text)
-        if (not body['success']):
-            raise Exception(body['error'])
+        body = self.client.request_json("POST", f"/{self.project_id}/jobs/build-ondevice-model", self.api_key, json=payload, params=querystring)
         return body['id']
 
-    def get_stdout(self, job_id, skip_line_no):
-        url = f"https://studio.edgeimpulse.com/v1/api/{self.project_id}/jobs/{job_id}/stdout"
-        headers = {
-            "x-api-key": self.api_key,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
-        response = requests.request("GET", url, headers=headers)
-        body = json.loads(response.text)
-        if (not body['success']):
-            raise Exception(body['error'])
-        stdout = body['stdout'][::-1] # reverse array so it's old -> new
-        return [ x['data'] for x in stdout[skip_line_no:] ]
+    def get_job_status(self, job_id):
+        body = self.client.request_json("GET", f"/{self.project_id}/jobs/{job_id}/status", self.api_key)
+        return body['job']
+
+    # Only fetch the lines logged after the first skip_line_no ones. seen_tail holds the last lines
+    # returned before (old -> new), it is the cursor when the API does not report the line count.
+    def get_stdout(self, job_id, skip_line_no, seen_tail = None):
+        path = f"/{self.project_id}/jobs/{job_id}/stdout"
+        body = self.client.request_json("GET", path, self.api_key, params={"limit": STDOUT_PAGE_SIZE})
+
+        if 'totalCount' not in body:
+            return self._get_stdout_without_count(path, body['stdout'], skip_line_no, seen_tail)
+
+        new_line_no = body['totalCount'] - skip_line_no
+        if new_line_no <= 0:
+            return []
+        if new_line_no > len(body['stdout']) and len(body['stdout']) >= STDOUT_PAGE_SIZE:
+            # More new lines than one page, fetch exactly the missing ones
+            body = self.client.request_json("GET", path, self.api_key, params={"limit": new_line_no})
+
+        stdout = body['stdout'][:new_line_no][::-1] # newest first, reverse so it's old -> new
+        return [ x['data'] for x in stdout ]
+
+    # Without line count, the newest page is used as is when it holds the whole log. Otherwise older
+    # pages are requested (offset) until the lines returned by the previous poll are found, so a poll
+    # costs one request as long as less than a page of lines was logged since the previous one.
+    # A sequence of STDOUT_CURSOR_LINES lines logged again right before a poll can hide the lines logged after it.
+    # After STDOUT_MAX_PAGES pages, or when the server ignores offset and returns the same page again,
+    # the lines fetched so far are taken as the whole log and the skip count is used instead.
+    def _get_stdout_without_count(self, path, page, skip_line_no, seen_tail):
+        lines = [ x['data'] for x in page ] # newest first
+        anchor = list(reversed(seen_tail)) if seen_tail and skip_line_no > 0 else None
+        pages = 1
+        # A short page is the start of the log, the line count is known
+        while len(page) >= STDOUT_PAGE_SIZE:
+            if anchor is not None:
+                for i in range(len(lines) - len(anchor) + 1):
+                    if lines[i:i + len(anchor)] == anchor:
+                        return lines[:i][::-1]
+            if pages >= STDOUT_MAX_PAGES:
+                break
+            next_page = self.client.request_json("GET", path, self.api_key, params={"limit": STDOUT_PAGE_SIZE, "offset": len(lines)})['stdout']
+            if next_page == page:
+                break
+            page = next_page
+            pages += 1
+            lines += [ x['data'] for x in page ]
+        return lines[:max(len(lines) - skip_line_no, 0)][::-1]
 
     def wait_for_job_completion(self, job_id):
-        skip_line_no = 0
+        poller = self.poller if self.poller is not None else JobPoller()
+        poller.wait(self, job_id)
 
-        url = f"https://studio.edgeimpulse.com/v1/api/{self.project_id}/jobs/{job_id}/status"
-        headers = {
-            "x-api-key": self.api_key,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
+class _PendingJob:
+
+    def __init__(self, downloader, job_id, interval):
+        self.downloader = downloader
+        self.job_id = job_id
+        self.interval = interval
+        self.next_poll = time.monotonic()
+        self.skip_line_no = 0
+        # Last lines logged by the job, cursor of get_stdout
+        self.stdout_tail = []
+        self.done = threading.Event()
+        self.error = None
+
+# Waits for build jobs of any number of projects from a single polling thread.
+# Each job is polled with an adaptive interval: it goes back to poll_interval when
+# the job logged new lines and grows by backoff (up to max_poll_interval) otherwise.
+# Setting abort_event (or the abort_event of a downloader) stops waiting for the jobs
+# within ABORT_CHECK_INTERVAL, not at their next poll.
+class JobPoller:
+
+    def __init__(self, poll_interval = 1.0, max_poll_interval = 30.0, backoff = 1.5, jitter = 0.2, abort_event = None):
+        self.abort_event = abort_event
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(poll_interval, max_poll_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self._jobs = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # Block until the job is finished, raise if it failed
+    def wait(self, downloader, job_id):
+        job = _PendingJob(downloader, job_id, self.poll_interval)
+        with self._cond:
+            self._jobs.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="JobPoller", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+        # The polling thread may be blocked in a request, the abort is also checked here
+        while not job.done.wait(ABORT_CHECK_INTERVAL):
+            if self._aborted(job):
+                raise Exception('Aborted while waiting for job ' + str(job_id))
+        if job.error is not None:
+            raise job.error
+
+    def _aborted(self, job):
+        return (self.abort_event is not None and self.abort_event.is_set()) or job.downloader.aborted()
+
+    def _run(self):
         while True:
-            response = requests.request("GET", url, headers=headers)
-            body = json.loads(response.text)
-            if (not body['success']):
-                raise Exception(body['error'])
+            with self._cond:
+                if not self._jobs:
+                    self._thread = None
+                    return
+                for job in self._jobs:
+                    if self._aborted(job):
+                        job.error = Exception('Aborted while waiting for job ' + str(job.job_id))
+                        job.done.set()
+                self._jobs = [job for job in self._jobs if not job.done.is_set()]
+                if not self._jobs:
+                    continue
+                now = time.monotonic()
+                due = [job for job in self._jobs if job.next_poll <= now]
+                if not due:
+                    # Sleep until the next job is due, a new job is registered or the abort is checked again
+                    self._cond.wait(min(min(job.next_poll for job in self._jobs) - now, ABORT_CHECK_INTERVAL))
+                    continue
+
+            for job in due:
+                self._poll(job)
+
+            with self._cond:
+                self._jobs = [job for job in self._jobs if not job.done.is_set()]
+
+    def _poll(self, job):
+        downloader = job.downloader
+        project_id = downloader.project_id
+        try:
+            if self._aborted(job):
+                raise Exception('Aborted while waiting for job ' + str(job.job_id))
 
-            stdout = self.get_stdout(job_id, skip_line_no)
+            status = downloader.get_job_status(job.job_id)
+
+            stdout = downloader.get_stdout(job.job_id, job.skip_line_no, job.stdout_tail)
             for l in stdout:
-                logger.info(l)
-            skip_line_no = skip_line_no + len(stdout)
-
-            if (not 'finished' in body['job']):
-                logger.info('Still building...')
-                time.sleep(1)
-                continue
-            if (not body['job']['finishedSuccessful']):
-                logger.error(f"Job did not finish successfully. Response: {response.text}")
-                raise Exception('Job failed')
-            else:
-                break
+                logger.info(f"[{project_id}] {l}")
+            job.skip_line_no = job.skip_line_no + len(stdout)
+            job.stdout_tail = (job.stdout_tail + stdout)[-STDOUT_CURSOR_LINES:]
 
+            if ('finished' in status):
+                if (not status['finishedSuccessful']):
+                    logger.error(f"Job did not finish successfully. Response: {json.dumps(status)}")
+                    raise Exception('Job failed')
+                job.done.set()
+                return
+
+            if stdout:
+                job.interval = self.poll_interval
+            else:
+                logger.info(f"[{project_id}] Still building...")
+                job.interval = min(job.interval * self.backoff, self.max_poll_interval)
+            job.next_poll = time.monotonic() + job.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
 
+        except Exception as e:
+            job.error = e
+            job.done.set()
@@ -0,0 +1,170 @@
+import os, json, time, hashlib, threading, tempfile
+from contextlib import contextmanager
+import logging
+from utils import sha256_file, link_or_copy
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+logging.basicConfig()
+
+logger = logging.getLogger("ExportCache")
+logger.setLevel(logging.INFO)
+
+# Persistent on-disk cache of SDK exports.
+# Archives are stored once by content hash in blobs/, and index/ maps each
+# (project ID, engine, model type, deployment version) key to a blob.
+# The cache can be shared by several processes, every access holds the lock file of the
+# cache directory so that no process removes a blob another one is adding or reading.
+class ExportCache:
+
+    def __init__(self, cache_dir, max_size = None):
+        self.cache_dir = cache_dir
+        # Maximum total size of the blobs in bytes, None for no limit
+        self.max_size = max_size
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.index_dir = os.path.join(cache_dir, "index")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.lock_path = os.path.join(cache_dir, "lock")
+        self._lock = threading.Lock()
+        # Apply the size limit right away, it may have been lowered since the last run
+        with self._locked():
+            self._evict()
+
+    # Lock of the threads of this process and of the other processes using the cache
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            with open(self.lock_path, 'a+') as file:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        file.seek(0)
+                        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _entry_path(self, project_id, engine, model_type, version):
+        key = json.dumps([str(project_id), engine, model_type, str(version)])
+        return os.path.join(self.index_dir, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest + ".zip")
+
+    def _read_entries(self):
+        entries = []
+        for f in os.listdir(self.index_dir):
+            if not f.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.index_dir, f), 'r') as file:
+                    entries.append((os.path.join(self.index_dir, f), json.load(file)))
+            except (OSError, ValueError):
+                # Entry removed or being written by another process
+                continue
+        return entries
+
+    def _write_entry(self, entry_path, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, entry_path)
+
+    # Return the path of a copy of the cached export in out_directory, None on cache miss
+    def get(self, project_id, engine, model_type, version, out_directory):
+        entry_path = self._entry_path(project_id, engine, model_type, version)
+        with self._locked():
+            if not os.path.exists(entry_path):
+                return None
+            with open(entry_path, 'r') as file:
+                entry = json.load(file)
+
+            blob_path = self._blob_path(entry['sha256'])
+            if not os.path.exists(blob_path) or sha256_file(blob_path) != entry['sha256']:
+                logger.warning(f"Corrupted cache entry for project {project_id}, discarding it")
+                os.remove(entry_path)
+                if os.path.exists(blob_path):
+                    os.remove(blob_path)
+                return None
+
+            entry['last_used'] = time.time()
+            self._write_entry(entry_path, entry)
+
+            # Under the lock, the blob cannot be evicted while it is copied
+            out_path = os.path.join(out_directory, entry['filename'])
+            link_or_copy(blob_path, out_path)
+        logger.info(f"Cache hit for project {project_id} ({engine}, {model_type}, version {version})")
+        return out_path
+
+    # Store a downloaded export, the file itself is left in place
+    def put(self, project_id, engine, model_type, version, zip_path):
+        digest = sha256_file(zip_path)
+        blob_path = self._blob_path(digest)
+        with self._locked():
+            if not os.path.exists(blob_path):
+                fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".tmp")
+                os.close(fd)
+                os.remove(tmp_path)
+                link_or_copy(zip_path, tmp_path)
+                os.replace(tmp_path, blob_path)
+
+            entry = {
+                "project_id": str(project_id),
+                "engine": engine,
+                "model_type": model_type,
+                "version": str(version),
+                "filename": os.path.basename(zip_path),
+                "sha256": digest,
+                "size": os.path.getsize(blob_path),
+                "last_used": time.time(),
+            }
+            self._write_entry(self._entry_path(project_id, engine, model_type, version), entry)
+            self._evict()
+
+        logger.info(f"Export of project {project_id} added to cache ({entry['size']} Bytes)")
+
+    # Drop every cached version of a project build, used when a rebuild is forced
+    def invalidate(self, project_id, engine, model_type):
+        with self._locked():
+            for entry_path, entry in self._read_entries():
+                if entry['project_id'] == str(project_id) and entry['engine'] == engine and entry['model_type'] == model_type:
+                    os.remove(entry_path)
+            self._remove_unused_blobs()
+
+    # Remove least recently used entries until the blobs fit in max_size, with the lock held
+    def _evict(self):
+        if self.max_size is None:
+            return
+
+        entries = sorted(self._read_entries(), key=lambda e: e[1]['last_used'])
+        blob_sizes = {}
+        for _, entry in entries:
+            blob_sizes[entry['sha256']] = entry['size']
+        total_size = sum(blob_sizes.values())
+
+        # Always keep the most recent entry, even if it is bigger than max_size
+        while total_size > self.max_size and len(entries) > 1:
+            entry_path, entry = entries.pop(0)
+            os.remove(entry_path)
+            if not any(e['sha256'] == entry['sha256'] for _, e in entries):
+                total_size -= blob_sizes[entry['sha256']]
+            logger.info(f"Evicted project {entry['project_id']} version {entry['version']} from cache")
+
+        self._remove_unused_blobs()
+
+    def _remove_unused_blobs(self):
+        used = set(entry['sha256'] for _, entry in self._read_entries())
+        for f in os.listdir(self.blob_dir):
+            if f.endswith(".zip") and f[:-len(".zip")] not in used:
+                os.remove(os.path.join(self.blob_dir, f))
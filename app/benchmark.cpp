@@ -0,0 +1,189 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <math.h>
+#include <chrono>
+#include <string>
+#include <vector>
+#include <algorithm>
+
+#include "edge-impulse-sdk/classifier/ei_run_classifier.h"
+#include "multi_impulse.h"
+#include "heap_tracker.h"
+
+// Benchmark of the merged impulses: each iteration runs every impulse once on its example
+// features. Usage: ./app [--warmup N] [--iterations N] [--format csv|json] [--output FILE]
+
+// benchmark settings inserted here
+
+// raw features array inserted here
+
+// impulse table inserted here
+
+// Latencies in microseconds of one metric over all measured iterations
+typedef struct {
+    int64_t p50, p95, p99, min, max;
+    double mean;
+} latency_stats_t;
+
+static latency_stats_t compute_stats(std::vector<int64_t> values) {
+    latency_stats_t stats = { 0, 0, 0, 0, 0, 0.0 };
+    if (values.empty()) {
+        return stats;
+    }
+    std::sort(values.begin(), values.end());
+    // Nearest-rank percentile
+    auto percentile = [&values](double p) {
+        size_t rank = (size_t)ceil(p / 100.0 * values.size());
+        return values[rank > 0 ? rank - 1 : 0];
+    };
+    stats.p50 = percentile(50);
+    stats.p95 = percentile(95);
+    stats.p99 = percentile(99);
+    stats.min = values.front();
+    stats.max = values.back();
+    double sum = 0;
+    for (int64_t v : values) {
+        sum += v;
+    }
+    stats.mean = sum / values.size();
+    return stats;
+}
+
+#define METRIC_COUNT 4
+static const char *metric_names[METRIC_COUNT] = { "dsp", "inference", "anomaly", "total" };
+
+typedef struct {
+    std::string name;           // project ID, or "all" for all impulses of an iteration
+    std::vector<int64_t> samples[METRIC_COUNT];
+    size_t heap_peak;           // Bytes allocated by the SDK while the impulse runs
+    int errors;
+} impulse_stats_t;
+
+static void write_csv(FILE *out, std::vector<impulse_stats_t> &all_stats, int iterations) {
+    fprintf(out, "impulse,iterations");
+    for (int m = 0; m < METRIC_COUNT; m++) {
+        fprintf(out, ",%s_p50_us,%s_p95_us,%s_p99_us,%s_mean_us", metric_names[m], metric_names[m], metric_names[m], metric_names[m]);
+    }
+    fprintf(out, ",heap_peak_bytes,errors\n");
+    for (impulse_stats_t &s : all_stats) {
+        fprintf(out, "%s,%d", s.name.c_str(), iterations);
+        for (int m = 0; m < METRIC_COUNT; m++) {
+            latency_stats_t l = compute_stats(s.samples[m]);
+            fprintf(out, ",%lld,%lld,%lld,%.1f", (long long)l.p50, (long long)l.p95, (long long)l.p99, l.mean);
+        }
+        fprintf(out, ",%zu,%d\n", s.heap_peak, s.errors);
+    }
+}
+
+static void write_json(FILE *out, std::vector<impulse_stats_t> &all_stats, int iterations, int warmup) {
+    fprintf(out, "{\n  \"warmup\": %d,\n  \"iterations\": %d,\n  \"impulses\": [\n", warmup, iterations);
+    for (size_t i = 0; i < all_stats.size(); i++) {
+        impulse_stats_t &s = all_stats[i];
+        fprintf(out, "    { \"impulse\": \"%s\", \"heap_peak_bytes\": %zu, \"errors\": %d", s.name.c_str(), s.heap_peak, s.errors);
+        for (int m = 0; m < METRIC_COUNT; m++) {
+            latency_stats_t l = compute_stats(s.samples[m]);
+            fprintf(out, ",\n      \"%s_us\": { \"p50\": %lld, \"p95\": %lld, \"p99\": %lld, \"mean\": %.1f, \"min\": %lld, \"max\": %lld }",
+                    metric_names[m], (long long)l.p50, (long long)l.p95, (long long)l.p99, l.mean, (long long)l.min, (long long)l.max);
+        }
+        fprintf(out, " }%s\n", i + 1 < all_stats.size() ? "," : "");
+    }
+    fprintf(out, "  ]\n}\n");
+}
+
+int main(int argc, char **argv) {
+    int warmup = BENCH_WARMUP;
+    int iterations = BENCH_ITERATIONS;
+    const char *format = "csv";
+    const char *output = NULL;
+
+    for (int i = 1; i < argc; i++) {
+        if (strcmp(argv[i], "--warmup") == 0 && i + 1 < argc) {
+            warmup = atoi(argv[++i]);
+        } else if (strcmp(argv[i], "--iterations") == 0 && i + 1 < argc) {
+            iterations = atoi(argv[++i]);
+        } else if (strcmp(argv[i], "--format") == 0 && i + 1 < argc) {
+            format = argv[++i];
+        } else if (strcmp(argv[i], "--output") == 0 && i + 1 < argc) {
+            output = argv[++i];
+        } else {
+            fprintf(stderr, "Usage: %s [--warmup N] [--iterations N] [--format csv|json] [--output FILE]\n", argv[0]);
+            return 1;
+        }
+    }
+
+    std::vector<std::vector<float>> windows;
+    std::vector<impulse_stats_t> all_stats(multi_impulses_count + 1);
+    for (size_t i = 0; i < multi_impulses_count; i++) {
+        windows.push_back(multi_impulse_example_window(&multi_impulses[i]));
+        all_stats[i].name = std::to_string(multi_impulses[i].project_id);
+        all_stats[i].heap_peak = 0;
+        all_stats[i].errors = 0;
+    }
+    impulse_stats_t &total_stats = all_stats[multi_impulses_count];
+    total_stats.name = "all";
+    total_stats.heap_peak = 0;
+    total_stats.errors = 0;
+
+    for (int it = 0; it < warmup + iterations; it++) {
+        bool measured = it >= warmup;
+        int64_t iteration_us[METRIC_COUNT] = { 0, 0, 0, 0 };
+
+        for (size_t i = 0; i < multi_impulses_count; i++) {
+            ei_impulse_result_t result;
+            memset(&result, 0, sizeof(result));
+            size_t heap_base = heap_tracker_get_current();
+            heap_tracker_reset_peak();
+
+            auto start = std::chrono::steady_clock::now();
+            EI_IMPULSE_ERROR res = run_multi_impulse(&multi_impulses[i], windows[i].data(), &result);
+            auto end = std::chrono::steady_clock::now();
+
+            if (!measured) {
+                continue;
+            }
+            impulse_stats_t &s = all_stats[i];
+            int64_t us[METRIC_COUNT] = {
+                result.timing.dsp_us,
+                result.timing.classification_us,
+                result.timing.anomaly_us,
+                std::chrono::duration_cast<std::chrono::microseconds>(end - start).count()
+            };
+            for (int m = 0; m < METRIC_COUNT; m++) {
+                s.samples[m].push_back(us[m]);
+                iteration_us[m] += us[m];
+            }
+            s.heap_peak = std::max(s.heap_peak, heap_tracker_get_peak() - heap_base);
+            total_stats.heap_peak = std::max(total_stats.heap_peak, heap_tracker_get_peak());
+            if (res != EI_IMPULSE_OK) {
+                s.errors++;
+                total_stats.errors++;
+            }
+        }
+        if (measured) {
+            for (int m = 0; m < METRIC_COUNT; m++) {
+                total_stats.samples[m].push_back(iteration_us[m]);
+            }
+        }
+    }
+
+    FILE *out = stdout;
+    if (output != NULL) {
+        out = fopen(output, "w");
+        if (out == NULL) {
+            fprintf(stderr, "Cannot open %s\n", output);
+            return 1;
+        }
+    }
+    if (strcmp(format, "json") == 0) {
+        write_json(out, all_stats, iterations, warmup);
+    } else {
+        write_csv(out, all_stats, iterations);
+    }
+    if (out != stdout) {
+        fclose(out);
+    }
+
+    return total_stats.errors == 0 ? 0 : 1;
+}
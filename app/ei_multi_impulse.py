@@ -0,0 +1,132 @@
+import os, sys, ctypes
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+# NumPy is optional: without it, features are given as array('f') or lists and results are lists
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Python bindings of the merged impulses, loads the shared library built with `make lib`.
+#
+#   from ei_multi_impulse import MultiImpulse
+#   impulses = MultiImpulse()
+#   impulses.run(111, window)                     # {"scores": {label: value}, "anomaly": value}
+#   impulses.run_batch(111, windows)              # scores of every window
+#   impulses.run_many({111: w1, 222: w2}, threads=2)
+#
+# Float32 C-contiguous NumPy arrays and array('f') buffers are passed to the library in place,
+# without copy. The library releases the GIL while it runs, one impulse runs on one thread at a
+# time but different impulses run in parallel in run_many().
+
+LIB_NAME = 'libei_multi_impulse.dylib' if sys.platform == 'darwin' else 'libei_multi_impulse.so'
+DEFAULT_LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'build', 'lib', LIB_NAME)
+
+_float_p = ctypes.POINTER(ctypes.c_float)
+_int_p = ctypes.POINTER(ctypes.c_int)
+
+class ImpulseError(Exception):
+    pass
+
+class Impulse:
+
+    def __init__(self, index, project_id, deploy_version, input_size, labels, has_anomaly):
+        self.index = index
+        self.project_id = project_id
+        self.deploy_version = deploy_version
+        self.input_size = input_size
+        self.labels = labels
+        self.has_anomaly = has_anomaly
+
+    def __repr__(self):
+        return f"Impulse(project_id={self.project_id}, input_size={self.input_size}, labels={self.labels})"
+
+class MultiImpulse:
+
+    # path of the shared library, default: $EI_MULTI_IMPULSE_LIB or build/lib of the deployment
+    def __init__(self, path = None):
+        path = path or os.environ.get('EI_MULTI_IMPULSE_LIB') or DEFAULT_LIB_PATH
+        self.lib = ctypes.CDLL(path)
+        self.lib.ei_bridge_impulse_count.restype = ctypes.c_size_t
+        self.lib.ei_bridge_impulse_info.argtypes = [ctypes.c_size_t, ctypes.POINTER(ctypes.c_uint32), ctypes.POINTER(ctypes.c_uint32),
+                                                    ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_size_t), _int_p]
+        self.lib.ei_bridge_label.argtypes = [ctypes.c_size_t, ctypes.c_size_t]
+        self.lib.ei_bridge_label.restype = ctypes.c_char_p
+        self.lib.ei_bridge_run_batch.argtypes = [ctypes.c_size_t, _float_p, ctypes.c_size_t, ctypes.c_size_t, _float_p, _float_p, _int_p]
+
+        self.impulses = {}
+        for i in range(self.lib.ei_bridge_impulse_count()):
+            project_id, deploy_version = ctypes.c_uint32(), ctypes.c_uint32()
+            input_size, label_count, has_anomaly = ctypes.c_size_t(), ctypes.c_size_t(), ctypes.c_int()
+            self.lib.ei_bridge_impulse_info(i, ctypes.byref(project_id), ctypes.byref(deploy_version), ctypes.byref(input_size),
+                                            ctypes.byref(label_count), ctypes.byref(has_anomaly))
+            labels = [self.lib.ei_bridge_label(i, l).decode() for l in range(label_count.value)]
+            self.impulses[project_id.value] = Impulse(i, project_id.value, deploy_version.value, input_size.value, labels, bool(has_anomaly.value))
+
+    def impulse(self, project_id):
+        impulse = self.impulses.get(int(project_id))
+        if impulse is None:
+            raise(ImpulseError(f"Unknown project {project_id}, the merged projects are {', '.join(str(p) for p in self.impulses)}"))
+        return impulse
+
+    # Features as a float32 buffer: (pointer, number of values, object keeping the buffer alive)
+    def _buffer(self, features):
+        if np is not None and isinstance(features, np.ndarray):
+            features = np.ascontiguousarray(features, dtype=np.float32)
+            return features.ctypes.data_as(_float_p), features.size, features
+        if not (isinstance(features, array) and features.typecode == 'f'):
+            features = array('f', features)
+        if len(features) == 0:
+            return None, 0, features
+        address, length = features.buffer_info()
+        return ctypes.cast(address, _float_p), length, features
+
+    # Run an impulse on windows of impulse.input_size values. features holds count windows one after
+    # another, or with stride the windows start every stride values (stride < input_size for
+    # overlapping windows). Returns the scores (count x labels), the anomaly score and the error of
+    # each window, as NumPy arrays when NumPy is installed, as lists otherwise.
+    def run_batch(self, project_id, features, stride = None, raise_on_error = True):
+        impulse = self.impulse(project_id)
+        # keep holds the buffer until the library returns
+        pointer, size, keep = self._buffer(features)
+        stride = stride or impulse.input_size
+        count = 0 if size < impulse.input_size else (size - impulse.input_size) // stride + 1
+
+        label_count = len(impulse.labels)
+        if np is not None:
+            scores = np.zeros((count, label_count), dtype=np.float32)
+            anomaly = np.zeros(count, dtype=np.float32)
+            errors = np.zeros(count, dtype=np.intc)
+            scores_p, anomaly_p, errors_p = scores.ctypes.data_as(_float_p), anomaly.ctypes.data_as(_float_p), errors.ctypes.data_as(_int_p)
+        else:
+            scores = (ctypes.c_float * (count * label_count))()
+            anomaly = (ctypes.c_float * count)()
+            errors = (ctypes.c_int * count)()
+            scores_p, anomaly_p, errors_p = scores, anomaly, errors
+
+        if count > 0:
+            failed = self.lib.ei_bridge_run_batch(impulse.index, pointer, count, stride, scores_p, anomaly_p, errors_p)
+            if failed and raise_on_error:
+                raise(ImpulseError(f"Project {impulse.project_id}: {failed} of {count} windows failed (first error {[e for e in errors if e != 0][0]})"))
+
+        if np is None:
+            scores = [list(scores[i * label_count:(i + 1) * label_count]) for i in range(count)]
+            anomaly, errors = list(anomaly), list(errors)
+        return {"labels": impulse.labels, "scores": scores, "anomaly": anomaly, "errors": errors}
+
+    # Run an impulse on one window, returns the score of each label and the anomaly score
+    def run(self, project_id, features):
+        impulse = self.impulse(project_id)
+        if len(features) != impulse.input_size:
+            raise(ImpulseError(f"Project {impulse.project_id} expects {impulse.input_size} values, got {len(features)}"))
+        batch = self.run_batch(project_id, features)
+        return {"scores": {label: float(value) for label, value in zip(impulse.labels, batch["scores"][0])},
+                "anomaly": float(batch["anomaly"][0])}
+
+    # Run the windows of several impulses, {project ID: features}, on a pool of threads.
+    # Returns {project ID: result of run_batch}
+    def run_many(self, features_by_project, threads = None, stride = None):
+        with ThreadPoolExecutor(max_workers = threads or len(features_by_project) or 1) as executor:
+            futures = {p: executor.submit(self.run_batch, p, features, stride) for p, features in features_by_project.items()}
+            return {p: future.result() for p, future in futures.items()}
@@ -0,0 +1,73 @@
+#ifndef HEAP_TRACKER_H
+#define HEAP_TRACKER_H
+
+#include <stdlib.h>
+#include <atomic>
+
+// Heap used by the SDK (tensor arenas, DSP buffers), measured by overriding the weak
+// ei_malloc/ei_calloc/ei_free of the SDK porting layer. Build with -DEI_APP_TRACK_HEAP=0
+// if the porting layer of your target defines them as strong symbols.
+#ifndef EI_APP_TRACK_HEAP
+#define EI_APP_TRACK_HEAP 1
+#endif
+
+// Size header in front of each block, 16 Bytes to keep the alignment of malloc
+#define HEAP_TRACKER_HEADER 16
+
+static std::atomic<size_t> heap_tracker_current(0);
+static std::atomic<size_t> heap_tracker_peak(0);
+
+static inline void heap_tracker_add(size_t size) {
+    size_t current = heap_tracker_current.fetch_add(size) + size;
+    size_t peak = heap_tracker_peak.load();
+    while (current > peak && !heap_tracker_peak.compare_exchange_weak(peak, current)) {
+    }
+}
+
+// Start a new measurement, the peak is counted from the current usage
+static inline void heap_tracker_reset_peak(void) {
+    heap_tracker_peak.store(heap_tracker_current.load());
+}
+
+static inline size_t heap_tracker_get_current(void) {
+    return heap_tracker_current.load();
+}
+
+static inline size_t heap_tracker_get_peak(void) {
+    return heap_tracker_peak.load();
+}
+
+#if EI_APP_TRACK_HEAP
+
+void *ei_malloc(size_t size) {
+    char *block = (char *)malloc(size + HEAP_TRACKER_HEADER);
+    if (block == NULL) {
+        return NULL;
+    }
+    *(size_t *)block = size;
+    heap_tracker_add(size);
+    return block + HEAP_TRACKER_HEADER;
+}
+
+void *ei_calloc(size_t nitems, size_t size) {
+    char *block = (char *)calloc(nitems * size + HEAP_TRACKER_HEADER, 1);
+    if (block == NULL) {
+        return NULL;
+    }
+    *(size_t *)block = nitems * size;
+    heap_tracker_add(nitems * size);
+    return block + HEAP_TRACKER_HEADER;
+}
+
+void ei_free(void *ptr) {
+    if (ptr == NULL) {
+        return;
+    }
+    char *block = (char *)ptr - HEAP_TRACKER_HEADER;
+    heap_tracker_current.fetch_sub(*(size_t *)block);
+    free(block);
+}
+
+#endif // EI_APP_TRACK_HEAP
+
+#endif // HEAP_TRACKER_H
@@ -0,0 +1,239 @@
+#ifndef INPUT_STREAM_H
+#define INPUT_STREAM_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <string>
+#include <vector>
+
+#ifndef _WIN32
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#endif
+
+// Sources of input windows for the impulses. A window is frame_size consecutive float values.
+// Binary inputs are little-endian float32 values, CSV inputs are values separated by commas,
+// spaces or new lines (line breaks do not have to match windows).
+class window_source_t {
+public:
+    window_source_t(size_t frame_size) : frame_size(frame_size), round(-1), current(NULL) {}
+    virtual ~window_source_t() {}
+
+    // Window of a processing round, read once and shared by all impulses using this source.
+    // NULL once the input is exhausted. The pointer stays valid until the next round.
+    const float *window_for_round(long r) {
+        if (r != round) {
+            round = r;
+            current = next();
+        }
+        return current;
+    }
+
+    // True if the window of a round is overwritten by the next one, it has to be copied to be kept longer
+    virtual bool reuses_buffer() const {
+        return false;
+    }
+
+    const size_t frame_size;
+
+protected:
+    virtual const float *next() = 0;
+
+private:
+    long round;
+    const float *current;
+};
+
+// Windows of a buffer held in memory (parsed CSV file, example features)
+class memory_source_t : public window_source_t {
+public:
+    memory_source_t(size_t frame_size, std::vector<float> values) : window_source_t(frame_size), values(values), offset(0) {}
+
+protected:
+    const float *next() override {
+        if (offset + frame_size > values.size()) {
+            return NULL;
+        }
+        const float *window = values.data() + offset;
+        offset += frame_size;
+        return window;
+    }
+
+private:
+    std::vector<float> values;
+    size_t offset;
+};
+
+// Windows of a binary file, memory-mapped on POSIX systems so windows point straight into
+// the page cache without any copy. Read in memory with fread on Windows.
+class binary_file_source_t : public window_source_t {
+public:
+    binary_file_source_t(size_t frame_size, const char *path) : window_source_t(frame_size), data(NULL), count(0), offset(0), mapped_size(0) {
+#ifndef _WIN32
+        int fd = open(path, O_RDONLY);
+        if (fd < 0) {
+            return;
+        }
+        struct stat st;
+        if (fstat(fd, &st) == 0 && st.st_size > 0) {
+            void *map = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+            if (map != MAP_FAILED) {
+                madvise(map, st.st_size, MADV_SEQUENTIAL);
+                data = (const float *)map;
+                mapped_size = st.st_size;
+                count = st.st_size / sizeof(float);
+            }
+        }
+        close(fd);
+#else
+        FILE *file = fopen(path, "rb");
+        if (file == NULL) {
+            return;
+        }
+        float buf[4096];
+        size_t n;
+        while ((n = fread(buf, sizeof(float), 4096, file)) > 0) {
+            buffer.insert(buffer.end(), buf, buf + n);
+        }
+        fclose(file);
+        data = buffer.data();
+        count = buffer.size();
+#endif
+    }
+
+    ~binary_file_source_t() {
+#ifndef _WIN32
+        if (mapped_size > 0) {
+            munmap((void *)data, mapped_size);
+        }
+#endif
+    }
+
+    bool ok() const {
+        return data != NULL;
+    }
+
+protected:
+    const float *next() override {
+        if (offset + frame_size > count) {
+            return NULL;
+        }
+        const float *window = data + offset;
+        offset += frame_size;
+        return window;
+    }
+
+private:
+    const float *data;
+    size_t count;
+    size_t offset;
+    size_t mapped_size;
+    std::vector<float> buffer;
+};
+
+// Windows read one at a time from a stream (stdin), binary or CSV
+class stream_source_t : public window_source_t {
+public:
+    stream_source_t(size_t frame_size, FILE *file, bool csv) : window_source_t(frame_size), file(file), csv(csv), window(frame_size) {}
+
+    bool reuses_buffer() const override {
+        return true;
+    }
+
+protected:
+    const float *next() override {
+        if (!csv) {
+            return fread(window.data(), sizeof(float), frame_size, file) == frame_size ? window.data() : NULL;
+        }
+        for (size_t i = 0; i < frame_size; i++) {
+            if (!read_csv_value(&window[i])) {
+                return NULL;
+            }
+        }
+        return window.data();
+    }
+
+private:
+    bool read_csv_value(float *value) {
+        int c;
+        std::string token;
+        while ((c = fgetc(file)) != EOF) {
+            if (c == ',' || c == ' ' || c == '\t' || c == '\r' || c == '\n') {
+                if (!token.empty()) {
+                    break;
+                }
+                continue;
+            }
+            token += (char)c;
+        }
+        if (token.empty()) {
+            return false;
+        }
+        *value = strtof(token.c_str(), NULL);
+        return true;
+    }
+
+    FILE *file;
+    bool csv;
+    std::vector<float> window;
+};
+
+// Parse all values of a CSV file, false if it cannot be read
+static inline bool read_csv_file(const char *path, std::vector<float> &values) {
+    FILE *file = fopen(path, "r");
+    if (file == NULL) {
+        return false;
+    }
+    char buf[64];
+    size_t len = 0;
+    int c;
+    do {
+        c = fgetc(file);
+        if (c == ',' || c == ' ' || c == '\t' || c == '\r' || c == '\n' || c == EOF) {
+            if (len > 0) {
+                buf[len] = 0;
+                values.push_back(strtof(buf, NULL));
+                len = 0;
+            }
+        } else if (len < sizeof(buf) - 1) {
+            buf[len++] = (char)c;
+        }
+    } while (c != EOF);
+    fclose(file);
+    return true;
+}
+
+static inline bool is_csv_path(const std::string &path) {
+    size_t dot = path.rfind('.');
+    if (dot == std::string::npos) {
+        return false;
+    }
+    std::string ext = path.substr(dot);
+    return ext == ".csv" || ext == ".txt";
+}
+
+// Open a window source for a path: "-" for stdin, *.csv/*.txt for CSV files, binary float32 otherwise.
+// Returns NULL if the file cannot be read.
+static inline window_source_t *open_window_source(const std::string &path, size_t frame_size, bool stdin_csv) {
+    if (path == "-") {
+        return new stream_source_t(frame_size, stdin, stdin_csv);
+    }
+    if (is_csv_path(path)) {
+        std::vector<float> values;
+        if (!read_csv_file(path.c_str(), values)) {
+            return NULL;
+        }
+        return new memory_source_t(frame_size, values);
+    }
+    binary_file_source_t *source = new binary_file_source_t(frame_size, path.c_str());
+    if (!source->ok()) {
+        delete source;
+        return NULL;
+    }
+    return source;
+}
+
+#endif // INPUT_STREAM_H
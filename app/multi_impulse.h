@@ -0,0 +1,48 @@
+#ifndef MULTI_IMPULSE_H
+#define MULTI_IMPULSE_H
+
+#include <stdint.h>
+#include <string.h>
+#include <vector>
+
+#include "edge-impulse-sdk/classifier/ei_run_classifier.h"
+
+// One of the merged impulses, the table of all impulses is generated in main.cpp
+typedef struct {
+    uint32_t project_id;
+    ei_impulse_handle_t *handle;
+    const ei_impulse_t *impulse;
+    const float *features;      // example features of the project
+    size_t features_size;       // may be shorter than the input frame, the rest is zeros
+    int dsp_group;              // impulses of a same group (>= 0) have identical DSP blocks, see shared_dsp.h
+} multi_impulse_t;
+
+extern multi_impulse_t multi_impulses[];
+extern const size_t multi_impulses_count;
+
+// Window read by the signal callback. One per thread, so impulses can run concurrently.
+static thread_local const float *multi_impulse_window = nullptr;
+
+static inline int multi_impulse_get_data(size_t offset, size_t length, float *out_ptr) {
+    memcpy(out_ptr, multi_impulse_window + offset, length * sizeof(float));
+    return EIDSP_OK;
+}
+
+// Run an impulse on a window of impulse->dsp_input_frame_size values, the window is not copied
+static inline EI_IMPULSE_ERROR run_multi_impulse(const multi_impulse_t *mi, const float *window, ei_impulse_result_t *result) {
+    signal_t signal;
+    signal.total_length = mi->impulse->dsp_input_frame_size;
+    signal.get_data = &multi_impulse_get_data;
+    multi_impulse_window = window;
+    return process_impulse(mi->handle, &signal, result, false);
+}
+
+// Input frame of an impulse filled with its example features
+static inline std::vector<float> multi_impulse_example_window(const multi_impulse_t *mi) {
+    std::vector<float> window(mi->impulse->dsp_input_frame_size, 0.0f);
+    size_t size = mi->features_size < window.size() ? mi->features_size : window.size();
+    memcpy(window.data(), mi->features, size * sizeof(float));
+    return window;
+}
+
+#endif // MULTI_IMPULSE_H
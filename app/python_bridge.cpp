@@ -0,0 +1,106 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <mutex>
+
+// bridge settings inserted here
+
+#include "edge-impulse-sdk/classifier/ei_run_classifier.h"
+#include "multi_impulse.h"
+
+// C API of the merged impulses, built as a shared library with `make lib` and loaded by
+// python/ei_multi_impulse.py (ctypes). Windows are read in place from the caller's buffers,
+// the signal callback copies each requested slice straight from them.
+// An impulse runs on one thread at a time (one lock per impulse), different impulses can run
+// concurrently. With EI_BRIDGE_GLOBAL_LOCK, all impulses share one lock: the tflite engine and
+// the shared tensor arena (--shared-arena) keep state common to all models.
+
+#ifndef EI_BRIDGE_GLOBAL_LOCK
+#define EI_BRIDGE_GLOBAL_LOCK 0
+#endif
+
+// raw features array inserted here
+
+// impulse table inserted here
+
+static std::mutex bridge_locks[sizeof(multi_impulses) / sizeof(multi_impulses[0])];
+
+static std::mutex &bridge_lock(size_t index) {
+    return bridge_locks[EI_BRIDGE_GLOBAL_LOCK ? 0 : index];
+}
+
+#if defined(_WIN32)
+#define EI_BRIDGE_EXPORT extern "C" __declspec(dllexport)
+#else
+#define EI_BRIDGE_EXPORT extern "C" __attribute__((visibility("default")))
+#endif
+
+EI_BRIDGE_EXPORT size_t ei_bridge_impulse_count(void) {
+    return multi_impulses_count;
+}
+
+// Description of an impulse, returns -1 if index is out of range
+EI_BRIDGE_EXPORT int ei_bridge_impulse_info(size_t index, uint32_t *project_id, uint32_t *deploy_version,
+                                            size_t *input_size, size_t *label_count, int *has_anomaly) {
+    if (index >= multi_impulses_count) {
+        return -1;
+    }
+    const ei_impulse_t *impulse = multi_impulses[index].impulse;
+    *project_id = multi_impulses[index].project_id;
+    *deploy_version = impulse->deploy_version;
+    *input_size = impulse->dsp_input_frame_size;
+    *label_count = impulse->label_count;
+    *has_anomaly = impulse->has_anomaly ? 1 : 0;
+    return 0;
+}
+
+EI_BRIDGE_EXPORT const char *ei_bridge_label(size_t index, size_t label) {
+    if (index >= multi_impulses_count || label >= multi_impulses[index].impulse->label_count) {
+        return NULL;
+    }
+    return multi_impulses[index].impulse->categories[label];
+}
+
+// Run an impulse on count windows of input_size values, window i starts at features + i * stride.
+// scores receives label_count values per window and anomaly one value per window (may be NULL),
+// errors the EI_IMPULSE_ERROR of each window (may be NULL). Returns the number of failed windows,
+// -1 if index is out of range.
+EI_BRIDGE_EXPORT int ei_bridge_run_batch(size_t index, const float *features, size_t count, size_t stride,
+                                         float *scores, float *anomaly, int *errors) {
+    if (index >= multi_impulses_count) {
+        return -1;
+    }
+    const multi_impulse_t *mi = &multi_impulses[index];
+    size_t label_count = mi->impulse->label_count;
+    int failed = 0;
+
+    std::lock_guard<std::mutex> guard(bridge_lock(index));
+    for (size_t i = 0; i < count; i++) {
+        ei_impulse_result_t result;
+        memset(&result, 0, sizeof(result));
+        EI_IMPULSE_ERROR res = run_multi_impulse(mi, features + i * stride, &result);
+        if (res != EI_IMPULSE_OK) {
+            failed++;
+        }
+        if (errors != NULL) {
+            errors[i] = res;
+        }
+        for (size_t l = 0; l < label_count; l++) {
+            scores[i * label_count + l] = res == EI_IMPULSE_OK ? result.classification[l].value : 0.0f;
+        }
+        if (anomaly != NULL) {
+            anomaly[i] = res == EI_IMPULSE_OK ? result.anomaly : 0.0f;
+        }
+    }
+    return failed;
+}
+
+// Run an impulse on one window, returns its EI_IMPULSE_ERROR (-1 if index is out of range)
+EI_BRIDGE_EXPORT int ei_bridge_run(size_t index, const float *features, float *scores, float *anomaly) {
+    int error = EI_IMPULSE_OK;
+    if (ei_bridge_run_batch(index, features, 1, 0, scores, anomaly, &error) < 0) {
+        return -1;
+    }
+    return error;
+}
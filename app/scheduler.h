@@ -0,0 +1,176 @@
+#ifndef SCHEDULER_H
+#define SCHEDULER_H
+
+#include <pthread.h>
+#include <string.h>
+#include <chrono>
+#include <vector>
+
+#include "edge-impulse-sdk/classifier/ei_run_classifier.h"
+#include "multi_impulse.h"
+
+// Runs the impulses concurrently on a pool of pthreads, one worker per impulse. A worker only uses
+// the handle of its impulse (multi_impulse_t.handle) and its own result buffers, and the signal
+// callback reads a thread_local window, so no lock is held while an impulse runs.
+//
+// A sample gives one window to each impulse (or none). Up to `depth` samples are in flight:
+// - depth 1 is the latency mode, all impulses run in parallel on a sample and the next sample is
+//   submitted once the slowest impulse is done
+// - depth > 1 is the pipelined throughput mode, fast impulses move on to the next samples while
+//   slow ones are still busy, the throughput is bound by the slowest impulse only
+// Every worker processes the samples in order, so samples complete in order.
+
+// One sample in flight
+typedef struct {
+    long sample;                                // index of the sample, -1 if the slot is free
+    size_t pending;                             // workers not done with the sample yet
+    std::vector<const float *> windows;         // window of each impulse, NULL if it does not run
+    std::vector<std::vector<float>> copies;     // windows copied because their buffer is reused
+    std::vector<ei_impulse_result_t> results;   // result buffer of each impulse
+    std::vector<EI_IMPULSE_ERROR> errors;
+    std::chrono::steady_clock::time_point submitted;
+} scheduler_slot_t;
+
+// Called by the worker completing a sample, with the scheduler lock held.
+// latency_us is the time from the submission of the sample to the end of its slowest impulse.
+typedef void (*scheduler_callback_t)(scheduler_slot_t *slot, int64_t latency_us, void *ctx);
+
+class multi_impulse_scheduler_t {
+public:
+    // copy_windows[i] is true if the windows of impulse i have to be copied on submission,
+    // the others must stay valid until their sample completes
+    multi_impulse_scheduler_t(size_t depth, std::vector<bool> copy_windows, scheduler_callback_t callback, void *ctx)
+        : slots(depth > 0 ? depth : 1), copy_windows(copy_windows), callback(callback), ctx(ctx), submitted(0), completed(0), stopping(false) {
+        pthread_mutex_init(&lock, NULL);
+        pthread_cond_init(&work_cond, NULL);
+        pthread_cond_init(&free_cond, NULL);
+        for (scheduler_slot_t &slot : slots) {
+            slot.sample = -1;
+            slot.pending = 0;
+            slot.windows.assign(multi_impulses_count, NULL);
+            slot.copies.resize(multi_impulses_count);
+            slot.results.resize(multi_impulses_count);
+            slot.errors.assign(multi_impulses_count, EI_IMPULSE_OK);
+        }
+        workers.resize(multi_impulses_count);
+        for (size_t i = 0; i < multi_impulses_count; i++) {
+            workers[i].scheduler = this;
+            workers[i].impulse = i;
+            pthread_create(&workers[i].thread, NULL, &multi_impulse_scheduler_t::worker_main, &workers[i]);
+        }
+    }
+
+    ~multi_impulse_scheduler_t() {
+        drain();
+        pthread_mutex_lock(&lock);
+        stopping = true;
+        pthread_cond_broadcast(&work_cond);
+        pthread_mutex_unlock(&lock);
+        for (worker_t &worker : workers) {
+            pthread_join(worker.thread, NULL);
+        }
+        pthread_cond_destroy(&work_cond);
+        pthread_cond_destroy(&free_cond);
+        pthread_mutex_destroy(&lock);
+    }
+
+    // Submit a sample, windows[i] is the window of impulse i or NULL. Blocks while depth samples are in flight.
+    void submit(const float *const *windows) {
+        pthread_mutex_lock(&lock);
+        scheduler_slot_t &slot = slots[submitted % slots.size()];
+        while (slot.sample >= 0) {
+            pthread_cond_wait(&free_cond, &lock);
+        }
+        pthread_mutex_unlock(&lock);
+
+        // The slot is free, workers do not read it until it is published below
+        for (size_t i = 0; i < multi_impulses_count; i++) {
+            slot.windows[i] = windows[i];
+            if (windows[i] != NULL && copy_windows[i]) {
+                slot.copies[i].assign(windows[i], windows[i] + multi_impulses[i].impulse->dsp_input_frame_size);
+                slot.windows[i] = slot.copies[i].data();
+            }
+        }
+        slot.submitted = std::chrono::steady_clock::now();
+
+        pthread_mutex_lock(&lock);
+        slot.sample = submitted++;
+        // Every worker passes every sample, even without window, so that a slot is only reused once
+        // all workers are past it
+        slot.pending = multi_impulses_count;
+        pthread_cond_broadcast(&work_cond);
+        pthread_mutex_unlock(&lock);
+    }
+
+    // Wait until all submitted samples completed
+    void drain() {
+        pthread_mutex_lock(&lock);
+        while (completed < submitted) {
+            pthread_cond_wait(&free_cond, &lock);
+        }
+        pthread_mutex_unlock(&lock);
+    }
+
+private:
+    typedef struct {
+        multi_impulse_scheduler_t *scheduler;
+        size_t impulse;
+        pthread_t thread;
+    } worker_t;
+
+    static void *worker_main(void *arg) {
+        worker_t *worker = (worker_t *)arg;
+        worker->scheduler->run_worker(worker->impulse);
+        return NULL;
+    }
+
+    void run_worker(size_t i) {
+        for (long next = 0; ; next++) {
+            pthread_mutex_lock(&lock);
+            while (next >= submitted && !stopping) {
+                pthread_cond_wait(&work_cond, &lock);
+            }
+            if (next >= submitted) {
+                pthread_mutex_unlock(&lock);
+                return;
+            }
+            scheduler_slot_t &slot = slots[next % slots.size()];
+            const float *window = slot.windows[i];
+            pthread_mutex_unlock(&lock);
+
+            if (window != NULL) {
+                memset(&slot.results[i], 0, sizeof(slot.results[i]));
+                slot.errors[i] = run_multi_impulse(&multi_impulses[i], window, &slot.results[i]);
+            }
+
+            pthread_mutex_lock(&lock);
+            if (--slot.pending == 0) {
+                complete(slot);
+            }
+            pthread_mutex_unlock(&lock);
+        }
+    }
+
+    // Called with the lock held
+    void complete(scheduler_slot_t &slot) {
+        int64_t latency_us = std::chrono::duration_cast<std::chrono::microseconds>(std::chrono::steady_clock::now() - slot.submitted).count();
+        callback(&slot, latency_us, ctx);
+        slot.sample = -1;
+        completed++;
+        pthread_cond_broadcast(&free_cond);
+    }
+
+    std::vector<scheduler_slot_t> slots;
+    std::vector<worker_t> workers;
+    std::vector<bool> copy_windows;
+    scheduler_callback_t callback;
+    void *ctx;
+    long submitted;
+    long completed;
+    bool stopping;
+    pthread_mutex_t lock;
+    pthread_cond_t work_cond;
+    pthread_cond_t free_cond;
+};
+
+#endif // SCHEDULER_H
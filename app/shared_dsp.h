@@ -0,0 +1,112 @@
+#ifndef SHARED_DSP_H
+#define SHARED_DSP_H
+
+#include <string.h>
+#include <memory>
+#include <vector>
+
+#include "edge-impulse-sdk/classifier/ei_run_classifier.h"
+#include "multi_impulse.h"
+
+// Impulses of a same DSP group (dsp_group >= 0 in the impulse table) have identical DSP blocks:
+// same input frame, extract functions, configs and axes. When they run on the same window, the
+// features are extracted once, as process_impulse does, and fed to run_inference of each impulse.
+// Set EI_APP_SHARED_DSP to 0 to always go through process_impulse.
+#ifndef EI_APP_SHARED_DSP
+#define EI_APP_SHARED_DSP 0
+#endif
+
+#if EI_APP_SHARED_DSP
+// Features of the DSP blocks of one impulse
+typedef struct {
+    std::vector<std::unique_ptr<ei::matrix_t>> matrices;
+    std::vector<ei_feature_t> features;
+    uint64_t dsp_us;
+} shared_features_t;
+
+static inline EI_IMPULSE_ERROR shared_dsp_extract(const multi_impulse_t *mi, const float *window, shared_features_t *out) {
+    const ei_impulse_t *impulse = mi->impulse;
+    signal_t signal;
+    signal.total_length = impulse->dsp_input_frame_size;
+    signal.get_data = &multi_impulse_get_data;
+    multi_impulse_window = window;
+
+    uint64_t start_us = ei_read_timer_us();
+    out->matrices.clear();
+    out->features.assign(impulse->dsp_blocks_size + impulse->learning_blocks_size, ei_feature_t());
+    size_t out_features_index = 0;
+    for (size_t ix = 0; ix < impulse->dsp_blocks_size; ix++) {
+        ei_model_dsp_t block = impulse->dsp_blocks[ix];
+        if (block.factory != nullptr || out_features_index + block.n_output_features > impulse->nn_input_frame_size) {
+            return EI_IMPULSE_DSP_ERROR;
+        }
+        out->matrices.emplace_back(new ei::matrix_t(1, block.n_output_features));
+        out->features[ix].matrix = out->matrices.back().get();
+        out->features[ix].blockId = block.blockId;
+#if EIDSP_SIGNAL_C_FN_POINTER
+        if (block.axes_size != impulse->raw_samples_per_frame) {
+            return EI_IMPULSE_DSP_ERROR;
+        }
+        signal_t *internal_signal = &signal;
+#else
+        SignalWithAxes swa(&signal, block.axes, block.axes_size, impulse);
+        signal_t *internal_signal = swa.get_signal();
+#endif
+        if (block.extract_fn(internal_signal, out->features[ix].matrix, block.config, impulse->frequency) != EIDSP_OK) {
+            return EI_IMPULSE_DSP_ERROR;
+        }
+        out_features_index += block.n_output_features;
+    }
+    out->dsp_us = ei_read_timer_us() - start_us;
+    return EI_IMPULSE_OK;
+}
+#endif // EI_APP_SHARED_DSP
+
+// Run several impulses on the same window, errors[i] is the result of impulses[i].
+// Impulses of a DSP group share the extracted features, the others (and every impulse of a group
+// whose extraction failed) run process_impulse.
+static inline void run_multi_impulses(const multi_impulse_t *const *impulses, size_t count, const float *window,
+                                      ei_impulse_result_t *results, EI_IMPULSE_ERROR *errors) {
+    std::vector<bool> done(count, false);
+#if EI_APP_SHARED_DSP
+    for (size_t i = 0; i < count; i++) {
+        if (done[i] || impulses[i]->dsp_group < 0) {
+            continue;
+        }
+        std::vector<size_t> members;
+        for (size_t j = i; j < count; j++) {
+            if (!done[j] && impulses[j]->dsp_group == impulses[i]->dsp_group) {
+                members.push_back(j);
+            }
+        }
+        shared_features_t shared;
+        if (members.size() < 2 || shared_dsp_extract(impulses[i], window, &shared) != EI_IMPULSE_OK) {
+            continue;
+        }
+        for (size_t k = 0; k < members.size(); k++) {
+            size_t j = members[k];
+            const ei_impulse_t *impulse = impulses[j]->impulse;
+            // Same features, but the learning blocks refer to the DSP block IDs of their own project
+            std::vector<ei_feature_t> features = shared.features;
+            features.resize(impulse->dsp_blocks_size + impulse->learning_blocks_size);
+            for (size_t ix = 0; ix < impulse->dsp_blocks_size; ix++) {
+                features[ix].blockId = impulse->dsp_blocks[ix].blockId;
+            }
+            memset(&results[j], 0, sizeof(results[j]));
+            // The extraction time is accounted to the first impulse of the group only
+            results[j].timing.dsp_us = k == 0 ? shared.dsp_us : 0;
+            results[j].timing.dsp = (int)(results[j].timing.dsp_us / 1000);
+            errors[j] = run_inference(impulses[j]->handle, features.data(), &results[j], false);
+            done[j] = true;
+        }
+    }
+#endif
+    for (size_t i = 0; i < count; i++) {
+        if (!done[i]) {
+            memset(&results[i], 0, sizeof(results[i]));
+            errors[i] = run_multi_impulse(impulses[i], window, &results[i]);
+        }
+    }
+}
+
+#endif // SHARED_DSP_H
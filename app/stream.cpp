@@ -0,0 +1,304 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <math.h>
+#include <chrono>
+#include <string>
+#include <vector>
+#include <algorithm>
+
+// shared DSP settings inserted here
+
+// scheduler settings inserted here
+
+#include "edge-impulse-sdk/classifier/ei_run_classifier.h"
+#include "multi_impulse.h"
+#include "shared_dsp.h"
+#include "input_stream.h"
+#if EI_APP_SCHEDULER
+#include "scheduler.h"
+#endif
+
+// Streams recorded windows through the merged impulses and reports their throughput.
+// Usage: ./app [--input [PROJECT_ID=]PATH]... [--stdin-format csv|bin] [--print-results]
+//              [--mode sequential|latency|throughput] [--depth N]
+// PATH is a binary file of float32 values, a CSV file (*.csv, *.txt) or - for stdin.
+// Without PROJECT_ID, the input is used by all impulses. Impulses without an input run once
+// on their example features. Impulses reading the same input with the same frame size share
+// each window, so every round runs all of them on the same sample. Impulses with identical DSP
+// blocks extract the features of a shared window once (see shared_dsp.h).
+// A sample is the set of windows of a round. When the app is generated with a scheduler, the
+// impulses of a sample run in parallel on worker threads (see scheduler.h): --mode latency waits
+// for each sample to complete, --mode throughput keeps up to --depth samples in flight.
+
+#ifndef EI_APP_SCHEDULER
+#define EI_APP_SCHEDULER 0
+#endif
+
+#if EI_APP_SCHEDULER
+#define USAGE_SCHEDULER " [--mode sequential|latency|throughput] [--depth N]"
+#else
+#define USAGE_SCHEDULER ""
+#endif
+
+// raw features array inserted here
+
+// impulse table inserted here
+
+typedef struct {
+    window_source_t *source;
+    size_t windows;
+    int errors;
+    int64_t process_us;     // DSP, inference and anomaly time reported by the SDK
+} impulse_stream_t;
+
+typedef struct {
+    std::vector<impulse_stream_t> *streams;
+    bool print_results;
+    std::vector<int64_t> latencies;     // per sample, from its start to the end of its slowest impulse
+} stream_state_t;
+
+static void print_result(uint32_t project_id, size_t window, ei_impulse_result_t *result, const ei_impulse_t *impulse) {
+    printf("%u,%zu", project_id, window);
+#if EI_CLASSIFIER_OBJECT_DETECTION == 1
+    for (uint32_t i = 0; i < result->bounding_boxes_count; i++) {
+        ei_impulse_result_bounding_box_t bb = result->bounding_boxes[i];
+        if (bb.value > 0) {
+            printf(",%s:%.5f", bb.label, bb.value);
+        }
+    }
+#else
+    for (uint16_t i = 0; i < impulse->label_count; i++) {
+        printf(",%s:%.5f", result->classification[i].label, result->classification[i].value);
+    }
+#endif
+#if EI_CLASSIFIER_HAS_ANOMALY == 1
+    printf(",anomaly:%.3f", result->anomaly);
+#endif
+    printf("\n");
+}
+
+static void record_result(stream_state_t *state, size_t i, ei_impulse_result_t *result, EI_IMPULSE_ERROR res) {
+    impulse_stream_t &s = (*state->streams)[i];
+    s.process_us += result->timing.dsp_us + result->timing.classification_us + result->timing.anomaly_us;
+    if (res != EI_IMPULSE_OK) {
+        fprintf(stderr, "Impulse %u failed on window %zu (%d)\n", multi_impulses[i].project_id, s.windows, res);
+        s.errors++;
+    } else if (state->print_results) {
+        print_result(multi_impulses[i].project_id, s.windows, result, multi_impulses[i].impulse);
+    }
+    s.windows++;
+}
+
+#if EI_APP_SCHEDULER
+static void on_sample_complete(scheduler_slot_t *slot, int64_t latency_us, void *ctx) {
+    stream_state_t *state = (stream_state_t *)ctx;
+    for (size_t i = 0; i < multi_impulses_count; i++) {
+        if (slot->windows[i] != NULL) {
+            record_result(state, i, &slot->results[i], slot->errors[i]);
+        }
+    }
+    state->latencies.push_back(latency_us);
+}
+#endif
+
+// Nearest-rank percentile
+static int64_t percentile(std::vector<int64_t> &sorted, double p) {
+    if (sorted.empty()) {
+        return 0;
+    }
+    size_t rank = (size_t)ceil(p / 100.0 * sorted.size());
+    return sorted[rank > 0 ? rank - 1 : 0];
+}
+
+int main(int argc, char **argv) {
+    std::vector<std::pair<std::string, std::string>> inputs;    // (project ID or "", path)
+    bool stdin_csv = true;
+    bool print_results = false;
+#if EI_APP_SCHEDULER
+    const char *mode = EI_APP_SCHEDULER_MODE;
+    size_t depth = EI_APP_SCHEDULER_DEPTH;
+#else
+    const char *mode = "sequential";
+#endif
+
+    for (int i = 1; i < argc; i++) {
+        if (strcmp(argv[i], "--input") == 0 && i + 1 < argc) {
+            std::string arg = argv[++i];
+            size_t eq = arg.find('=');
+            if (eq == std::string::npos) {
+                inputs.push_back(std::make_pair(std::string(), arg));
+            } else {
+                inputs.push_back(std::make_pair(arg.substr(0, eq), arg.substr(eq + 1)));
+            }
+        } else if (strcmp(argv[i], "--stdin-format") == 0 && i + 1 < argc) {
+            stdin_csv = strcmp(argv[++i], "bin") != 0;
+        } else if (strcmp(argv[i], "--print-results") == 0) {
+            print_results = true;
+#if EI_APP_SCHEDULER
+        } else if (strcmp(argv[i], "--mode") == 0 && i + 1 < argc) {
+            mode = argv[++i];
+        } else if (strcmp(argv[i], "--depth") == 0 && i + 1 < argc) {
+            depth = atoi(argv[++i]);
+#endif
+        } else {
+            fprintf(stderr, "Usage: %s [--input [PROJECT_ID=]PATH]... [--stdin-format csv|bin] [--print-results]" USAGE_SCHEDULER "\n", argv[0]);
+            return 1;
+        }
+    }
+
+    if (strcmp(mode, "sequential") != 0 && strcmp(mode, "latency") != 0 && strcmp(mode, "throughput") != 0) {
+        fprintf(stderr, "Unknown mode %s\n", mode);
+        return 1;
+    }
+
+    // Sources are opened once per (path, frame size) and shared by the impulses using them
+    std::vector<std::pair<std::string, window_source_t *>> sources;
+    std::vector<impulse_stream_t> streams(multi_impulses_count);
+    for (size_t i = 0; i < multi_impulses_count; i++) {
+        const multi_impulse_t *mi = &multi_impulses[i];
+        size_t frame_size = mi->impulse->dsp_input_frame_size;
+        std::string id = std::to_string(mi->project_id);
+
+        std::string path;
+        for (auto &input : inputs) {
+            if (input.first == id || (input.first.empty() && path.empty())) {
+                path = input.second;
+            }
+        }
+
+        impulse_stream_t &s = streams[i];
+        s.source = NULL;
+        s.windows = 0;
+        s.errors = 0;
+        s.process_us = 0;
+        if (path.empty()) {
+            s.source = new memory_source_t(frame_size, multi_impulse_example_window(mi));
+            continue;
+        }
+        std::string key = path + "#" + std::to_string(frame_size);
+        for (auto &source : sources) {
+            if (source.first == key) {
+                s.source = source.second;
+            }
+        }
+        if (s.source != NULL) {
+            continue;
+        }
+        if (path == "-") {
+            for (auto &source : sources) {
+                if (source.first.compare(0, 2, "-#") == 0) {
+                    fprintf(stderr, "stdin can only feed impulses with the same input frame size\n");
+                    return 1;
+                }
+            }
+        }
+        s.source = open_window_source(path, frame_size, stdin_csv);
+        if (s.source == NULL) {
+            fprintf(stderr, "Cannot read %s\n", path.c_str());
+            return 1;
+        }
+        sources.push_back(std::make_pair(key, s.source));
+    }
+
+    // Distinct sources, in the order of the impulse table
+    std::vector<window_source_t *> round_sources;
+    for (impulse_stream_t &s : streams) {
+        if (std::find(round_sources.begin(), round_sources.end(), s.source) == round_sources.end()) {
+            round_sources.push_back(s.source);
+        }
+    }
+
+    stream_state_t state;
+    state.streams = &streams;
+    state.print_results = print_results;
+
+#if EI_APP_SCHEDULER
+    multi_impulse_scheduler_t *scheduler = NULL;
+    if (strcmp(mode, "sequential") != 0) {
+        std::vector<bool> copy_windows;
+        for (impulse_stream_t &s : streams) {
+            copy_windows.push_back(s.source->reuses_buffer());
+        }
+        scheduler = new multi_impulse_scheduler_t(strcmp(mode, "latency") == 0 ? 1 : depth, copy_windows, &on_sample_complete, &state);
+    }
+#endif
+
+    // At each round, all the impulses of a source run on its next window, until every input is exhausted
+    std::vector<const float *> windows(multi_impulses_count);
+    std::vector<const multi_impulse_t *> batch;
+    std::vector<size_t> batch_index;
+    std::vector<ei_impulse_result_t> results(multi_impulses_count);
+    std::vector<EI_IMPULSE_ERROR> errors(multi_impulses_count);
+    auto start = std::chrono::steady_clock::now();
+    for (long round = 0; ; round++) {
+        auto round_start = std::chrono::steady_clock::now();
+        bool active = false;
+        for (size_t i = 0; i < multi_impulses_count; i++) {
+            windows[i] = streams[i].source->window_for_round(round);
+            active = active || windows[i] != NULL;
+        }
+        if (!active) {
+            break;
+        }
+#if EI_APP_SCHEDULER
+        if (scheduler != NULL) {
+            scheduler->submit(windows.data());
+            continue;
+        }
+#endif
+        for (window_source_t *source : round_sources) {
+            const float *window = source->window_for_round(round);
+            if (window == NULL) {
+                continue;
+            }
+            batch.clear();
+            batch_index.clear();
+            for (size_t i = 0; i < multi_impulses_count; i++) {
+                if (streams[i].source == source) {
+                    batch.push_back(&multi_impulses[i]);
+                    batch_index.push_back(i);
+                }
+            }
+            run_multi_impulses(batch.data(), batch.size(), window, results.data(), errors.data());
+            for (size_t b = 0; b < batch.size(); b++) {
+                record_result(&state, batch_index[b], &results[b], errors[b]);
+            }
+        }
+        state.latencies.push_back(std::chrono::duration_cast<std::chrono::microseconds>(std::chrono::steady_clock::now() - round_start).count());
+    }
+#if EI_APP_SCHEDULER
+    if (scheduler != NULL) {
+        scheduler->drain();
+        delete scheduler;
+    }
+#endif
+    double wall_s = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+
+    size_t total_windows = 0;
+    int total_errors = 0;
+    fprintf(stderr, "impulse,windows,errors,process_s,windows_per_s\n");
+    for (size_t i = 0; i < multi_impulses_count; i++) {
+        impulse_stream_t &s = streams[i];
+        double process_s = s.process_us / 1e6;
+        fprintf(stderr, "%u,%zu,%d,%.3f,%.1f\n", multi_impulses[i].project_id, s.windows, s.errors, process_s,
+                process_s > 0 ? s.windows / process_s : 0.0);
+        total_windows += s.windows;
+        total_errors += s.errors;
+    }
+    fprintf(stderr, "all,%zu,%d,%.3f,%.1f\n", total_windows, total_errors, wall_s, wall_s > 0 ? total_windows / wall_s : 0.0);
+
+    // Combined latency of a sample (all its impulses) and sample throughput
+    std::vector<int64_t> &latencies = state.latencies;
+    std::sort(latencies.begin(), latencies.end());
+    double mean = 0;
+    for (int64_t l : latencies) {
+        mean += (double)l / latencies.size();
+    }
+    fprintf(stderr, "mode,samples,latency_p50_us,latency_p95_us,latency_p99_us,latency_mean_us,samples_per_s\n");
+    fprintf(stderr, "%s,%zu,%lld,%lld,%lld,%.1f,%.1f\n", mode, latencies.size(), (long long)percentile(latencies, 50),
+            (long long)percentile(latencies, 95), (long long)percentile(latencies, 99), mean, wall_s > 0 ? latencies.size() / wall_s : 0.0);
+
+    return total_errors == 0 ? 0 : 1;
+}
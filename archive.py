@@ -0,0 +1,133 @@
+import os, io, struct, tarfile, zipfile
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig()
+
+logger = logging.getLogger("archive")
+logger.setLevel(logging.INFO)
+
+ARCHIVE_FORMATS = ['zip', 'tar', 'tar.zst', 'none']
+# Level used when none is given: same as shutil.make_archive for zip, zstd default for tar.zst
+# and the valid range of each format, checked by generate.py
+DEFAULT_ZIP_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+COMPRESSION_LEVELS = {'zip': range(0, 10), 'tar.zst': range(1, 23)}
+
+# Files and directories of root_dir with their name in the archive, in the same order as
+# shutil.make_archive: sub-directories (sorted) then files of each directory
+def list_members(root_dir):
+    members = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        arcdirpath = os.path.normpath(os.path.relpath(dirpath, root_dir))
+        for name in sorted(dirnames):
+            members += [(os.path.join(dirpath, name), os.path.normpath(os.path.join(arcdirpath, name)))]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.isfile(path):
+                members += [(path, os.path.normpath(os.path.join(arcdirpath, name)))]
+    return members
+
+# Central directory entry and end of central directory record of the ZIP format (APPNOTE 4.3.12, 4.3.16)
+CENTRAL_HEADER_OFFSET_FIELD = 42
+END_RECORD = struct.Struct('<4s4H2LH')
+END_RECORD_SIGNATURE = b'PK\x05\x06'
+
+# Zip one member on its own, runs in a worker thread (zlib releases the GIL while it compresses).
+# Returns the single member archive, level 0 stores the data as-is.
+def _zip_member(path, arcname, level):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        if level > 0:
+            zf.write(path, arcname, compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
+        else:
+            zf.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+# Split a single member archive into its local entry (header and data) and its central directory entry
+def _split_member(data):
+    signature, _, _, _, _, central_size, central_offset, _ = END_RECORD.unpack(data[-END_RECORD.size:])
+    if signature != END_RECORD_SIGNATURE:
+        raise(Exception('Unexpected end of central directory record in a zip member'))
+    return data[:central_offset], bytearray(data[central_offset:central_offset + central_size])
+
+# Zip root_dir, members are compressed in parallel and written in order.
+# Each worker zips its member in a single member archive with zipfile, the local entries are then
+# concatenated and their central directory entries moved to the offset of the entry in the archive.
+# At most 2 * workers members are held in memory at the same time.
+def make_zip(base_name, root_dir, level = DEFAULT_ZIP_LEVEL, workers = None):
+    zip_filename = base_name + ".zip"
+    if workers is None:
+        workers = os.cpu_count() or 1
+    members = list_members(root_dir)
+
+    # Archives that may need zip64 records (4 GB, 65535 members) are written by zipfile on one thread
+    if len(members) >= 0xFFFF or sum(os.path.getsize(path) + 1024 for path, _ in members) > zipfile.ZIP64_LIMIT:
+        compress_type = zipfile.ZIP_DEFLATED if level > 0 else zipfile.ZIP_STORED
+        with zipfile.ZipFile(zip_filename, "w", compression=compress_type, compresslevel=level if level > 0 else None) as zf:
+            for path, arcname in members:
+                zf.write(path, arcname)
+        return zip_filename
+
+    with open(zip_filename, "wb") as file, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        central_directory = []
+
+        def write_next():
+            local, central = _split_member(pending.popleft().result())
+            central[CENTRAL_HEADER_OFFSET_FIELD:CENTRAL_HEADER_OFFSET_FIELD + 4] = struct.pack('<L', file.tell())
+            file.write(local)
+            central_directory.append(bytes(central))
+
+        for path, arcname in members:
+            pending.append(executor.submit(_zip_member, path, arcname, level))
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+
+        central_offset = file.tell()
+        for central in central_directory:
+            file.write(central)
+        file.write(END_RECORD.pack(END_RECORD_SIGNATURE, 0, 0, len(central_directory), len(central_directory),
+                                   file.tell() - central_offset, central_offset, 0))
+
+    return zip_filename
+
+# Tar root_dir, compressed with zstd (multi-threaded) if level > 0
+def make_tar(base_name, root_dir, level = 0, workers = None):
+    if level == 0:
+        tar_filename = base_name + ".tar"
+        with tarfile.open(tar_filename, "w") as tar:
+            tar.add(root_dir, arcname=os.curdir)
+        return tar_filename
+
+    try:
+        import zstandard
+    except ImportError:
+        raise(Exception('tar.zst archives need the zstandard package (pip install zstandard)'))
+
+    tar_filename = base_name + ".tar.zst"
+    compressor = zstandard.ZstdCompressor(level=level, threads=workers if workers is not None else -1)
+    with open(tar_filename, 'wb') as file, compressor.stream_writer(file) as writer:
+        with tarfile.open(fileobj=writer, mode="w|") as tar:
+            tar.add(root_dir, arcname=os.curdir)
+    return tar_filename
+
+# Package root_dir as base_name + extension of archive_format.
+# Returns the archive path, None for the 'none' format (root_dir is left as the deliverable).
+def create_archive(base_name, root_dir, archive_format = 'zip', level = None, workers = None):
+    if archive_format == 'none':
+        logger.info(f"No archive created, output left in {root_dir}")
+        return None
+    if archive_format == 'zip':
+        archive_path = make_zip(base_name, root_dir, DEFAULT_ZIP_LEVEL if level is None else level, workers)
+    elif archive_format == 'tar':
+        archive_path = make_tar(base_name, root_dir, 0, workers)
+    elif archive_format == 'tar.zst':
+        archive_path = make_tar(base_name, root_dir, DEFAULT_ZSTD_LEVEL if level is None else level, workers)
+    else:
+        raise(Exception(f'Unknown archive format {archive_format}'))
+    logger.info(f"Archive {archive_path} created ({os.path.getsize(archive_path)} Bytes)")
+    return archive_path
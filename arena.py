@@ -0,0 +1,146 @@
+import os, re, json
+import logging
+
+logging.basicConfig()
+
+logger = logging.getLogger("arena")
+logger.setLevel(logging.INFO)
+
+SHARED_ARENA_HEADER = "tflite-model/shared_tensor_arena.h"
+SHARED_ARENA_SOURCE = "tflite-model/shared_tensor_arena.cpp"
+
+# Graph configs of the learning blocks in model_variables.h: ei_config_tflite_graph_t (tflite)
+# and ei_config_tflite_eon_graph_t (EON). Suffixed projects have ei_config_tflite_graph_<block>_<project ID>.
+GRAPH_CONFIG_PATTERN = re.compile(r'ei_config_tflite_(?:eon_)?graph_t\s+(ei_config_tflite_graph_(\d+)(?:_(\d+))?)\s*=\s*\{([^}]*)\}')
+
+# Static arena of an EON compiled model, only when it is allocated statically
+EON_STATIC_ARENA_PATTERN = re.compile(r'(#if\s+defined\s*\(\s*EI_CLASSIFIER_ALLOCATION_STATIC\s*\)[ \t]*\n)[ \t]*uint8_t\s+tensor_arena\s*\[\s*kTensorArenaSize\s*\][^;\n]*;')
+
+# Value of a size: a literal, or a constant defined in the model sources
+def _size_value(value, sources):
+    value = value.strip()
+    if re.fullmatch(r'\d+', value):
+        return int(value)
+    for source in sources:
+        m = re.search(r'\b' + re.escape(value) + r'\s*=\s*(\d+)', source)
+        if m:
+            return int(m.group(1))
+    return None
+
+def _read(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+# Tensor arena size of each learning block of the merged projects.
+# With EON it is kTensorArenaSize of the compiled model, with tflite the arena_size of the graph config.
+# Returns {project ID: [{"graph": name, "arena_size": bytes or None, "source": file}]}
+def read_arena_sizes(target_dir, project_ids, engine):
+    model_dir = os.path.join(target_dir, "tflite-model")
+    content = _read(os.path.join(target_dir, "model-parameters/model_variables.h"))
+    headers = [_read(os.path.join(model_dir, f)) for f in sorted(os.listdir(model_dir)) if f.endswith('.h')]
+
+    arenas = {p: [] for p in project_ids}
+    for name, _, suffix, body in GRAPH_CONFIG_PATTERN.findall(content):
+        # Symbols of the first project are not suffixed
+        p = suffix if suffix else project_ids[0]
+        if p not in arenas:
+            logger.warning(f"{name} does not belong to a merged project")
+            continue
+        fields = dict(re.findall(r'\.(\w+)\s*=\s*&?\s*([^,\n]+)', body))
+        entry = {"graph": name, "arena_size": None, "source": "model-parameters/model_variables.h"}
+        if engine == 'eon' and 'model_init' in fields:
+            model = re.sub(r'_init$', '', fields['model_init'].strip())
+            source = f"tflite-model/{model}_compiled.cpp"
+            entry["graph"] = model
+            entry["source"] = source
+            if os.path.exists(os.path.join(target_dir, source)):
+                entry["arena_size"] = _size_value("kTensorArenaSize", [_read(os.path.join(target_dir, source))])
+        elif 'arena_size' in fields:
+            entry["arena_size"] = _size_value(fields['arena_size'], headers)
+        if entry["arena_size"] is None:
+            logger.warning(f"Tensor arena size of {entry['graph']} (project {p}) not found")
+        arenas[p].append(entry)
+    return arenas
+
+# Per impulse memory report: arena of each learning block, the RAM taken by the arenas when
+# each model keeps its own one, and when they share a single arena sized to the largest
+def memory_report(arenas, engine, shared_arena, shared_arena_reason = None):
+    sizes = [a["arena_size"] for graphs in arenas.values() for a in graphs if a["arena_size"] is not None]
+    impulses = []
+    for p, graphs in arenas.items():
+        impulses.append({
+            "project_id": p,
+            "graphs": graphs,
+            "arena_size": sum(a["arena_size"] for a in graphs if a["arena_size"] is not None),
+        })
+    return {
+        "engine": engine,
+        "shared_arena": shared_arena,
+        "shared_arena_reason": shared_arena_reason,
+        "impulses": impulses,
+        "separate_arenas_size": sum(sizes),
+        "shared_arena_size": max(sizes, default=0),
+        "saved_size": sum(sizes) - max(sizes, default=0),
+        "complete": all(a["arena_size"] is not None for graphs in arenas.values() for a in graphs),
+    }
+
+def write_memory_report(path, report):
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+# Point the static arenas of the EON compiled models at one arena sized to the largest of them.
+# Only valid when the impulses never run at the same time: the arena is reinitialized by each
+# model_init, as done by process_impulse for every inference.
+# Fails if an arena cannot be shared, returns False if there is nothing to share.
+def emit_shared_arena(target_dir, arenas):
+    graphs = [a for entries in arenas.values() for a in entries]
+    unknown = [a["graph"] for a in graphs if a["arena_size"] is None]
+    if unknown:
+        raise(Exception(f"--shared-arena: tensor arena size of {', '.join(unknown)} not found, the arenas cannot be shared"))
+    if len(graphs) < 2:
+        logger.info("Less than 2 tensor arenas, nothing to share")
+        return False
+
+    # Patch every source first, nothing is written if one of them cannot be
+    patched = {}
+    for a in graphs:
+        path = os.path.join(target_dir, a["source"])
+        code = _read(path)
+        if f'#include "{SHARED_ARENA_HEADER}"' in code:
+            # Reused from a previous run with the shared arena
+            continue
+        code, count = EON_STATIC_ARENA_PATTERN.subn(
+            r"\1uint8_t *const tensor_arena = ei_shared_tensor_arena;\n"
+            r'static_assert(kTensorArenaSize <= EI_SHARED_TENSOR_ARENA_SIZE, "shared tensor arena too small");',
+            code, count=1)
+        if count == 0:
+            raise(Exception(f"--shared-arena: no static tensor arena found in {a['source']}, the arenas cannot be shared"))
+        patched[path] = f'#include "{SHARED_ARENA_HEADER}"\n' + code
+
+    size = max(a["arena_size"] for a in graphs)
+    with open(os.path.join(target_dir, SHARED_ARENA_HEADER), 'w') as file:
+        file.write("#ifndef SHARED_TENSOR_ARENA_H\n"
+                   "#define SHARED_TENSOR_ARENA_H\n\n"
+                   "#include <stdint.h>\n\n"
+                   "// Tensor arena shared by all the compiled models with EI_CLASSIFIER_ALLOCATION_STATIC,\n"
+                   "// sized to the largest of them. The impulses must not run concurrently.\n"
+                   f"#define EI_SHARED_TENSOR_ARENA_SIZE {size}\n\n"
+                   "extern uint8_t ei_shared_tensor_arena[EI_SHARED_TENSOR_ARENA_SIZE];\n\n"
+                   "#endif // SHARED_TENSOR_ARENA_H\n")
+    with open(os.path.join(target_dir, SHARED_ARENA_SOURCE), 'w') as file:
+        file.write(f'#include "{SHARED_ARENA_HEADER}"\n\n'
+                   "#if defined(EI_CLASSIFIER_ALLOCATION_STATIC)\n"
+                   "alignas(16) uint8_t ei_shared_tensor_arena[EI_SHARED_TENSOR_ARENA_SIZE];\n"
+                   "#endif\n")
+    for path, code in patched.items():
+        with open(path, 'w') as file:
+            file.write(code)
+
+    logger.info(f"{len(graphs)} tensor arenas share one arena of {size} bytes instead of {sum(a['arena_size'] for a in graphs)} bytes")
+    return True
+
+# Remove the shared arena of a previous run in the same output directory
+def remove_shared_arena(target_dir):
+    for f in [SHARED_ARENA_HEADER, SHARED_ARENA_SOURCE]:
+        if os.path.exists(os.path.join(target_dir, f)):
+            os.remove(os.path.join(target_dir, f))
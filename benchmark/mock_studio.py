@@ -0,0 +1,461 @@
+import io, re, json, time, zlib, random, zipfile, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for the Studio API endpoints used by EIDownload, serving synthetic exports.
+# Run it standalone and pass --api-url http://127.0.0.1:<port>/v1/api to generate.py,
+# or use MockStudio from a script (see run_benchmark.py).
+
+API_PREFIX = "/v1/api"
+# Lines added to the log of a build job per second
+STDOUT_LINES_PER_S = 10
+
+# Project ID of an API key: trailing digits of the key ("bench-12" -> 12), a hash otherwise
+def project_id_from_key(api_key):
+    m = re.search(r"(\d+)$", api_key)
+    if m:
+        return int(m.group(1))
+    return zlib.crc32(api_key.encode()) % 100000
+
+def _metadata_h(project_id, labels, fft):
+    ffts = "".join(f"#define EI_CLASSIFIER_LOAD_FFT_{32 << i} {v}\n" for i, v in enumerate(fft))
+    return f"""#ifndef _EI_CLASSIFIER_MODEL_METADATA_H_
+#define _EI_CLASSIFIER_MODEL_METADATA_H_
+
+#define EI_CLASSIFIER_PROJECT_ID {project_id}
+#define EI_CLASSIFIER_LABEL_COUNT {len(labels)}
+#define EI_CLASSIFIER_HAS_VISUAL_ANOMALY 0
+#define EI_CLASSIFIER_SINGLE_FEATURE_INPUT 1
+#define EI_CLASSIFIER_QUANTIZATION_ENABLED 1
+#define EI_CLASSIFIER_LOAD_IMAGE_SCALING 0
+#define EI_DSP_PARAMS_SPECTRAL_ANALYSIS_ANALYSIS_TYPE_FFT 1
+#define EI_DSP_PARAMS_SPECTRAL_ANALYSIS_ANALYSIS_TYPE_WAVELET 0
+#define EI_CLASSIFIER_OBJECT_DETECTION 0
+#define EI_CLASSIFIER_OBJECT_DETECTION_COUNT 10
+#define EI_CLASSIFIER_OBJECT_DETECTION_LAST_LAYER EI_CLASSIFIER_LAST_LAYER_UNKNOWN
+#define EI_CLASSIFIER_HAS_ANOMALY EI_ANOMALY_TYPE_UNKNOWN
+#define EI_CLASSIFIER_HAS_FFT_INFO 1
+#define EI_CLASSIFIER_NON_STANDARD_FFT_SIZES 0
+{ffts}#define EI_STUDIO_VERSION_MAJOR 1
+#define EI_STUDIO_VERSION_MINOR 60
+#define EI_STUDIO_VERSION_PATCH 2
+
+#endif // _EI_CLASSIFIER_MODEL_METADATA_H_
+"""
+
+def _variables_h(project_id, version, model_name, model_file, learn_id, dsp_id, labels, eon):
+    categories = ", ".join(f'"{label}"' for label in labels)
+    if eon:
+        graph_config = f"""const ei_config_tflite_eon_graph_t ei_config_tflite_graph_{learn_id} = {{
+    .implementation_version = 1,
+    .model_init = &{model_name}_init,
+    .model_invoke = &{model_name}_invoke,
+    .model_reset = &{model_name}_reset,
+    .model_input = &{model_name}_input,
+    .model_output = &{model_name}_output,
+}};"""
+    else:
+        graph_config = f"""const ei_config_tflite_graph_t ei_config_tflite_graph_{learn_id} = {{
+    .implementation_version = 1,
+    .model = {model_name},
+    .model_size = {model_name}_len,
+    .arena_size = {model_name}_arena_size
+}};"""
+    return f"""#ifndef _EI_CLASSIFIER_MODEL_VARIABLES_H_
+#define _EI_CLASSIFIER_MODEL_VARIABLES_H_
+
+#include <stdint.h>
+#include "model_metadata.h"
+
+#include "tflite-model/{model_file}.h"
+#include "edge-impulse-sdk/classifier/ei_model_types.h"
+#include "edge-impulse-sdk/classifier/inferencing_engines/engines.h"
+
+const char* ei_classifier_inferencing_categories[] = {{ {categories} }};
+
+uint8_t ei_dsp_config_{dsp_id}_axes[] = {{ 0, 1, 2 }};
+const uint32_t ei_dsp_config_{dsp_id}_axes_size = 3;
+ei_dsp_config_spectral_analysis_t ei_dsp_config_{dsp_id} = {{
+    {dsp_id}, // uint32_t blockId
+    4, // int implementationVersion
+    3, // int length of axes
+    1.0f, // float scale-axes
+}};
+
+const uint8_t ei_dsp_blocks_size = 1;
+ei_model_dsp_t ei_dsp_blocks[ei_dsp_blocks_size] = {{
+    {{ // DSP block {dsp_id}
+        {dsp_id},
+        33, // output size
+        &extract_spectral_analysis_features, // DSP function pointer
+        (void*)&ei_dsp_config_{dsp_id}, // pointer to config struct
+        ei_dsp_config_{dsp_id}_axes, // array of offsets into the input stream, one for each axis
+        ei_dsp_config_{dsp_id}_axes_size, // number of axes
+        1, // version
+        nullptr, // factory function
+    }}
+}};
+
+{graph_config}
+
+const uint8_t ei_learning_block_{learn_id}_inputs[1] = {{ {dsp_id} }};
+const uint8_t ei_learning_block_{learn_id}_inputs_size = 1;
+const ei_learning_block_config_tflite_graph_t ei_learning_block_config_{learn_id} = {{
+    .block_id = {learn_id},
+    .object_detection = 0,
+    .object_detection_last_layer = EI_CLASSIFIER_LAST_LAYER_UNKNOWN,
+    .output_data_tensor = 0,
+    .output_labels_tensor = 1,
+    .output_score_tensor = 2,
+    .threshold = 0,
+    .quantized = 1,
+    .compiled = {1 if eon else 0},
+    .graph_config = (void*)&ei_config_tflite_graph_{learn_id}
+}};
+
+const uint8_t ei_learning_blocks_size = 1;
+const ei_learning_block_t ei_learning_blocks[ei_learning_blocks_size] = {{
+    {{
+        {learn_id},
+        &run_nn_inference,
+        (void*)&ei_learning_block_config_{learn_id},
+        EI_CLASSIFIER_IMAGE_SCALING_NONE,
+        ei_learning_block_{learn_id}_inputs,
+        ei_learning_block_{learn_id}_inputs_size,
+    }},
+}};
+
+const ei_model_performance_calibration_t ei_calibration = {{
+    1, /* integer version number */
+    false, /* has configured performance calibration */
+    (int32_t)(EI_CLASSIFIER_RAW_SAMPLES_PER_FRAME / ((EI_CLASSIFIER_FREQUENCY > 0) ? EI_CLASSIFIER_FREQUENCY : 1)) * 1000, /* Model window */
+    0.8f, /* Default threshold */
+    (int32_t)(EI_CLASSIFIER_RAW_SAMPLES_PER_FRAME / ((EI_CLASSIFIER_FREQUENCY > 0) ? EI_CLASSIFIER_FREQUENCY : 1)) * 500, /* Half of model window */
+    0   /* Don't use flags */
+}};
+
+const ei_object_detection_nms_config_t ei_object_detection_nms = {{
+    0.0f, /* NMS confidence threshold */
+    0.2f  /* NMS IOU threshold */
+}};
+
+const ei_impulse_t impulse_{project_id}_{version} = {{
+    .project_id = {project_id},
+    .project_owner = "Benchmark",
+    .project_name = "bench-{project_id}",
+    .deploy_version = {version},
+
+    .nn_input_frame_size = 33,
+    .raw_sample_count = 125,
+    .raw_samples_per_frame = 3,
+    .dsp_input_frame_size = 125 * 3,
+    .input_width = 0,
+    .input_height = 0,
+    .input_frames = 0,
+    .interval_ms = 16,
+    .frequency = 62.5,
+
+    .dsp_blocks_size = ei_dsp_blocks_size,
+    .dsp_blocks = ei_dsp_blocks,
+
+    .learning_blocks_size = ei_learning_blocks_size,
+    .learning_blocks = ei_learning_blocks,
+
+    .inferencing_engine = {"EI_CLASSIFIER_TFLITE_EON" if eon else "EI_CLASSIFIER_TFLITE"},
+
+    .sensor = EI_CLASSIFIER_SENSOR_ACCELEROMETER,
+    .fusion_string = "accX + accY + accZ",
+    .slice_size = (125/4),
+    .slices_per_model_window = 4,
+
+    .has_anomaly = EI_ANOMALY_TYPE_UNKNOWN,
+    .label_count = {len(labels)},
+    .calibration = ei_calibration,
+    .categories = ei_classifier_inferencing_categories,
+    .object_detection_nms = ei_object_detection_nms
+}};
+
+ei_impulse_handle_t impulse_handle_{project_id}_{version} = ei_impulse_handle_t( &impulse_{project_id}_{version} );
+ei_impulse_handle_t& ei_default_impulse = impulse_handle_{project_id}_{version};
+
+#endif // _EI_CLASSIFIER_MODEL_VARIABLES_H_
+"""
+
+# Build the ZIP export of a project. Content only depends on the arguments, model_size is
+# the approximate size in bytes of the weights array in the model source.
+def make_export(project_id, version, eon = True, model_size = 256 * 1024, sdk_files = 200, sdk_file_size = 4096):
+    rnd = random.Random(project_id)
+    learn_id = 5 + project_id % 7
+    dsp_id = 2 + project_id % 3
+    labels = [f"label{i}" for i in range(2 + project_id % 3)]
+    fft = [1 if rnd.random() < 0.3 else 0 for _ in range(8)]
+    ops = ["ADD", "CONV_2D", "DEPTHWISE_CONV_2D", "FULLY_CONNECTED", "RESHAPE", "SOFTMAX"]
+    used_ops = sorted(rnd.sample(ops, 3))
+    # With EON, the entry points tflite_learn_<block>_init... are in tflite_learn_<block>_compiled.cpp
+    model_name = f"tflite_learn_{learn_id}"
+    model_file = f"{model_name}_compiled" if eon else model_name
+    arena_size = 1024 * (2 + project_id % 5)
+
+    # About 5 characters per int8 weight in the C array
+    weights = ", ".join(str(w) for w in rnd.choices(range(-128, 128), k=max(model_size // 5, 1)))
+    # Table identical in every project, as the tables of models sharing an architecture
+    table = ", ".join(str(i * 3 % 251) for i in range(256))
+    arrays = (f"const ALIGN(16) int8_t tensor_data0[{weights.count(',') + 1}] = {{ {weights} }};\n"
+              f"const ALIGN(16) int32_t tensor_data1[256] = {{ {table} }};\n")
+    if eon:
+        # Tensor arena allocated as in the sources of the EON compiler
+        model_source = (f'#include "{model_file}.h"\n#include <string.h>\n\nnamespace {{\n\nconstexpr int kTensorArenaSize = {arena_size};\n\n'
+                        "#if defined(EI_CLASSIFIER_ALLOCATION_STATIC)\nuint8_t tensor_arena[kTensorArenaSize] ALIGN(16);\n"
+                        "#else\n#define EI_CLASSIFIER_ALLOCATION_HEAP 1\nuint8_t* tensor_arena = NULL;\n#endif\n\n"
+                        f"{arrays}}} // namespace\n\n"
+                        f"TfLiteStatus {model_name}_init(void*(*alloc_fnc)(size_t,size_t)) {{\n"
+                        "#ifdef EI_CLASSIFIER_ALLOCATION_HEAP\n  tensor_arena = (uint8_t*) alloc_fnc(16, kTensorArenaSize);\n"
+                        "#else\n  memset(tensor_arena, 0, kTensorArenaSize);\n#endif\n  return kTfLiteOk;\n}\n")
+    else:
+        model_source = (f'#include "{model_file}.h"\n\nnamespace {{\n{arrays}}} // namespace\n\n'
+                        f"const unsigned char {model_name}[] = {{ 0x1c, 0x00 }};\nconst unsigned int {model_name}_len = 2;\n")
+    files = {
+        f"tflite-model/{model_file}.h": f"#include <stdint.h>\n\nTfLiteStatus {model_name}_init(void*(*alloc_fnc)(size_t,size_t));\n" if eon
+            else f"#include <stdint.h>\n\nextern const unsigned char {model_name}[];\nextern const unsigned int {model_name}_len;\nconst size_t {model_name}_arena_size = {arena_size};\n",
+        f"tflite-model/{model_file}.cpp": model_source,
+        "tflite-model/trained_model_ops_define.h": "#ifndef EI_TFLITE_OPS_DEFINE_H\n#define EI_TFLITE_OPS_DEFINE_H\n\n"
+            + "".join(f"#define EI_TFLITE_DISABLE_{op}_IN_U8 1\n" for op in ops if op not in used_ops) + "\n#endif\n",
+        "tflite-model/tflite-resolver.h": "#ifndef EI_TFLITE_RESOLVER_H\n#define EI_TFLITE_RESOLVER_H\n\n"
+            + f"#define EI_TFLITE_RESOLVER static tflite::MicroMutableOpResolver<{len(used_ops)}> resolver; \\\n"
+            + "".join(f"    resolver.Add{op.title().replace('_', '')}(); \\\n" for op in used_ops[:-1])
+            + f"    resolver.Add{used_ops[-1].title().replace('_', '')}();\n\n#endif\n",
+        "model-parameters/model_metadata.h": _metadata_h(project_id, labels, fft),
+        "model-parameters/model_variables.h": _variables_h(project_id, version, model_name, model_file, learn_id, dsp_id, labels, eon),
+        "CMakeLists.txt": "cmake_minimum_required(VERSION 3.13.1)\n",
+        "README.txt": f"Synthetic export of project {project_id}, deployment version {version}\n",
+    }
+    sdk_line = "// edge-impulse-sdk synthetic source\n"
+    for i in range(sdk_files):
+        files[f"edge-impulse-sdk/dir{i % 10}/file{i}.cpp"] = sdk_line * max(sdk_file_size // len(sdk_line), 1)
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buf.getvalue()
+
+class MockStudio:
+
+    def __init__(self, model_size = 256 * 1024, sdk_files = 200, sdk_file_size = 4096, latency = 0.0,
+                 build_duration = 2.0, bandwidth = None, has_deployment = True, stdout_count = True, stdout_offset = True):
+        self.model_size = model_size
+        self.sdk_files = sdk_files
+        self.sdk_file_size = sdk_file_size
+        # Delay in seconds added to every request
+        self.latency = latency
+        # Time a build job takes, in seconds
+        self.build_duration = build_duration
+        # Download speed limit in Bytes/s, None for no limit
+        self.bandwidth = bandwidth
+        # False: projects have no build until one is requested
+        self.has_deployment = has_deployment
+        # False: the job stdout has no totalCount / ignores the offset query, as older Studio APIs
+        self.stdout_count = stdout_count
+        self.stdout_offset = stdout_offset
+        self.server = None
+        self._lock = threading.Lock()
+        self._exports = {}
+        self._versions = {}
+        self._built = set()
+        self._jobs = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {}
+
+    def get_stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    def _count(self, endpoint, nbytes):
+        with self._lock:
+            stat = self.stats.setdefault(endpoint, {"requests": 0, "bytes": 0})
+            stat["requests"] += 1
+            stat["bytes"] += nbytes
+
+    def version(self, project_id):
+        with self._lock:
+            return self._versions.setdefault(project_id, 1)
+
+    def export(self, project_id, engine):
+        key = (project_id, self.version(project_id), engine)
+        with self._lock:
+            data = self._exports.get(key)
+        if data is None:
+            data = make_export(project_id, key[1], engine == "tflite-eon", self.model_size, self.sdk_files, self.sdk_file_size)
+            with self._lock:
+                self._exports[key] = data
+        return data
+
+    # elapsed: seconds the job has already been running
+    def start_build(self, project_id, elapsed = 0.0):
+        with self._lock:
+            job_id = len(self._jobs) + 1
+            self._jobs[job_id] = {"project_id": project_id, "start": time.monotonic() - elapsed, "done": False}
+        return job_id
+
+    # Status of a job, a finished build bumps the deployment version of its project
+    def job_status(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            elapsed = time.monotonic() - job["start"]
+            if elapsed >= self.build_duration and not job["done"]:
+                job["done"] = True
+                self._versions[job["project_id"]] = self._versions.get(job["project_id"], 1) + 1
+                self._built.add(job["project_id"])
+            return job["done"], elapsed
+
+    def deployment_available(self, project_id):
+        with self._lock:
+            return self.has_deployment or project_id in self._built
+
+    # Listen in a background thread, port 0 picks a free port
+    def start(self, host = "127.0.0.1", port = 0):
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.api_url()
+
+    def api_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def _make_handler(studio):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, endpoint, body, content_type, headers = {}):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                if studio.bandwidth:
+                    chunk_size = 64 * 1024
+                    for offset in range(0, len(body), chunk_size):
+                        self.wfile.write(body[offset:offset + chunk_size])
+                        time.sleep(min(chunk_size, len(body) - offset) / studio.bandwidth)
+                else:
+                    self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # Download aborted by the client
+                return
+            studio._count(endpoint, len(body))
+
+        def send_json(self, endpoint, obj):
+            self.send_body(endpoint, json.dumps(obj).encode(), "application/json")
+
+        def handle_request(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            path = url.path
+            if self.headers.get("Content-Length"):
+                self.rfile.read(int(self.headers["Content-Length"]))
+
+            if path == "/__stats":
+                return self.send_body("stats", json.dumps(studio.get_stats()).encode(), "application/json")
+
+            if studio.latency:
+                time.sleep(studio.latency)
+
+            if not path.startswith(API_PREFIX):
+                return self.send_error(404)
+            path = path[len(API_PREFIX):]
+            api_key = self.headers.get("x-api-key", "")
+
+            if path == "/projects":
+                return self.send_json("projects", {"success": True, "projects": [{"id": project_id_from_key(api_key)}]})
+
+            m = re.match(r"/(\d+)/deployment$", path)
+            if m:
+                project_id = int(m.group(1))
+                return self.send_json("deployment", {"success": True, "hasDeployment": studio.deployment_available(project_id),
+                                                     "version": studio.version(project_id)})
+
+            m = re.match(r"/(\d+)/deployment/download$", path)
+            if m:
+                project_id = int(m.group(1))
+                engine = query.get("engine", ["tflite-eon"])[0]
+                filename = f"bench-{project_id}-v{studio.version(project_id)}.zip"
+                return self.send_body("download", studio.export(project_id, engine), "application/zip",
+                                      {"Content-Disposition": f"attachment; filename*=utf-8''{filename}"})
+
+            m = re.match(r"/(\d+)/jobs/build-ondevice-model$", path)
+            if m:
+                return self.send_json("build", {"success": True, "id": studio.start_build(int(m.group(1)))})
+
+            m = re.match(r"/(\d+)/jobs/(\d+)/status$", path)
+            if m:
+                done, _ = studio.job_status(int(m.group(2)))
+                job = {"id": int(m.group(2))}
+                if done:
+                    job["finished"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                    job["finishedSuccessful"] = True
+                return self.send_json("job status", {"success": True, "job": job})
+
+            m = re.match(r"/(\d+)/jobs/(\d+)/stdout$", path)
+            if m:
+                _, elapsed = studio.job_status(int(m.group(2)))
+                total = int(min(elapsed, studio.build_duration) * STDOUT_LINES_PER_S)
+                # Newest line first, as returned by Studio
+                lines = [{"data": f"Building... step {i}"} for i in range(total - 1, -1, -1)]
+                offset = int(query.get("offset", ["0"])[0]) if studio.stdout_offset else 0
+                if "limit" in query:
+                    lines = lines[offset:offset + int(query["limit"][0])]
+                else:
+                    lines = lines[offset:]
+                body = {"success": True, "stdout": lines}
+                if studio.stdout_count:
+                    body["totalCount"] = total
+                return self.send_json("job stdout", body)
+
+            self.send_json("unknown", {"success": False, "error": f"Unknown endpoint {path}"})
+
+        def do_GET(self):
+            self.handle_request()
+
+        def do_POST(self):
+            self.handle_request()
+
+    return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Studio API serving synthetic exports")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--model-size-kb", type=int, default=256, help="Approximate size of the weights in each model source, in kB")
+    parser.add_argument("--sdk-files", type=int, default=200, help="Number of files in the synthetic SDK")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every request")
+    parser.add_argument("--build-s", type=float, default=2, help="Duration of a build job")
+    parser.add_argument("--bandwidth-mbps", type=float, help="Download speed limit in MB/s")
+    parser.add_argument("--no-deployment", action="store_true", help="Projects need a build before they can be downloaded")
+    args = parser.parse_args()
+
+    studio = MockStudio(model_size = args.model_size_kb * 1024, sdk_files = args.sdk_files, latency = args.latency_ms / 1000,
+                        build_duration = args.build_s, bandwidth = args.bandwidth_mbps * 1024 * 1024 if args.bandwidth_mbps else None,
+                        has_deployment = not args.no_deployment)
+    url = studio.start(args.host, args.port)
+    print(f"Mock Studio API listening on {url}, statistics on http://{args.host}:{args.port}/__stats", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        studio.stop()
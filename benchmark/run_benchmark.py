@@ -0,0 +1,122 @@
+import os, sys, json, time, shutil, argparse, tempfile, statistics, subprocess
+from mock_studio import MockStudio
+
+# End-to-end benchmark: runs generate.py against the mock Studio API for several numbers
+# of impulses and reports wall time, peak RSS and the bytes transferred per stage.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+# Run generate.py once, returns its wall time, peak RSS and exit code
+def run_generate(cmd, log_path):
+    with open(log_path, 'w') as log:
+        start = time.monotonic()
+        process = subprocess.Popen(cmd, cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 returns the resource usage of this child only, including the worker processes it waited for
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.monotonic() - start
+    # ru_maxrss is in kB on Linux, in Bytes on macOS
+    peak_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return wall_time, peak_rss, os.waitstatus_to_exitcode(status)
+
+def run_benchmark(studio, impulses, args, extra_args):
+    api_url = studio.api_url()
+    keys = ",".join(f"bench-{1000 + i}" for i in range(impulses))
+    quantization_map = ",".join("1" for _ in range(impulses))
+
+    runs = []
+    for repeat in range(args.repeat):
+        work_dir = tempfile.mkdtemp(prefix=f"ei-bench-{impulses}-")
+        out_dir = os.path.join(work_dir, "out")
+        cmd = [sys.executable, os.path.join(REPO_DIR, "generate.py"),
+               "--api-url", api_url, "--api-keys", keys, "--quantization-map", quantization_map,
+               "--out-directory", out_dir, "--engine", args.engine] + extra_args
+
+        studio.reset_stats()
+        log_path = os.path.join(work_dir, "generate.log")
+        wall_time, peak_rss, returncode = run_generate(cmd, log_path)
+        if returncode != 0:
+            with open(log_path, 'r') as log:
+                tail = log.readlines()[-20:]
+            raise Exception(f"generate.py failed for {impulses} impulses (exit code {returncode}):\n" + "".join(tail))
+
+        archives = [f for f in os.listdir(out_dir) if f.startswith("deploy")]
+        # Stage timings and counters recorded by generate.py itself
+        report = {}
+        if os.path.exists(os.path.join(out_dir, "build-report.json")):
+            with open(os.path.join(out_dir, "build-report.json"), 'r') as file:
+                report = json.load(file)
+        runs.append({
+            "wall_time_s": wall_time,
+            "peak_rss_bytes": peak_rss,
+            "api": studio.get_stats(),
+            "output_bytes": dir_size(os.path.join(out_dir, "output")),
+            "archive_bytes": sum(os.path.getsize(os.path.join(out_dir, f)) for f in archives),
+            "stages_s": report.get("stages_s", {}),
+            "counters": report.get("counters", {}),
+        })
+        if args.keep:
+            print(f"  output kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir)
+
+    return {
+        "impulses": impulses,
+        "wall_time_s": statistics.median(run["wall_time_s"] for run in runs),
+        "peak_rss_bytes": max(run["peak_rss_bytes"] for run in runs),
+        "runs": runs,
+    }
+
+def print_result(result):
+    run = result["runs"][-1]
+    print(f"{result['impulses']:>3} impulses: {result['wall_time_s']:8.2f} s, peak RSS {result['peak_rss_bytes'] / (1024 * 1024):8.1f} MB")
+    for endpoint, stat in sorted(run["api"].items()):
+        print(f"      {endpoint:<12} {stat['requests']:6} requests {stat['bytes'] / 1024:12.1f} kB")
+    print(f"      {'output':<12} {'':6}          {run['output_bytes'] / 1024:12.1f} kB")
+    print(f"      {'archive':<12} {'':6}          {run['archive_bytes'] / 1024:12.1f} kB")
+    for stage, duration in run["stages_s"].items():
+        print(f"      {stage:<24} {duration:8.3f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generate.py against a local mock Studio API",
+                                     epilog="Arguments after -- are passed to generate.py")
+    parser.add_argument("--impulses", type=str, default="2,4,8,16", help="Numbers of impulses to benchmark, separated by a comma")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per number of impulses, the median wall time is reported")
+    parser.add_argument("--engine", type=str, choices = ['eon', 'tflite'], default='eon')
+    parser.add_argument("--model-size-kb", type=int, default=256, help="Approximate size of the weights in each model source, in kB")
+    parser.add_argument("--sdk-files", type=int, default=200, help="Number of files in the synthetic SDK")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every API request")
+    parser.add_argument("--build-s", type=float, default=2, help="Duration of a build job")
+    parser.add_argument("--bandwidth-mbps", type=float, help="Download speed limit in MB/s")
+    parser.add_argument("--no-deployment", action="store_true", help="Every project has to be built before it is downloaded")
+    parser.add_argument("--output", type=str, help="Write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="Keep the output of each run")
+
+    argv = sys.argv[1:]
+    extra_args = []
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    studio = MockStudio(model_size = args.model_size_kb * 1024, sdk_files = args.sdk_files, latency = args.latency_ms / 1000,
+                        build_duration = args.build_s, bandwidth = args.bandwidth_mbps * 1024 * 1024 if args.bandwidth_mbps else None,
+                        has_deployment = not args.no_deployment)
+    studio.start()
+    print(f"Mock Studio API on {studio.api_url()}")
+
+    results = []
+    try:
+        for impulses in [int(n) for n in args.impulses.split(",")]:
+            result = run_benchmark(studio, impulses, args, extra_args)
+            print_result(result)
+            results.append(result)
+    finally:
+        studio.stop()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({"settings": vars(args), "generate_args": extra_args, "results": results}, file, indent=2)
+        print(f"Results saved in {args.output}")
@@ -0,0 +1,296 @@
+import os, re, glob, hashlib
+import logging
+from utils import MacroTable
+
+logging.basicConfig()
+
+logger = logging.getLogger("build_profile")
+logger.setLevel(logging.INFO)
+
+# 'default' keeps the Makefile of templates/ as-is
+BUILD_PROFILES = ['default', 'size', 'speed', 'debug']
+
+# Flags of each profile, they replace the -Os and -g of the default Makefile.
+# gc_sections drops the unused functions and data at link time, cmsis_nn enables CMSIS-NN on Arm hosts.
+PROFILES = {
+    'size': {
+        'cflags': ['-Os', '-ffunction-sections', '-fdata-sections', '-flto'],
+        'ldflags': ['-Os', '-flto'],
+        'gc_sections': True,
+        'cmsis_nn': True,
+        'march': None,
+        'ndebug': True,
+    },
+    'speed': {
+        'cflags': ['-O3', '-ffunction-sections', '-fdata-sections', '-flto'],
+        'ldflags': ['-O3', '-flto'],
+        'gc_sections': True,
+        'cmsis_nn': True,
+        'march': 'native',
+        'ndebug': True,
+    },
+    'debug': {
+        'cflags': ['-O0', '-g3', '-fno-omit-frame-pointer'],
+        'ldflags': [],
+        'gc_sections': False,
+        'cmsis_nn': False,
+        'march': None,
+        'ndebug': False,
+    },
+}
+
+KERNELS_DIR = "edge-impulse-sdk/tensorflow/lite/micro/kernels"
+
+# TFLM kernel sources implementing each op, ops are normalized with normalize_op().
+# The *_common sources and the helpers (kernel_util, micro_tensor_utils...) are always compiled.
+KERNEL_SOURCES = {
+    'abs': ['elementwise'], 'sin': ['elementwise'], 'cos': ['elementwise'], 'log': ['elementwise'],
+    'sqrt': ['elementwise'], 'rsqrt': ['elementwise'], 'square': ['elementwise'], 'logicalnot': ['elementwise'],
+    'add': ['add'], 'addn': ['add_n'],
+    'argmax': ['arg_min_max'], 'argmin': ['arg_min_max'],
+    'assignvariable': ['assign_variable'], 'readvariable': ['read_variable'], 'varhandle': ['var_handle'],
+    'averagepool2d': ['pooling'], 'maxpool2d': ['pooling'], 'l2pool2d': ['l2_pool_2d'],
+    'batchtospacend': ['batch_to_space_nd'], 'spacetobatchnd': ['space_to_batch_nd'],
+    'broadcastargs': ['broadcast_args'], 'broadcastto': ['broadcast_to'],
+    'callonce': ['call_once'], 'if': ['if'], 'while': ['while'],
+    'cast': ['cast'], 'ceil': ['ceil'], 'floor': ['floor'], 'round': ['round'],
+    'circularbuffer': ['circular_buffer'],
+    'concatenation': ['concatenation'],
+    'conv2d': ['conv'], 'depthwiseconv2d': ['depthwise_conv'], 'transposeconv': ['transpose_conv'],
+    'cumsum': ['cumsum'],
+    'depthtospace': ['depth_to_space'], 'spacetodepth': ['space_to_depth'],
+    'dequantize': ['dequantize'], 'quantize': ['quantize'],
+    'detectionpostprocess': ['detection_postprocess'],
+    'div': ['div'], 'floordiv': ['floor_div'], 'floormod': ['floor_mod'],
+    'elu': ['elu'], 'exp': ['exp'], 'neg': ['neg'],
+    'equal': ['comparisons'], 'notequal': ['comparisons'], 'greater': ['comparisons'],
+    'greaterequal': ['comparisons'], 'less': ['comparisons'], 'lessequal': ['comparisons'],
+    'expanddims': ['expand_dims'], 'fill': ['fill'], 'zeroslike': ['zeros_like'],
+    'fullyconnected': ['fully_connected'],
+    'gather': ['gather'], 'gathernd': ['gather_nd'],
+    'hardswish': ['hard_swish'],
+    'l2normalization': ['l2norm'],
+    'leakyrelu': ['leaky_relu'],
+    'logsoftmax': ['log_softmax'], 'softmax': ['softmax'],
+    'logicaland': ['logical'], 'logicalor': ['logical'],
+    'logistic': ['logistic'], 'tanh': ['tanh'],
+    'maximum': ['maximum_minimum'], 'minimum': ['maximum_minimum'],
+    'mean': ['reduce'], 'sum': ['reduce'], 'reducemax': ['reduce'], 'reducemin': ['reduce'],
+    'mirrorpad': ['mirror_pad'], 'pad': ['pad'], 'padv2': ['pad'],
+    'mul': ['mul'], 'sub': ['sub'], 'squareddifference': ['squared_difference'],
+    'pack': ['pack'], 'unpack': ['unpack'],
+    'prelu': ['prelu'],
+    'relu': ['activations'], 'relu6': ['activations'],
+    'reshape': ['reshape'], 'squeeze': ['squeeze'], 'shape': ['shape'],
+    'resizebilinear': ['resize_bilinear'], 'resizenearestneighbor': ['resize_nearest_neighbor'],
+    'select': ['select'], 'selectv2': ['select'],
+    'slice': ['slice'], 'stridedslice': ['strided_slice'],
+    'split': ['split'], 'splitv': ['split_v'],
+    'svdf': ['svdf'],
+    'transpose': ['transpose'],
+    'unidirectionalsequencelstm': ['unidirectional_sequence_lstm', 'lstm_eval'],
+}
+
+# Registers every op, it cannot be linked once kernels are pruned
+ALL_OPS_RESOLVER = "edge-impulse-sdk/tensorflow/lite/micro/all_ops_resolver.cc"
+
+# CONV_2D, Conv2D and conv2d are the same op
+def normalize_op(name):
+    return name.replace('_', '').lower()
+
+# Ops used by the merged models: entries of the merged op resolver with the tflite engine, kernels
+# registered by the compiled models with EON. trained_model_ops_define.h only disables type
+# variants of the ops, it does not tell which ops are used.
+def used_ops(target_dir, engine):
+    ops = set()
+    resolver = os.path.join(target_dir, "tflite-model/tflite-resolver.h")
+    if engine == 'tflite' and os.path.exists(resolver):
+        with open(resolver, 'r') as file:
+            ops.update(normalize_op(op) for op in re.findall(r'resolver\.Add(\w+)\(', file.read()))
+    for source in glob.glob(os.path.join(target_dir, "tflite-model/*.cpp")):
+        with open(source, 'r') as file:
+            ops.update(normalize_op(op) for op in re.findall(r'\bRegister_(\w+)\(', file.read()))
+    return ops
+
+# Kernel sources of the SDK implementing ops that none of the models use, relative to target_dir.
+# None if an op is unknown, as its kernel sources cannot be told apart from the others.
+def unused_kernel_sources(target_dir, ops):
+    unknown = [op for op in ops if op not in KERNEL_SOURCES]
+    if unknown:
+        logger.warning(f"Unknown ops {', '.join(sorted(unknown))}, kernels are not pruned")
+        return None
+    if not ops:
+        logger.warning("No ops found in the models, kernels are not pruned")
+        return None
+    if not os.path.isdir(os.path.join(target_dir, KERNELS_DIR)):
+        logger.warning("No TFLM kernels in the SDK, kernels are not pruned")
+        return None
+    needed = set(stem for op in ops for stem in KERNEL_SOURCES[op])
+    known = set(stem for stems in KERNEL_SOURCES.values() for stem in stems)
+    unused = []
+    for path in sorted(glob.glob(os.path.join(target_dir, KERNELS_DIR, "*.cc"))):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stem in known and stem not in needed:
+            unused.append(f"{KERNELS_DIR}/{stem}.cc")
+    return unused
+
+def _profile_code(profile, march):
+    settings = PROFILES[profile]
+    code = f"# Build profile: {profile}\n"
+    code += "".join(f"CFLAGS += {flag}\n" for flag in settings['cflags'])
+    code += "CFLAGS += -MMD -MP\t\t\t\t\t# Dependency files, sources are rebuilt when a header changes\n"
+    if march:
+        code += f"MARCH ?= {march}\n"
+        code += "ifneq ($(MARCH),)\nCFLAGS += -march=$(MARCH)\nendif\n"
+    code += "".join(f"LDFLAGS += {flag}\n" for flag in settings['ldflags'])
+    if settings['gc_sections']:
+        # ld64 of macOS does not know --gc-sections
+        code += ("ifneq ($(OS), Windows_NT)\n"
+                 "ifeq ($(shell uname -s), Darwin)\n"
+                 "LDFLAGS += -Wl,-dead_strip\n"
+                 "else\n"
+                 "LDFLAGS += -Wl,--gc-sections\n"
+                 "endif\n"
+                 "else\n"
+                 "LDFLAGS += -Wl,--gc-sections\n"
+                 "endif\n")
+    if settings['cmsis_nn']:
+        code += ("ifneq ($(OS), Windows_NT)\n"
+                 "ifneq ($(filter arm% aarch64,$(shell uname -m)),)\n"
+                 "CMSIS_NN ?= 1\n"
+                 "endif\n"
+                 "endif\n")
+    return code + "\n"
+
+# Rewrite the Makefile of the output for a build profile, with dependency files, and optionally
+# without the TFLM kernels of the ops unused by the models
+def generate_makefile(target_dir, profile, engine, march = None, prune_kernels = False):
+    if profile == 'default' and not prune_kernels:
+        return
+    makefile = os.path.join(target_dir, 'Makefile')
+    with open(makefile, 'r') as file:
+        lines = file.readlines()
+
+    if profile != 'default':
+        settings = PROFILES[profile]
+        removed = [r'CFLAGS \+= -Os\b', r'CFLAGS \+= -g\b']
+        if not settings['ndebug']:
+            removed.append(r'CFLAGS \+= -DNDEBUG\b')
+        lines = [line for line in lines if not any(re.match(pattern, line) for pattern in removed)]
+        idx = lines.index("# C++ only compiler flags\n")
+        lines[idx:idx] = [_profile_code(profile, march if march is not None else settings['march'])]
+
+        # Dependency files of the objects, and their removal on clean. The headers become prerequisites
+        # of the objects, so only the source ($<) is compiled
+        lines = [line.replace("-c $^ -o $@", "-c $< -o $@") for line in lines]
+        if not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        lines.append("\n# Header dependencies generated by -MMD\n")
+        lines.append("DEPFILES := $(COBJECTS:.o=.d) $(CXXOBJECTS:.o=.d) $(CCOBJECTS:.o=.d)\n")
+        lines.append("-include $(DEPFILES)\n")
+        idx = lines.index("\trm -f $(CXXOBJECTS)\n") + 1
+        lines[idx:idx] = ["\trm -f $(DEPFILES)\n"]
+        idx = [i for i, line in enumerate(lines) if line.startswith("\tdel /Q") and "CCSOURCES" in line][0] + 1
+        lines[idx:idx] = ["\tdel /Q $(subst /,\\,$(DEPFILES)) >nul 2>&1 || exit 0\n"]
+        logger.info(f"Makefile generated for the {profile} profile")
+
+    if prune_kernels:
+        unused = unused_kernel_sources(target_dir, used_ops(target_dir, engine))
+        if unused is not None:
+            code = "# TFLM kernels of the ops that no model uses\n"
+            code += "PRUNED_SOURCES = " + " \\\n\t\t\t\t".join([ALL_OPS_RESOLVER] + unused) + "\n"
+            code += "CCSOURCES := $(filter-out $(PRUNED_SOURCES),$(CCSOURCES))\n\n"
+            idx = lines.index("# Generate names for the output object files (*.o)\n")
+            lines[idx:idx] = [code]
+            logger.info(f"{len(unused)} unused TFLM kernel sources excluded from the build")
+
+    with open(makefile, 'w') as file:
+        file.writelines(lines)
+
+# Deployment specific macros of model_metadata.h, they do not change how the SDK is compiled
+DEPLOYMENT_MACROS = re.compile(r'\s*#define\s+EI_CLASSIFIER_PROJECT_\w+')
+
+# Part of the SDK cache key known at generation: the Studio version (shared by all projects, see
+# compare_version) and the headers of the output included by the SDK sources
+def _sdk_config(target_dir):
+    table = MacroTable.from_file(os.path.join(target_dir, "model-parameters/model_metadata.h"))
+    version = ".".join(str(table.get(f"EI_STUDIO_VERSION_{part}")) for part in ["MAJOR", "MINOR", "PATCH"])
+    digest = hashlib.sha256(version.encode())
+    for header in ["model-parameters/model_metadata.h", "tflite-model/trained_model_ops_define.h"]:
+        path = os.path.join(target_dir, header)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                digest.update("".join(line for line in file if not DEPLOYMENT_MACROS.match(line)).encode())
+    return version, digest.hexdigest()[:16]
+
+# Link the app against a static library of the SDK objects kept in a cache directory, keyed by the
+# Studio version, the headers, the compiler, the flags and the SDK sources. Only the model sources
+# and main.cpp are compiled once the library is in the cache. Call after generate_makefile.
+# cache_dir is the default of EI_SDK_CACHE, empty to only use the cache when EI_SDK_CACHE is set.
+def add_sdk_cache(target_dir, cache_dir):
+    version, config = _sdk_config(target_dir)
+    makefile = os.path.join(target_dir, 'Makefile')
+    with open(makefile, 'r') as file:
+        lines = file.readlines()
+
+    code = ("# Cache of the compiled SDK (not on Windows): the SDK objects are archived once in\n"
+            "# $(EI_SDK_CACHE)/<Studio version>/<key>/libei_sdk.a and the app is linked against it.\n"
+            "# The key covers the model headers, the compiler, the flags and the list of SDK sources. Disable with make EI_SDK_CACHE=\n"
+            f"EI_SDK_CACHE ?= {cache_dir}\n"
+            "ifneq ($(OS), Windows_NT)\n"
+            "ifneq ($(EI_SDK_CACHE),)\n"
+            f"SDK_CONFIG = {config}\n"
+            "SDK_OBJECTS := $(filter-out source/% tflite-model/%,$(COBJECTS) $(CXXOBJECTS) $(CCOBJECTS))\n"
+            "SDK_KEY := $(shell (echo '$(SDK_CONFIG)'; $(CC) --version | head -n 1; $(CXX) --version | head -n 1; \\\n"
+            "\techo '$(strip $(CFLAGS) $(CXXFLAGS))'; echo '$(sort $(SDK_OBJECTS))') | cksum | cut -d ' ' -f 1)\n"
+            f"SDK_LIB := $(EI_SDK_CACHE)/{version}/$(SDK_KEY)/libei_sdk.a\n"
+            "# Compiled in a directory of the key, objects built with other flags are never archived\n"
+            "SDK_BUILD_PATH := $(BUILD_PATH)/sdk/$(SDK_KEY)\n"
+            "SDK_LIB_OBJECTS := $(addprefix $(SDK_BUILD_PATH)/,$(SDK_OBJECTS))\n"
+            "# Archives of LTO objects need the linker plugin\n"
+            "ifneq ($(filter -flto,$(CFLAGS)),)\n"
+            "ifneq ($(shell uname -s), Darwin)\n"
+            "SDK_AR ?= gcc-ar\n"
+            "endif\n"
+            "endif\n"
+            "SDK_AR ?= $(AR)\n"
+            "COBJECTS := $(filter-out $(SDK_OBJECTS),$(COBJECTS))\n"
+            "CXXOBJECTS := $(filter-out $(SDK_OBJECTS),$(CXXOBJECTS))\n"
+            "CCOBJECTS := $(filter-out $(SDK_OBJECTS),$(CCOBJECTS))\n"
+            "endif\n"
+            "endif\n\n")
+    idx = lines.index("# Default rule\n")
+    lines[idx:idx] = [code]
+
+    idx = lines.index("\trm -f $(CXXOBJECTS)\n") + 1
+    lines[idx:idx] = ["\trm -rf $(BUILD_PATH)/sdk\n"]
+    # Only the app links the library, the shared library of the Python bridge compiles its own objects
+    lines = [line.replace("$(CCOBJECTS) -o $(BUILD_PATH)/$(NAME)", "$(CCOBJECTS) $(SDK_LIB) -o $(BUILD_PATH)/$(NAME)") for line in lines]
+
+    # The SDK objects are only compiled when the library is not in the cache yet. It is published
+    # with a rename, concurrent builds never see a partial archive.
+    if not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    lines.append("\n# Library of the SDK objects, see EI_SDK_CACHE\n"
+                 "ifneq ($(SDK_LIB),)\n"
+                 "app: $(SDK_LIB)\n"
+                 "ifeq ($(wildcard $(SDK_LIB)),)\n"
+                 "$(SDK_LIB): $(SDK_LIB_OBJECTS)\n"
+                 "\tmkdir -p $(dir $@)\n"
+                 "\t$(SDK_AR) rcs $@.$$$$ $(SDK_LIB_OBJECTS) && mv -f $@.$$$$ $@\n"
+                 "endif\n"
+                 "$(SDK_BUILD_PATH)/%.o: %.c\n"
+                 "\t@mkdir -p $(dir $@)\n"
+                 "\t$(CC) $(CFLAGS) -c $< -o $@\n"
+                 "$(SDK_BUILD_PATH)/%.o: %.cc\n"
+                 "\t@mkdir -p $(dir $@)\n"
+                 "\t$(CXX) $(CFLAGS) $(CXXFLAGS) -c $< -o $@\n"
+                 "$(SDK_BUILD_PATH)/%.o: %.cpp\n"
+                 "\t@mkdir -p $(dir $@)\n"
+                 "\t$(CXX) $(CFLAGS) $(CXXFLAGS) -c $< -o $@\n"
+                 "-include $(SDK_LIB_OBJECTS:.o=.d)\n"
+                 "endif\n")
+
+    with open(makefile, 'w') as file:
+        file.writelines(lines)
+    logger.info(f"Makefile linked against the SDK cache ({cache_dir if cache_dir else '$EI_SDK_CACHE'}, Studio version {version})")
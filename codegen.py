@@ -0,0 +1,152 @@
+import os, shutil
+import logging
+
+logging.basicConfig()
+
+logger = logging.getLogger("codegen")
+logger.setLevel(logging.INFO)
+
+# C++ sources of the generated applications, other than the example of templates/
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+
+# Applications that can be generated in source/main.cpp
+APPS = ['example', 'benchmark', 'stream']
+
+# Insert code after each marker line of a template, lines as returned by readlines()
+def insert_at_markers(lines, code_by_marker):
+    for marker, code in code_by_marker.items():
+        idx = lines.index(marker + "\n") + 1
+        lines[idx:idx] = [code]
+    return lines
+
+def render_template(template_path, out_path, code_by_marker):
+    with open(template_path, 'r') as file:
+        lines = file.readlines()
+    insert_at_markers(lines, code_by_marker)
+    with open(out_path, 'w') as file:
+        file.writelines(lines)
+
+# Append compiler and linker flags to the Makefile of the output, before the source lists
+def add_makefile_flags(target_dir, cflags = [], ldflags = []):
+    makefile = os.path.join(target_dir, 'Makefile')
+    with open(makefile, 'r') as file:
+        lines = file.readlines()
+    code = "".join(f"CFLAGS += {flag}\n" for flag in cflags) + "".join(f"LDFLAGS += {flag}\n" for flag in ldflags) + "\n"
+    idx = lines.index("# Include C source code for required libraries\n")
+    lines[idx:idx] = [code]
+    with open(makefile, 'w') as file:
+        file.writelines(lines)
+
+# Example features of each project, to be filled by the user. Missing values are zeros.
+def features_code(project_ids):
+    code = "\n"
+    for p in project_ids:
+        code += f"static const float features_{p}[] = {{ 0 }}; // copy features from project {p}\n"
+    return code
+
+# Table of the merged impulses (multi_impulse_t, see app/multi_impulse.h).
+# dsp_groups are the groups of projects with identical DSP blocks, see shared_dsp.py
+def impulse_table_code(project_ids, impulses_id, dsp_groups = []):
+    group_of = {p: g for g, group in enumerate(dsp_groups) for p in group}
+    code = "\nmulti_impulse_t multi_impulses[] = {\n"
+    for p in project_ids:
+        v = impulses_id[p]
+        code += f"    {{ {p}, &impulse_handle_{p}_{v}, &impulse_{p}_{v}, features_{p}, sizeof(features_{p}) / sizeof(float), {group_of.get(p, -1)} }},\n"
+    code += "};\n"
+    code += "const size_t multi_impulses_count = sizeof(multi_impulses) / sizeof(multi_impulses[0]);\n"
+    return code
+
+# Generate source/main.cpp of a table driven application, and copy the headers it needs
+def generate_app(app, target_dir, project_ids, impulses_id, options = {}, dsp_groups = []):
+    source_dir = os.path.join(target_dir, 'source')
+    for header in ['multi_impulse.h', 'heap_tracker.h', 'input_stream.h', 'shared_dsp.h']:
+        shutil.copy(os.path.join(APP_DIR, header), os.path.join(source_dir, header))
+
+    code_by_marker = {
+        "// raw features array inserted here": features_code(project_ids),
+        "// impulse table inserted here": impulse_table_code(project_ids, impulses_id, dsp_groups),
+    }
+    if app == 'benchmark':
+        code_by_marker["// benchmark settings inserted here"] = (
+            f"#define BENCH_WARMUP {options.get('warmup', 10)}\n"
+            f"#define BENCH_ITERATIONS {options.get('iterations', 100)}\n")
+        template = 'benchmark.cpp'
+    elif app == 'stream':
+        # Compile with -DEI_APP_SHARED_DSP=0 to run every impulse through process_impulse
+        code_by_marker["// shared DSP settings inserted here"] = (
+            "#ifndef EI_APP_SHARED_DSP\n"
+            f"#define EI_APP_SHARED_DSP {1 if dsp_groups else 0}\n"
+            "#endif\n")
+        scheduler = options.get('scheduler', 'none')
+        if scheduler != 'none':
+            # Default mode of the app, it can be changed at run time
+            code_by_marker["// scheduler settings inserted here"] = (
+                "#define EI_APP_SCHEDULER 1\n"
+                f"#define EI_APP_SCHEDULER_MODE \"{scheduler}\"\n"
+                f"#define EI_APP_SCHEDULER_DEPTH {options.get('depth', 4)}\n")
+            shutil.copy(os.path.join(APP_DIR, 'scheduler.h'), os.path.join(source_dir, 'scheduler.h'))
+            add_makefile_flags(target_dir, ["-pthread"], ["-lpthread"])
+        template = 'stream.cpp'
+    else:
+        raise(Exception(f'Unknown application {app}'))
+
+    logger.info(f"Generating {app} application in main.cpp")
+    render_template(os.path.join(APP_DIR, template), os.path.join(source_dir, 'main.cpp'), code_by_marker)
+
+# Makefile rules of the shared library loaded by the Python bridge: all sources but main.cpp, plus
+# python/bridge.cpp, compiled with -fPIC in their own directory so they do not clash with the app objects
+LIB_MAKEFILE_CODE = """
+# Shared library of the Python bridge (python/ei_multi_impulse.py), built with make lib
+LIB_BUILD_PATH = $(BUILD_PATH)/lib
+ifeq ($(shell uname -s), Darwin)
+LIB_FILE = $(LIB_BUILD_PATH)/libei_multi_impulse.dylib
+else
+LIB_FILE = $(LIB_BUILD_PATH)/libei_multi_impulse.so
+endif
+LIB_OBJECTS := $(patsubst %.c,$(LIB_BUILD_PATH)/obj/%.o,$(CSOURCES)) \\
+			$(patsubst %.cpp,$(LIB_BUILD_PATH)/obj/%.o,$(filter-out source/main.cpp,$(CXXSOURCES)) python/bridge.cpp) \\
+			$(patsubst %.cc,$(LIB_BUILD_PATH)/obj/%.o,$(CCSOURCES))
+
+$(LIB_BUILD_PATH)/obj/%.o: %.c
+	@mkdir -p $(dir $@)
+	$(CC) $(CFLAGS) -fPIC -c $< -o $@
+$(LIB_BUILD_PATH)/obj/%.o: %.cc
+	@mkdir -p $(dir $@)
+	$(CXX) $(CFLAGS) $(CXXFLAGS) -fPIC -c $< -o $@
+$(LIB_BUILD_PATH)/obj/%.o: %.cpp
+	@mkdir -p $(dir $@)
+	$(CXX) $(CFLAGS) $(CXXFLAGS) -fPIC -c $< -o $@
+
+.PHONY: lib
+lib: $(LIB_FILE)
+
+$(LIB_FILE): $(LIB_OBJECTS)
+	$(CXX) -shared $(LIB_OBJECTS) -o $@ $(LDFLAGS)
+
+-include $(LIB_OBJECTS:.o=.d)
+"""
+
+# Generate the C API of the merged impulses (python/bridge.cpp), its ctypes module and the lib target
+# of the Makefile. global_lock serializes all impulses, for models sharing state (tflite engine, shared arena)
+def generate_python_bridge(target_dir, project_ids, impulses_id, global_lock = False):
+    python_dir = os.path.join(target_dir, 'python')
+    os.makedirs(python_dir, exist_ok=True)
+    shutil.copy(os.path.join(APP_DIR, 'multi_impulse.h'), os.path.join(python_dir, 'multi_impulse.h'))
+    shutil.copy(os.path.join(APP_DIR, 'ei_multi_impulse.py'), os.path.join(python_dir, 'ei_multi_impulse.py'))
+    render_template(os.path.join(APP_DIR, 'python_bridge.cpp'), os.path.join(python_dir, 'bridge.cpp'), {
+        "// bridge settings inserted here": f"#define EI_BRIDGE_GLOBAL_LOCK {1 if global_lock else 0}\n",
+        "// raw features array inserted here": features_code(project_ids),
+        "// impulse table inserted here": impulse_table_code(project_ids, impulses_id),
+    })
+
+    makefile = os.path.join(target_dir, 'Makefile')
+    with open(makefile, 'r') as file:
+        lines = file.readlines()
+    if not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    lines.append(LIB_MAKEFILE_CODE)
+    idx = lines.index("\trm -f $(CXXOBJECTS)\n") + 1
+    lines[idx:idx] = ["\trm -rf $(LIB_BUILD_PATH)\n"]
+    with open(makefile, 'w') as file:
+        file.writelines(lines)
+    logger.info("Python bridge generated in python/, build the library with make lib")
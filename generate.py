@@ -1,6 +1,15 @@
-import os, argparse, tempfile, re, shutil
-from zipfile import ZipFile
-from EIDownload import EIDownload
+import os, argparse, tempfile, re, shutil, threading, atexit, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from EIDownload import EIDownload, StudioClient, JobPoller, STUDIO_API_URL
+from ExportCache import ExportCache
+from BuildManifest import BuildManifest
+from archive import create_archive, ARCHIVE_FORMATS, COMPRESSION_LEVELS
+from instrumentation import metrics
+from codegen import generate_app, generate_python_bridge, APPS
+from shared_dsp import find_shared_dsp
+from build_profile import generate_makefile, add_sdk_cache, BUILD_PROFILES
+from shared_weights import share_identical_weights, remove_shared_weights
+from arena import read_arena_sizes, memory_report, write_memory_report, emit_shared_arena, remove_shared_arena
 from utils import *
 import logging
 
@@ -12,6 +21,32 @@ parser.add_argument('--out-directory', type=str, default='/home/output', require
 parser.add_argument("--force-build", action="store_true", help="Force build libraries, no cache")
 parser.add_argument("--engine", type=str, choices = ['eon', 'tflite'], default='eon', help="Inferencing engine to use.")
 parser.add_argument("--quantization-map", type=str, help="Description of quantization policy for each impulse", required=False)
+parser.add_argument("--cache-dir", type=str, help="Directory of the persistent cache of downloaded exports (disabled if not set)", required=False)
+parser.add_argument("--cache-max-size", type=int, default=4096, help="Maximum size of the export cache in MB")
+parser.add_argument("--incremental", action="store_true", help="Only fetch and process again the projects that changed since the last run in the same output directory")
+parser.add_argument("--direct-write", action="store_true", help="Write rewritten model files straight to the output directory (memory-mapped, no intermediate copies)")
+parser.add_argument("--workers", type=int, help="Number of processes used to edit model files and of threads used to compress the archive (default: number of CPUs)", required=False)
+parser.add_argument("--archive-format", type=str, choices = ARCHIVE_FORMATS, default='zip', help="Format of the deploy archive, 'none' leaves the output directory without archive")
+parser.add_argument("--compression-level", type=int, help="Compression level of the archive, 0-9 for zip (0: store only, default 6), 1-22 for tar.zst (default 3)", required=False)
+parser.add_argument("--jobs", type=int, help="Number of projects to build/download in parallel (default: all of them)", required=False)
+parser.add_argument("--app", type=str, choices = APPS, default='example', help="Application generated in source/main.cpp: 'example' runs each impulse once, 'benchmark' measures latency percentiles and heap usage of each impulse, 'stream' runs the impulses on recorded windows read from files or stdin")
+parser.add_argument("--bench-warmup", type=int, default=10, help="Default number of warm-up iterations of the benchmark application")
+parser.add_argument("--bench-iterations", type=int, default=100, help="Default number of measured iterations of the benchmark application")
+parser.add_argument("--scheduler", type=str, choices = ['none', 'latency', 'throughput'], default='none', help="Run the impulses of the stream application in parallel on worker threads (pthreads), 'latency' runs each sample on all impulses at once, 'throughput' pipelines the samples")
+parser.add_argument("--scheduler-depth", type=int, default=4, help="Number of samples in flight in the throughput mode of the scheduler")
+parser.add_argument("--build-profile", type=str, choices = BUILD_PROFILES, default='default', help="Compiler flags of the generated Makefile: 'size' (-Os, LTO, gc-sections), 'speed' (-O3, LTO, -march, gc-sections), 'debug' (-O0 -g3), 'default' keeps the flags of the template")
+parser.add_argument("--march", type=str, help="Value of -march in the Makefile (default: native for the speed profile, not set otherwise), can be changed with make MARCH=...", required=False)
+parser.add_argument("--prune-kernels", action="store_true", help="Only compile the TFLM kernels of the ops used by the models")
+parser.add_argument("--sdk-cache-dir", type=str, nargs="?", const="", help="Link the app against the SDK objects archived in this directory (EI_SDK_CACHE at build time), compiled on the first build only. Without directory, the cache is only used when EI_SDK_CACHE is set", required=False)
+parser.add_argument("--dedup-weights", action="store_true", help="Define the constant arrays (weights, tables) identical in several model sources once, in shared_weights.cpp")
+parser.add_argument("--shared-arena", action="store_true", help="Share one static tensor arena, sized to the largest one, between the EON compiled models (EI_CLASSIFIER_ALLOCATION_STATIC), the impulses must run one after another")
+parser.add_argument("--python-bridge", action="store_true", help="Also generate a shared library target (make lib) and its ctypes Python module in python/, to run the impulses on batches of windows from Python")
+parser.add_argument("--trace", action="store_true", help="Also save a Chrome trace (build-trace.json) next to the build report")
+parser.add_argument("--api-url", type=str, default=STUDIO_API_URL, help="Base URL of the Studio API")
+parser.add_argument("--http-timeout", type=float, default=60, help="Timeout in seconds for each Studio API request")
+parser.add_argument("--poll-interval", type=float, default=1.0, help="Initial interval in seconds between two build job status checks")
+parser.add_argument("--poll-max-interval", type=float, default=30.0, help="Maximum interval in seconds between two build job status checks")
+parser.add_argument("--http-retries", type=int, default=5, help="Number of retries (with exponential backoff) on 429/5xx Studio API responses")
 
 # EG
 # --api-keys apiA,apiB \
@@ -20,15 +55,54 @@ parser.add_argument("--quantization-map", type=str, help="Description of quantiz
 
 args, unknown = parser.parse_known_args()
 
+if args.compression_level is not None:
+    levels = COMPRESSION_LEVELS.get(args.archive_format)
+    if levels is None:
+        raise(Exception(f'--compression-level cannot be used with --archive-format {args.archive_format}'))
+    if args.compression_level not in levels:
+        raise(Exception(f'--compression-level must be between {levels[0]} and {levels[-1]} with --archive-format {args.archive_format}'))
+if args.march is not None and args.build_profile == 'default':
+    raise(Exception('--march requires --build-profile size, speed or debug, the default profile keeps the flags of the template'))
+if args.scheduler != 'none' and args.app != 'stream':
+    raise(Exception('--scheduler requires --app stream'))
+if args.shared_arena and args.scheduler != 'none':
+    raise(Exception('--shared-arena cannot be used with --scheduler, the impulses would run concurrently on the same arena'))
+if args.engine == 'tflite' and args.scheduler != 'none':
+    raise(Exception('--scheduler cannot be used with --engine tflite, all the models share one op resolver and one tensor arena'))
+
+# Directories that differ between projects, everything else (SDK, build files) is the same
+# for all of them and only taken from the first project
+PROJECT_SPECIFIC_DIRS = ["tflite-model/", "model-parameters/"]
+# Directories copied to the output as-is, hard linked instead of copied when possible
+SHARED_DIRS = ["edge-impulse-sdk"]
+
 logging.basicConfig()
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
 
+# Timings, counters and peak memory of the run are saved in build-report.json, also when it fails
+metrics.set_info("status", "failed")
+metrics.set_info("engine", args.engine)
+def save_report():
+    metrics.stage(None)
+    if os.path.isdir(args.out_directory):
+        metrics.write_report(os.path.join(args.out_directory, "build-report.json"),
+                             os.path.join(args.out_directory, "build-trace.json") if args.trace else None)
+atexit.register(save_report)
+
 # Get projects API Keys
 #projectIDs = args.projects.replace(' ', '').split(',')
 
+# Projects left untouched since the last run, their files are reused as-is
+reused_projects = set()
+# Inputs of the projects processed in this run, recorded in the build manifest
+project_inputs = {}
+manifest = None
+
 ## DOWNLOADING LIBS
 
+metrics.stage("fetch")
+
 # We bypass download if we already have projects locally in a tmp directory
 if not (args.projects and args.tmp_directory):
 
@@ -55,123 +129,261 @@ if not (args.projects and args.tmp_directory):
         if not os.path.exists(args.tmp_directory):
             os.makedirs(args.tmp_directory)
         tmpdir = args.tmp_directory
+    elif args.incremental:
+        # Extracted projects must survive the run to be reused by the next one
+        tmpdir = os.path.join(args.out_directory, "stage")
+        os.makedirs(tmpdir, exist_ok=True)
     else:
         tmpdir = tempfile.mkdtemp()
 
-    project_ids = []
-    # Download C++ libs and unzip
-    for i in range(len(apiKeys)):
-        dzip = EIDownload(api_key = apiKeys[i])
-        project_ids += [str(dzip.get_project_id())]
-
-        download_path = os.path.join(tmpdir, str(project_ids[i]))
-
-        os.makedirs(download_path)
-        if quantizationMap[i] == '0':
-            quantized = False
-        else:
-            quantized = True
-
-        zipfile_path = dzip.download_model(download_path, eon = (args.engine == 'eon'), quantized = quantized, force_build = args.force_build)
-
-        with ZipFile(zipfile_path, 'r') as zObject:
-            zObject.extractall(download_path)
-        os.remove(zipfile_path)
+    if args.incremental:
+        manifest = BuildManifest(os.path.join(args.out_directory, "build-manifest.json"))
+
+    # One pooled HTTP session shared by all projects
+    client = StudioClient(pool_size = len(apiKeys), timeout = args.http_timeout, retries = args.http_retries, base_url = args.api_url)
+    # Set when one project fails so the other workers stop as early as possible
+    abort_event = threading.Event()
+    # One polling loop waits for the build jobs of all projects
+    poller = JobPoller(poll_interval = args.poll_interval, max_poll_interval = args.poll_max_interval, abort_event = abort_event)
+
+    # Exports of unchanged projects are reused from the cache
+    cache = None
+    if args.cache_dir:
+        cache = ExportCache(args.cache_dir, max_size = args.cache_max_size * 1024 * 1024)
+
+    # Errors of the failed projects, in the order they failed
+    failures = []
+
+    # Resolve project ID, build if needed, download and extract the C++ lib of one project
+    def fetch_project(i):
+        project_label = f"#{i}"
+        project_id = None
+        start = time.perf_counter()
+        try:
+            dzip = EIDownload(api_key = apiKeys[i], abort_event = abort_event, client = client, poller = poller)
+            project_id = str(dzip.get_project_id())
+            project_label = f"#{i} (ID {project_id})"
+
+            download_path = os.path.join(tmpdir, project_id)
+
+            if quantizationMap[i] == '0':
+                quantized = False
+            else:
+                quantized = True
+
+            # The 1st project is the base of the output, the other ones get suffixed symbols
+            inputs = {"engine": args.engine, "quantized": quantized, "role": "base" if i == 0 else "suffixed", "shared_arena": args.shared_arena, "dedup_weights": args.dedup_weights}
+            if manifest is not None and not args.force_build:
+                inputs["version"] = dzip.get_deployment_version(eon = (args.engine == 'eon'), quantized = quantized)
+                if inputs["version"] is not None and manifest.is_up_to_date(project_id, inputs):
+                    logger.info(f"Project {project_label} unchanged since last run, reusing it")
+                    reused_projects.add(project_id)
+                    project_inputs[project_id] = manifest.get_inputs(project_id)
+                    return project_id
+
+            # Start from a clean directory, files of a previous run may have been edited
+            if os.path.exists(download_path):
+                shutil.rmtree(download_path)
+            os.makedirs(download_path)
+
+            zipfile_path = dzip.download_model(download_path, eon = (args.engine == 'eon'), quantized = quantized, force_build = args.force_build, cache = cache)
+            if abort_event.is_set():
+                raise Exception('Aborted')
+
+            if manifest is not None:
+                inputs["version"] = dzip.deployment_version
+                inputs["export_sha256"] = sha256_file(zipfile_path)
+                project_inputs[project_id] = inputs
+
+            # Only the first project provides the SDK and build files
+            with metrics.span("extract", category="project", project_id=project_id):
+                extract_zip(zipfile_path, download_path, None if i == 0 else PROJECT_SPECIFIC_DIRS)
+            os.remove(zipfile_path)
+            logger.info(f"Project {project_label} downloaded and extracted")
+
+            return project_id
+        except Exception as e:
+            error = Exception(f"Project {project_label} failed: {e}")
+            failures.append(error)
+            raise error from e
+        finally:
+            metrics.add_span("fetch project", start, time.perf_counter(), category="project", project_id=project_id if project_id is not None else project_label)
+
+    # Download C++ libs and unzip, all projects in parallel
+    jobs = args.jobs if args.jobs else len(apiKeys)
+    executor = ThreadPoolExecutor(max_workers = jobs)
+    futures = [executor.submit(fetch_project, i) for i in range(len(apiKeys))]
+    done, not_done = wait(futures, return_when = FIRST_EXCEPTION)
+    if failures:
+        # Fail fast: stop the other projects and report the first error
+        abort_event.set()
+        for pending in not_done:
+            pending.cancel()
+        executor.shutdown(wait = False)
+        logger.error(str(failures[0]))
+        raise failures[0]
+    executor.shutdown()
+    client.close()
+
+    # Keep the same order as the API keys
+    project_ids = [future.result() for future in futures]
+
+    if manifest is not None:
+        # Output files of the projects that changed or were removed are stale
+        for p in manifest.project_ids():
+            if p not in reused_projects:
+                manifest.remove_project(p)
+                if p not in project_ids:
+                    shutil.rmtree(os.path.join(tmpdir, p), ignore_errors=True)
 
 else:
     project_ids = args.projects.split(',')
     tmpdir = args.tmp_directory
+    if args.incremental:
+        logger.warning("--incremental is ignored when projects are read from --tmp-directory")
 
 ## EDITING FILES
 
+metrics.set_info("projects", project_ids)
+metrics.stage("copy base project")
+
 # create a target dir
 target_dir = os.path.join(args.out_directory, "output")
 # copy from the first project
-shutil.copytree(os.path.join(tmpdir, project_ids[0]), target_dir, dirs_exist_ok=True)
+copytree_linked(os.path.join(tmpdir, project_ids[0]), target_dir, SHARED_DIRS)
 include_lines = []
 
+metrics.stage("merge headers")
+# Merge the headers of all projects, each one is written once in target_dir
+project_dirs = [os.path.join(tmpdir, p) for p in project_ids]
+
 # Save intersection of trained_model_ops_define.h files
-f1 = os.path.join(tmpdir, project_ids[0], "tflite-model/trained_model_ops_define.h")
-f2 = os.path.join(tmpdir, project_ids[1], "tflite-model/trained_model_ops_define.h")
-merge_model_ops(f1, f2)
-shutil.copy(f2, os.path.join(target_dir, "tflite-model/trained_model_ops_define.h"))
+merge_all_model_ops([os.path.join(d, "tflite-model/trained_model_ops_define.h") for d in project_dirs],
+                    os.path.join(target_dir, "tflite-model/trained_model_ops_define.h"))
 
 # merge the resolvers if tflite
 if args.engine == 'tflite':
-    f1 = os.path.join(tmpdir, project_ids[0], "tflite-model/tflite-resolver.h")
-    f2 = os.path.join(tmpdir, project_ids[1], "tflite-model/tflite-resolver.h")
-    merge_tflite_resolver(f1, f2)
-    shutil.copy(f2, os.path.join(target_dir, "tflite-model/tflite-resolver.h"))
+    merge_all_tflite_resolvers([os.path.join(d, "tflite-model/tflite-resolver.h") for d in project_dirs],
+                               os.path.join(target_dir, "tflite-model/tflite-resolver.h"))
 
 # merge the model metadata
-f1 = os.path.join(tmpdir, project_ids[0], "model-parameters/model_metadata.h")
-f2 = os.path.join(tmpdir, project_ids[1], "model-parameters/model_metadata.h")
-merge_model_metadata(f1, f2)
-shutil.copy(f2, os.path.join(target_dir, "model-parameters/model_metadata.h"))
-
-for p in project_ids:
+merge_all_model_metadata([os.path.join(d, "model-parameters/model_metadata.h") for d in project_dirs],
+                         os.path.join(target_dir, "model-parameters/model_metadata.h"))
+
+metrics.stage("rewrite")
+# List of patterns to look for and append with suffix
+# Get learn block ID pattern to add projectID as suffix
+MODEL_FILE_PATTERNS = [
+    r"tflite_learn_\d+"
+]
+# Patterns may be missing for anomaly detection blocks
+MODEL_VARIABLES_PATTERNS = [
+    r"tflite_learn_\d+",
+    r"tflite_graph_\d+",
+    "ei_classifier_inferencing_categories",
+    r"ei_dsp_config_\d+",
+    "ei_dsp_blocks",
+    "ei_learning_blocks",
+    r"ei_learning_block_config_\d+",
+    r"ei_learning_block_\d+_inputs",
+    "ei_object_detection_nms(?!_config)",
+    "ei_calibration"
+]
+
+# List the files to edit. The 1st project keeps its original symbols (its files
+# are already in target_dir), so only the other projects are rewritten.
+rewrite_tasks = [] # (project ID, file path, patterns, suffix, new file name)
+# Files written to target_dir for each project
+project_outputs = {p: [] for p in project_ids[1:]}
+for p in project_ids[1:]:
+
+    # Already suffixed in a previous run
+    if p in reused_projects:
+        continue
 
     # suffix added to different functions and variables
     suffix = "_" + p
-    logger.info(f"Processing Project{str(suffix)}")
 
     # Edit compiled files in tflite-model/
     model_dir = os.path.join(tmpdir, p, 'tflite-model')
-    for f in os.listdir(model_dir):
+    for f in sorted(os.listdir(model_dir)):
         if "compiled" in f:
-
-            # List of patterns to look for and append with suffix
-            # Get learn block ID pattern to add projectID as suffix
-            patterns = [
-                r"tflite_learn_\d+"
-            ]
-            edit_file(os.path.join(model_dir, f), patterns, suffix)
-
-            # Rename filenames
             new_f = f.replace("_compiled", f"{suffix}_compiled")
-            os.rename(os.path.join(model_dir, f), os.path.join(model_dir, new_f))
-
-            # copy to target_dir (1st project)
-            if project_ids.index(p) > 0:
-                shutil.copy(os.path.join(model_dir, new_f), os.path.join(target_dir, 'tflite-model', new_f))
-
         elif f.startswith("tflite_learn_"):
-            patterns = [
-                r"tflite_learn_\d+"
-            ]
-            edit_file(os.path.join(model_dir, f), patterns, suffix)
-
-            # Rename filenames
             name, ext = os.path.splitext(f)
             new_f = f"{name}{suffix}{ext}"
-            os.rename(os.path.join(model_dir, f), os.path.join(model_dir, new_f))
-
-            # copy to target_dir (1st project)
-            if project_ids.index(p) > 0:
-                shutil.copy(os.path.join(model_dir, new_f), os.path.join(target_dir, 'tflite-model', new_f))
+        else:
+            continue
+        rewrite_tasks += [(p, os.path.join(model_dir, f), MODEL_FILE_PATTERNS, suffix, new_f)]
+        project_outputs[p] += [os.path.join(target_dir, 'tflite-model', new_f)]
 
     # Edit model_variables.h
-    f = os.path.join(tmpdir, p, "model-parameters/model_variables.h")
-
-    # Patterns may be missing for anomaly detection blocks
-    patterns = [
-        r"tflite_learn_\d+",
-        r"tflite_graph_\d+",
-        "ei_classifier_inferencing_categories",
-        r"ei_dsp_config_\d+",
-        "ei_dsp_blocks",
-        "ei_learning_blocks",
-        r"ei_learning_block_config_\d+",
-        r"ei_learning_block_\d+_inputs",
-        "ei_object_detection_nms(?!_config)",
-        "ei_calibration"
-    ]
-    edit_file(f, patterns, suffix)
-
-    # Merge model_variables.h into 1st project
-    if project_ids.index(p) > 0:
-        merge_model_variables(f, os.path.join(target_dir, "model-parameters/model_variables.h"))
-
+    rewrite_tasks += [(p, os.path.join(tmpdir, p, "model-parameters/model_variables.h"), MODEL_VARIABLES_PATTERNS, suffix, None)]
+
+# With --direct-write, model files are rewritten straight to their final path in target_dir
+dest_paths = None
+if args.direct_write:
+    dest_paths = [os.path.join(target_dir, 'tflite-model', new_f) if new_f is not None else None for (_, _, _, _, new_f) in rewrite_tasks]
+
+# Files are independent, edit them on all cores. Results come back in task order.
+rewrite_results = edit_files(
+    [task[1] for task in rewrite_tasks],
+    [task[2] for task in rewrite_tasks],
+    [task[3] for task in rewrite_tasks],
+    workers = args.workers,
+    dest_paths = dest_paths,
+)
+
+substitutions = {p: {} for p in project_ids[1:] if p not in reused_projects}
+for (p, file_path, _, _, new_f), counts in zip(rewrite_tasks, rewrite_results):
+    add_counts(substitutions[p], counts)
+    if new_f is None or args.direct_write:
+        continue
+
+    # Rename filenames and copy to target_dir (1st project)
+    new_path = os.path.join(os.path.dirname(file_path), new_f)
+    os.rename(file_path, new_path)
+    shutil.copy(new_path, os.path.join(target_dir, 'tflite-model', new_f))
+
+for p in substitutions:
+    logger.info(f"Processing Project_{p}")
+    # Number of substitutions per pattern, to spot patterns that silently stopped matching
+    logger.info(f"Substitutions for project {p}: " + ", ".join(f"{pattern}: {count}" for pattern, count in substitutions[p].items()))
+
+metrics.stage("merge model_variables")
+# Merge model_variables.h of all other projects into 1st project, in one write
+merge_all_model_variables([os.path.join(tmpdir, p, "model-parameters/model_variables.h") for p in project_ids[1:]],
+                          os.path.join(target_dir, "model-parameters/model_variables.h"))
+
+if args.dedup_weights:
+    metrics.stage("share weights")
+    # Constant arrays identical in several projects are compiled and linked once
+    share_identical_weights(target_dir)
+else:
+    remove_shared_weights(target_dir)
+
+metrics.stage("plan arenas")
+# Tensor arena of each model, and the RAM they take separately or shared
+arenas = read_arena_sizes(target_dir, project_ids, args.engine)
+remove_shared_arena(target_dir)
+shared_arena = False
+# Why --shared-arena did not change the sources, recorded in the reports
+shared_arena_reason = None
+if args.shared_arena:
+    if args.engine == 'eon':
+        shared_arena = emit_shared_arena(target_dir, arenas)
+        if not shared_arena:
+            shared_arena_reason = "less than 2 tensor arenas"
+    else:
+        shared_arena_reason = "the tflite engine already shares one static arena (EI_CLASSIFIER_TFLITE_LARGEST_ARENA_SIZE) between the models"
+    if shared_arena_reason:
+        logger.warning(f"--shared-arena not applied: {shared_arena_reason}")
+report = memory_report(arenas, args.engine, shared_arena, shared_arena_reason)
+write_memory_report(os.path.join(args.out_directory, "memory-report.json"), report)
+metrics.set_info("tensor_arenas", {"separate": report["separate_arenas_size"], "shared": report["shared_arena_size"],
+                                   "shared_arena": shared_arena, "shared_arena_reason": shared_arena_reason})
+
+metrics.stage("generate main.cpp")
 # Copy template files to tmpdir
 shutil.copytree('templates', target_dir, dirs_exist_ok=True)
 
@@ -185,19 +397,24 @@ impulses_id = {}
 for i in impulses_id_set:
     impulses_id[i[0]] = i[1]
 
-get_signal_code = "\n"
-raw_features_code = "\n"
-run_classifier_code = "\n"
-callback_function_code = "\n"
-newline = "\n"
+# Projects whose DSP features can be extracted once for all of them
+dsp_groups = find_shared_dsp(os.path.join(target_dir, 'model-parameters/model_variables.h'), project_ids, impulses_id)
+metrics.set_info("shared_dsp_groups", dsp_groups)
+
+if args.app == 'example':
+    get_signal_code = "\n"
+    raw_features_code = "\n"
+    run_classifier_code = "\n"
+    callback_function_code = "\n"
+    newline = "\n"
 
-# custom code for each project
-for p in project_ids:
-    get_signal_code += f"static int get_signal_data_{p}(size_t offset, size_t length, float *out_ptr);{newline}"
-    raw_features_code += f"static const float features_{p}[] = {{ ... }}; // copy features from project {p}{newline}"
+    # custom code for each project
+    for p in project_ids:
+        get_signal_code += f"static int get_signal_data_{p}(size_t offset, size_t length, float *out_ptr);{newline}"
+        raw_features_code += f"static const float features_{p}[] = {{ ... }}; // copy features from project {p}{newline}"
 
-    deploy_version = impulses_id[p]
-    run_classifier_code += f"""
+        deploy_version = impulses_id[p]
+        run_classifier_code += f"""
     // new process_impulse call for project ID {p}
     signal.total_length = impulse_{p}_{deploy_version}.dsp_input_frame_size;
     signal.get_data = &get_signal_data_{p};
@@ -206,7 +423,7 @@ for p in project_ids:
     display_custom_results(&result, &impulse_{p}_{deploy_version});
     {newline}"""
 
-    callback_function_code += f"""
+        callback_function_code += f"""
 static int get_signal_data_{p}(size_t offset, size_t length, float *out_ptr) {{
     for (size_t i = 0; i < length; i++) {{
         out_ptr[i] = (features_{p} + offset)[i];
@@ -215,25 +432,58 @@ static int get_signal_data_{p}(size_t offset, size_t length, float *out_ptr) {{
 }}
 {newline}"""
 
-# Insert custom code in main.cpp
-with open(os.path.join(target_dir, 'source/main.cpp'), 'r') as file1:
-    main_template = file1.readlines()
+    # Insert custom code in main.cpp
+    with open(os.path.join(target_dir, 'source/main.cpp'), 'r') as file1:
+        main_template = file1.readlines()
+
+    idx = main_template.index("// get_signal declaration inserted here\n") +1
+    main_template[idx:idx] = get_signal_code
+    idx = main_template.index("// raw features array inserted here\n") + 1
+    main_template[idx:idx] = raw_features_code
+    idx = main_template.index("// process_impulse inserted here\n") + 1
+    main_template[idx:idx] = run_classifier_code
+    idx = main_template.index("// callback functions inserted here\n") + 1
+    main_template[idx:idx] = callback_function_code
+
+    logger.info("Editing main.cpp")
+    with open(os.path.join(target_dir, 'source/main.cpp'), 'w') as file1:
+        file1.writelines(main_template)
+    logger.info("main.cpp edited")
+else:
+    generate_app(args.app, target_dir, project_ids, impulses_id, {"warmup": args.bench_warmup, "iterations": args.bench_iterations,
+                 "scheduler": args.scheduler, "depth": args.scheduler_depth}, dsp_groups)
 
-idx = main_template.index("// get_signal declaration inserted here\n") +1
-main_template[idx:idx] = get_signal_code
-idx = main_template.index("// raw features array inserted here\n") + 1
-main_template[idx:idx] = raw_features_code
-idx = main_template.index("// process_impulse inserted here\n") + 1
-main_template[idx:idx] = run_classifier_code
-idx = main_template.index("// callback functions inserted here\n") + 1
-main_template[idx:idx] = callback_function_code
+if args.python_bridge:
+    # The tflite engine and the shared arena keep state common to all models, they cannot run concurrently
+    generate_python_bridge(target_dir, project_ids, impulses_id, global_lock = (args.engine == 'tflite' or shared_arena))
 
-logger.info("Editing main.cpp")
-with open(os.path.join(target_dir, 'source/main.cpp'), 'w') as file1:
-    file1.writelines(main_template)
-logger.info("main.cpp edited")
+# Compiler flags and sources of the Makefile
+generate_makefile(target_dir, args.build_profile, args.engine, args.march, args.prune_kernels)
+if args.sdk_cache_dir is not None:
+    add_sdk_cache(target_dir, args.sdk_cache_dir)
 
 logger.info("Merging done!")
 
+metrics.stage("archive")
 # Create archive
-shutil.make_archive(os.path.join(args.out_directory, 'deploy'), 'zip', target_dir)
+archive_path = create_archive(os.path.join(args.out_directory, 'deploy'), target_dir, args.archive_format, args.compression_level, args.workers)
+if archive_path is not None:
+    metrics.count("bytes_archive", os.path.getsize(archive_path))
+
+# Record the processed projects, once the whole output is consistent
+if manifest is not None:
+    metrics.stage("save manifest")
+    for i, p in enumerate(project_ids):
+        if p in reused_projects:
+            continue
+        stage_files = [os.path.join(root, f) for d in PROJECT_SPECIFIC_DIRS for root, _, files in os.walk(os.path.join(tmpdir, p, d)) for f in files]
+        if i == 0:
+            # Copied to target_dir, then edited by the merges: only the stage copies are checked
+            outputs = [os.path.join(target_dir, os.path.relpath(f, os.path.join(tmpdir, p))) for f in stage_files]
+            manifest.set_project(p, project_inputs[p], stage_files, outputs)
+        else:
+            manifest.set_project(p, project_inputs[p], stage_files + project_outputs[p], project_outputs[p])
+    manifest.save()
+    logger.info(f"Build manifest saved, {len(reused_projects)} project(s) reused")
+
+metrics.set_info("status", "success")
@@ -0,0 +1,131 @@
+import os, sys, json, time, threading
+from contextlib import contextmanager
+import logging
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is not reported there
+    resource = None
+
+logging.basicConfig()
+
+logger = logging.getLogger("instrumentation")
+logger.setLevel(logging.INFO)
+
+# Peak resident set size in Bytes of this process and of its terminated children, None if unknown
+def peak_rss():
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kB on Linux, in Bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+# Collects timed spans and counters of one generation, thread-safe.
+# Times are time.perf_counter() values, which can be compared between forked worker processes.
+class Instrumentation:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.start_timestamp = time.time()
+        self.spans = []
+        self.counters = {}
+        self.info = {}
+        # (name, start) of the current stage
+        self._stage = None
+
+    def add_span(self, name, start, end, category = "stage", pid = None, tid = None, **args):
+        span = {
+            "name": name,
+            "category": category,
+            "start_s": start - self.start_time,
+            "duration_s": end - start,
+            "pid": pid if pid is not None else os.getpid(),
+            "tid": tid if tid is not None else threading.get_ident(),
+            "args": args,
+        }
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    # Time the enclosed block, the peak RSS at its end is stored with it
+    @contextmanager
+    def span(self, name, category = "stage", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            args["peak_rss_bytes"] = peak_rss()[0]
+            self.add_span(name, start, time.perf_counter(), category, **args)
+
+    # Sequential stages of a script: end the current stage, if any, and start the next one.
+    # name=None only ends the current stage.
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stage is not None:
+            stage_name, start = self._stage
+            self.add_span(stage_name, start, now, peak_rss_bytes=peak_rss()[0])
+            logger.debug(f"Stage {stage_name} took {now - start:.3f} s")
+        self._stage = (name, now) if name is not None else None
+
+    def count(self, name, value = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_info(self, name, value):
+        with self._lock:
+            self.info[name] = value
+
+    def report(self):
+        rss_self, rss_children = peak_rss()
+        with self._lock:
+            stages = {}
+            projects = {}
+            for span in self.spans:
+                if span["category"] == "stage":
+                    stages[span["name"]] = stages.get(span["name"], 0) + span["duration_s"]
+                if "project_id" in span["args"]:
+                    steps = projects.setdefault(str(span["args"]["project_id"]), {})
+                    steps[span["name"]] = steps.get(span["name"], 0) + span["duration_s"]
+            return {
+                "start_time": self.start_timestamp,
+                "total_s": time.perf_counter() - self.start_time,
+                "peak_rss_bytes": rss_self,
+                "peak_rss_children_bytes": rss_children,
+                "info": dict(self.info),
+                "stages_s": stages,
+                "projects_s": projects,
+                "counters": dict(self.counters),
+                "spans": list(self.spans),
+            }
+
+    # Chrome trace event format, open it in chrome://tracing or https://ui.perfetto.dev
+    def chrome_trace(self):
+        with self._lock:
+            events = [{
+                "name": span["name"],
+                "cat": span["category"],
+                "ph": "X",
+                "ts": span["start_s"] * 1e6,
+                "dur": span["duration_s"] * 1e6,
+                "pid": span["pid"],
+                "tid": span["tid"],
+                "args": span["args"],
+            } for span in self.spans]
+            end = (time.perf_counter() - self.start_time) * 1e6
+            events += [{"name": name, "ph": "C", "ts": end, "pid": os.getpid(), "args": {name: value}} for name, value in self.counters.items()]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_report(self, path, trace_path = None):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+        logger.info(f"Build report saved in {path}")
+        if trace_path is not None:
+            with open(trace_path, 'w') as file:
+                json.dump(self.chrome_trace(), file)
+            logger.info(f"Chrome trace saved in {trace_path}")
+
+# Shared by generate.py, EIDownload and utils
+metrics = Instrumentation()
@@ -0,0 +1,104 @@
+import re
+import logging
+
+logging.basicConfig()
+
+logger = logging.getLogger("shared_dsp")
+logger.setLevel(logging.INFO)
+
+# Fields of ei_impulse_t that change the input of the DSP blocks
+IMPULSE_DSP_FIELDS = ['dsp_input_frame_size', 'raw_sample_count', 'raw_samples_per_frame', 'frequency', 'interval_ms',
+                      'input_width', 'input_height', 'input_frames', 'sensor']
+
+def _strip_comments(code):
+    code = re.sub(r'/\*.*?\*/', '', code, flags=re.DOTALL)
+    return re.sub(r'//[^\n]*', '', code)
+
+# Remove the project suffix of the identifiers, and all whitespace
+def _normalize(code, suffix):
+    code = _strip_comments(code)
+    if suffix:
+        code = re.sub(r'(\w+?)' + re.escape(suffix) + r'\b', r'\1', code)
+    return re.sub(r'\s+', '', code)
+
+# Body of a global initialized with braces, None if not found
+def _initializer(content, name):
+    m = re.search(r'\b' + re.escape(name) + r'\s*(?:\[[^\]]*\])?\s*=\s*\{', content)
+    if m is None:
+        return None
+    depth = 0
+    for i in range(m.end() - 1, len(content)):
+        if content[i] == '{':
+            depth += 1
+        elif content[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return content[m.end():i]
+    return None
+
+# Top level brace entries of an array initializer
+def _entries(body):
+    entries, depth, start = [], 0, None
+    for i, c in enumerate(body):
+        if c == '{':
+            if depth == 0:
+                start = i + 1
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                entries.append(body[start:i])
+    return entries
+
+# Comparable description of the DSP blocks of an impulse, None if they cannot be shared
+def _dsp_signature(content, project_id, version, suffix):
+    impulse = _initializer(content, f"impulse_{project_id}_{version}")
+    if impulse is None:
+        return None
+    fields = dict(re.findall(r'\.(\w+)\s*=\s*([^,\n]+)', _strip_comments(impulse)))
+    if 'dsp_blocks' not in fields:
+        return None
+    blocks = _initializer(content, fields['dsp_blocks'].strip())
+    if blocks is None:
+        return None
+
+    signature = [tuple((f, _normalize(fields[f], suffix)) for f in IMPULSE_DSP_FIELDS if f in fields)]
+    for entry in _entries(blocks):
+        # blockId, output size, extract function, config, axes, axes size, version, factory
+        values = [v.strip() for v in _strip_comments(entry).split(',') if v.strip()]
+        if len(values) < 6:
+            return None
+        if len(values) > 7 and values[7] not in ('nullptr', 'NULL', '0'):
+            # Stateful DSP blocks keep state per impulse
+            return None
+        config_name = re.sub(r'^\(void\s*\*\)\s*&', '', values[3])
+        config = _initializer(content, config_name)
+        axes = _initializer(content, values[4])
+        if config is None or axes is None:
+            return None
+        # The block ID is the first field of every DSP config, it may differ between projects
+        config = "\n".join(line for line in config.split('\n') if 'blockId' not in line)
+        signature.append((_normalize(values[1], suffix), values[2], _normalize(config, suffix),
+                          _normalize(axes, suffix), values[6] if len(values) > 6 else None))
+    return tuple(signature)
+
+# Groups of projects of the merged model_variables.h whose DSP blocks are identical: same input frame,
+# extract functions, configs and axes. Their features can be extracted once for all the impulses of
+# a group. Returns a list of groups of project IDs, only groups of 2 projects or more.
+def find_shared_dsp(model_variables_path, project_ids, impulses_id):
+    with open(model_variables_path, 'r') as file:
+        content = file.read()
+
+    groups = {}
+    for i, p in enumerate(project_ids):
+        # Symbols of the first project are not suffixed
+        signature = _dsp_signature(content, p, impulses_id[p], f"_{p}" if i > 0 else "")
+        if signature is None:
+            logger.info(f"DSP blocks of project {p} cannot be shared")
+            continue
+        groups.setdefault(signature, []).append(p)
+
+    shared = [group for group in groups.values() if len(group) > 1]
+    for group in shared:
+        logger.info(f"Projects {', '.join(group)} have identical DSP blocks, their features can be extracted once")
+    return shared
@@ -0,0 +1,153 @@
+import os, re, hashlib
+import logging
+from instrumentation import metrics
+from utils import NUMERIC_ARRAY_BODY
+
+logging.basicConfig()
+
+logger = logging.getLogger("shared_weights")
+logger.setLevel(logging.INFO)
+
+SHARED_WEIGHTS_HEADER = "tflite-model/shared_weights.h"
+SHARED_WEIGHTS_SOURCE = "tflite-model/shared_weights.cpp"
+SHARED_WEIGHTS_PREFIX = "ei_shared_weights_"
+
+# Constant array initialized with numeric literals only (weights, quantization and DSP tables), e.g.
+# const ALIGN(16) int8_t tensor_data0[5000] = { ... };
+ARRAY_PATTERN = re.compile(r'(?P<static>static\s+)?const\s+(?:ALIGN\((?P<align1>\d+)\)\s+)?(?P<type>\w+(?:\s+\w+)?)\s+(?P<name>\w+)\s*'
+                           r'\[(?P<size>\d+)\]\s*(?:ALIGN\((?P<align2>\d+)\)\s*)?=\s*(?P<body>' + NUMERIC_ARRAY_BODY + r')\s*;')
+
+# Reference to a shared array, left by this pass
+REFERENCE_PATTERN = re.compile(r'\b' + SHARED_WEIGHTS_PREFIX + r'([0-9a-f]+)\b')
+
+# Previous definitions of the shared arrays, in shared_weights.cpp
+DEFINITION_PATTERN = re.compile(r'(?:alignas\((?P<align>\d+)\)\s+)?const\s+(?P<type>\w+(?:\s+\w+)?)\s+' + SHARED_WEIGHTS_PREFIX +
+                                r'(?P<hash>[0-9a-f]+)\[(?P<size>[^\]\n]*)\]\s*=\s*(?P<body>\{[^}]*\})\s*;')
+
+TYPE_SIZES = {'int8_t': 1, 'uint8_t': 1, 'char': 1, 'unsigned char': 1, 'int16_t': 2, 'uint16_t': 2,
+              'int32_t': 4, 'uint32_t': 4, 'float': 4, 'int64_t': 8, 'uint64_t': 8, 'double': 8}
+
+# Spans of the anonymous namespaces of a source, the arrays in them have internal linkage
+def _anonymous_namespaces(code):
+    spans = []
+    for m in re.finditer(r'\bnamespace\s*\{', code):
+        depth = 0
+        for i in range(m.end() - 1, len(code)):
+            if code[i] == '{':
+                depth += 1
+            elif code[i] == '}':
+                depth -= 1
+                if depth == 0:
+                    spans.append((m.end(), i))
+                    break
+    return spans
+
+# The type, size, alignment and values of an array are its content, whitespace aside.
+# The copies become references without alignment of their own, the alignment of the array
+# (ALIGN(n) of the TFLM sources) moves to the shared definition as alignas(n). Copies are only
+# merged when they have the same alignment, an array annotated differently in two models
+# (ALIGN(16) and ALIGN(8), or none) is left duplicated.
+def _content_hash(array_type, size, align, body):
+    content = "\0".join([array_type, size, align or "", re.sub(r'\s+', '', body)])
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+def _byte_size(array_type, body):
+    return TYPE_SIZES.get(array_type, 1) * len([v for v in body.strip('{}').split(',') if v.strip()])
+
+# Arrays of a model source that can be shared: only with internal linkage, as the symbols declared
+# extern in the model headers (e.g. the flatbuffer of the tflite engine) cannot become references.
+# The size must be a literal, the constants of the source are not visible in shared_weights.cpp
+def _find_arrays(code):
+    namespaces = _anonymous_namespaces(code)
+    arrays = []
+    for m in ARRAY_PATTERN.finditer(code):
+        if m.group('static') is None and not any(start <= m.start() < end for start, end in namespaces):
+            continue
+        arrays.append(m)
+    return arrays
+
+# Previous shared arrays, still referenced by the model sources reused by --incremental
+def _previous_definitions(target_dir):
+    path = os.path.join(target_dir, SHARED_WEIGHTS_SOURCE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return {m.group('hash'): (m.group('type'), m.group('size'), m.group('align'), m.group('body'))
+                for m in DEFINITION_PATTERN.finditer(file.read())}
+
+# Emit each constant array found in several model sources once, in shared_weights.cpp, and turn
+# its copies into references to the shared array. Arrays are compared by a hash of their content.
+def share_identical_weights(target_dir):
+    model_dir = os.path.join(target_dir, "tflite-model")
+    sources = [os.path.join(model_dir, f) for f in sorted(os.listdir(model_dir))
+               if f.endswith(('.cpp', '.cc')) and os.path.join("tflite-model", f) != SHARED_WEIGHTS_SOURCE]
+
+    codes = {}
+    arrays = {}       # content hash: [(source, match)]
+    referenced = set()
+    for source in sources:
+        with open(source, 'r') as file:
+            codes[source] = file.read()
+        referenced.update(REFERENCE_PATTERN.findall(codes[source]))
+        for m in _find_arrays(codes[source]):
+            digest = _content_hash(m.group('type'), m.group('size'), m.group('align1') or m.group('align2'), m.group('body'))
+            arrays.setdefault(digest, []).append((source, m))
+
+    definitions = _previous_definitions(target_dir)
+    missing = [h for h in referenced if h not in definitions and h not in arrays]
+    if missing:
+        raise(Exception(f"Shared arrays {', '.join(sorted(missing))} are referenced but no longer defined, run again with --force-build"))
+
+    # Arrays with several copies, or with a copy already shared in a previous run
+    shared = {h: copies for h, copies in arrays.items() if len(copies) > 1 or h in referenced}
+    saved = 0
+    for h, copies in shared.items():
+        m = copies[0][1]
+        definitions[h] = (m.group('type'), m.group('size'), m.group('align1') or m.group('align2'), m.group('body'))
+        saved += _byte_size(m.group('type'), m.group('body')) * (len(copies) - (0 if h in referenced else 1))
+    used = referenced | set(shared)
+
+    if not used:
+        remove_shared_weights(target_dir)
+        logger.info("No identical constant arrays in the model sources")
+        return 0
+
+    # Replace the copies, from the end of each source so the offsets stay valid
+    replacements = {}
+    for h, copies in shared.items():
+        for source, m in copies:
+            replacements.setdefault(source, []).append((h, m))
+    for source, matches in replacements.items():
+        code = codes[source]
+        for h, m in sorted(matches, key=lambda hm: hm[1].start(), reverse=True):
+            reference = f"{m.group('static') or ''}const {m.group('type')} (&{m.group('name')})[{m.group('size')}] = {SHARED_WEIGHTS_PREFIX}{h};"
+            code = code[:m.start()] + reference + code[m.end():]
+        if f'#include "{SHARED_WEIGHTS_HEADER}"' not in code:
+            code = f'#include "{SHARED_WEIGHTS_HEADER}"\n' + code
+        with open(source, 'w') as file:
+            file.write(code)
+
+    with open(os.path.join(target_dir, SHARED_WEIGHTS_HEADER), 'w') as file:
+        file.write("#ifndef SHARED_WEIGHTS_H\n#define SHARED_WEIGHTS_H\n\n#include <stdint.h>\n\n"
+                   "// Constant arrays identical in several models, defined once in shared_weights.cpp\n")
+        for h in sorted(used):
+            array_type, size, _, _ = definitions[h]
+            file.write(f"extern const {array_type} {SHARED_WEIGHTS_PREFIX}{h}[{size}];\n")
+        file.write("\n#endif // SHARED_WEIGHTS_H\n")
+    with open(os.path.join(target_dir, SHARED_WEIGHTS_SOURCE), 'w') as file:
+        file.write(f'#include "{SHARED_WEIGHTS_HEADER}"\n')
+        for h in sorted(used):
+            array_type, size, align, body = definitions[h]
+            file.write(f"\n{f'alignas({align}) ' if align else ''}const {array_type} {SHARED_WEIGHTS_PREFIX}{h}[{size}] = {body};\n")
+
+    copies = sum(len(c) for c in shared.values())
+    metrics.count("shared_arrays", len(used))
+    metrics.count("bytes_shared_arrays_saved", saved)
+    logger.info(f"{copies} copies of {len(shared)} constant arrays replaced by references to shared_weights.cpp, {saved} Bytes saved")
+    return saved
+
+# Remove the shared arrays of a previous run in the same output directory
+def remove_shared_weights(target_dir):
+    for f in [SHARED_WEIGHTS_HEADER, SHARED_WEIGHTS_SOURCE]:
+        if os.path.exists(os.path.join(target_dir, f)):
+            os.remove(os.path.join(target_dir, f))
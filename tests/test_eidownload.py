@@ -0,0 +1,50 @@
+import unittest
+from unittest import mock
+from EIDownload import EIDownload, StudioClient
+from benchmark.mock_studio import MockStudio
+
+# Lines of a finished mock build job: 25 s at 10 lines/s
+LOG = [f"Building... step {i}" for i in range(250)]
+
+class StdoutWithoutCountTest(unittest.TestCase):
+
+    def start(self, **kwargs):
+        self.studio = MockStudio(build_duration=25.0, stdout_count=False, **kwargs)
+        self.studio.start()
+        self.client = StudioClient(base_url=self.studio.api_url())
+        self.job_id = self.studio.start_build(111, elapsed=30.0)
+        self.downloader = EIDownload(api_key="key-111", project_id=111, client=self.client)
+
+    def tearDown(self):
+        self.client.close()
+        self.studio.stop()
+
+    def get_stdout(self, skip_line_no, seen_tail = None):
+        with mock.patch.object(self.client, "request_json", wraps=self.client.request_json) as request_json:
+            lines = self.downloader.get_stdout(self.job_id, skip_line_no, seen_tail)
+        return lines, request_json.call_count
+
+    def test_whole_log(self):
+        self.start()
+        self.assertEqual(self.get_stdout(0), (LOG, 3))
+
+    def test_lines_after_the_previous_poll(self):
+        self.start()
+        # Found in the newest page
+        self.assertEqual(self.get_stdout(240, LOG[235:240]), (LOG[240:], 1))
+        # Found in an older page
+        self.assertEqual(self.get_stdout(120, LOG[115:120]), (LOG[120:], 2))
+
+    def test_offset_ignored(self):
+        # The same page comes back for every offset, the poll stops at the second one
+        self.start(stdout_offset=False)
+        self.assertEqual(self.get_stdout(60, LOG[1:6]), (LOG[210:], 2))
+
+    def test_max_pages(self):
+        self.start()
+        # The cursor is never found, the pages stop at STDOUT_MAX_PAGES and the skip count is used
+        with mock.patch("EIDownload.STDOUT_MAX_PAGES", 2):
+            self.assertEqual(self.get_stdout(100, ["not logged"] * 5), (LOG[150:], 2))
+
+if __name__ == '__main__':
+    unittest.main()
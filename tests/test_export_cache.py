@@ -0,0 +1,66 @@
+import os, random, shutil, tempfile, unittest, multiprocessing
+from ExportCache import ExportCache
+
+EXPORT_SIZE = 1000
+
+def write_export(directory, project_id):
+    path = os.path.join(directory, f"project-{project_id}.zip")
+    # The cache may hold a hard link to the previous file
+    if os.path.exists(path):
+        os.remove(path)
+    with open(path, 'wb') as file:
+        file.write(bytes([project_id]) * EXPORT_SIZE)
+    return path
+
+# Random puts, gets and invalidations of a few projects, in a cache that fits 3 exports
+def use_cache(args):
+    cache_dir, seed = args
+    rng = random.Random(seed)
+    cache = ExportCache(cache_dir, max_size = 3 * EXPORT_SIZE)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for _ in range(200):
+            project_id = rng.randrange(8)
+            op = rng.random()
+            if op < 0.4:
+                cache.put(project_id, "tflite-eon", "int8", 1, write_export(tmp_dir, project_id))
+            elif op < 0.9:
+                out_dir = tempfile.mkdtemp(dir=tmp_dir)
+                path = cache.get(project_id, "tflite-eon", "int8", 1, out_dir)
+                if path is not None:
+                    with open(path, 'rb') as file:
+                        assert file.read() == bytes([project_id]) * EXPORT_SIZE
+            else:
+                cache.invalidate(project_id, "tflite-eon", "int8")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+class ExportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_eviction(self):
+        cache = ExportCache(os.path.join(self.tmp_dir, "cache"), max_size = 2 * EXPORT_SIZE)
+        for project_id in range(3):
+            cache.put(project_id, "tflite-eon", "int8", 1, write_export(self.tmp_dir, project_id))
+        # The least recently used export is evicted
+        out_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        self.assertIsNone(cache.get(0, "tflite-eon", "int8", 1, out_dir))
+        self.assertIsNotNone(cache.get(2, "tflite-eon", "int8", 1, out_dir))
+        self.assertEqual(len(os.listdir(cache.blob_dir)), 2)
+
+    def test_processes_sharing_the_cache(self):
+        cache_dir = os.path.join(self.tmp_dir, "cache")
+        with multiprocessing.Pool(4) as pool:
+            pool.map(use_cache, [(cache_dir, seed) for seed in range(4)])
+        # Every blob left is referenced by an entry
+        cache = ExportCache(cache_dir)
+        used = set(entry['sha256'] + ".zip" for _, entry in cache._read_entries())
+        self.assertEqual(set(os.listdir(cache.blob_dir)), used)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os, re, shutil, tempfile, unittest
+from shared_weights import share_identical_weights, SHARED_WEIGHTS_HEADER, SHARED_WEIGHTS_SOURCE
+
+# 300 int8 values, long enough for NUMERIC_ARRAY_BODY
+WEIGHTS = ", ".join(str(i % 256 - 128) for i in range(300))
+OTHER_WEIGHTS = ", ".join(str(i % 200 - 100) for i in range(300))
+
+def model_source(name, weights = WEIGHTS, declaration = "namespace {{\nconst ALIGN(16) int8_t {array}[300] = {{ {weights} }};\n}} // namespace\n"):
+    return (f'#include "{name}.h"\n\n' + declaration.format(array="tensor_data0", weights=weights)
+            + f"\nTfLiteStatus {name}_init(void*(*alloc_fnc)(size_t,size_t)) {{ return kTfLiteOk; }}\n")
+
+class ShareIdenticalWeightsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.target_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.target_dir, "tflite-model"))
+
+    def tearDown(self):
+        shutil.rmtree(self.target_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.target_dir, "tflite-model", name), 'w') as file:
+            file.write(content)
+
+    def read(self, path):
+        with open(os.path.join(self.target_dir, path), 'r') as file:
+            return file.read()
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.target_dir, path))
+
+    def test_identical_arrays_are_defined_once(self):
+        self.write("tflite_learn_5_compiled.cpp", model_source("tflite_learn_5"))
+        self.write("tflite_learn_5_222_compiled.cpp", model_source("tflite_learn_5_222"))
+
+        self.assertEqual(share_identical_weights(self.target_dir), 300)
+
+        definitions = re.findall(r'alignas\(16\) const int8_t (ei_shared_weights_[0-9a-f]+)\[300\] = \{', self.read(SHARED_WEIGHTS_SOURCE))
+        self.assertEqual(len(definitions), 1)
+        self.assertIn(f"extern const int8_t {definitions[0]}[300];", self.read(SHARED_WEIGHTS_HEADER))
+        for name in ["tflite_learn_5_compiled.cpp", "tflite_learn_5_222_compiled.cpp"]:
+            code = self.read(os.path.join("tflite-model", name))
+            self.assertTrue(code.startswith(f'#include "{SHARED_WEIGHTS_HEADER}"\n'))
+            self.assertIn(f"const int8_t (&tensor_data0)[300] = {definitions[0]};", code)
+            self.assertNotIn(WEIGHTS, code)
+
+    def test_static_arrays_keep_internal_linkage(self):
+        declaration = "static const int8_t {array}[300] = {{ {weights} }};\n"
+        self.write("a.cpp", model_source("a", declaration=declaration))
+        self.write("b.cpp", model_source("b", declaration=declaration))
+
+        share_identical_weights(self.target_dir)
+
+        self.assertRegex(self.read("tflite-model/a.cpp"), r"static const int8_t \(&tensor_data0\)\[300\] = ei_shared_weights_[0-9a-f]+;")
+
+    def test_different_values_are_not_shared(self):
+        self.write("a.cpp", model_source("a"))
+        self.write("b.cpp", model_source("b", OTHER_WEIGHTS))
+
+        self.assertEqual(share_identical_weights(self.target_dir), 0)
+        self.assertFalse(self.exists(SHARED_WEIGHTS_SOURCE))
+        self.assertIn(WEIGHTS, self.read("tflite-model/a.cpp"))
+
+    def test_different_alignments_are_not_shared(self):
+        # The references have no alignment of their own, merging would lose the alignment of one copy
+        self.write("a.cpp", model_source("a"))
+        self.write("b.cpp", model_source("b", declaration="namespace {{\nconst ALIGN(8) int8_t {array}[300] = {{ {weights} }};\n}} // namespace\n"))
+
+        self.assertEqual(share_identical_weights(self.target_dir), 0)
+        self.assertFalse(self.exists(SHARED_WEIGHTS_SOURCE))
+
+    def test_external_arrays_are_not_shared(self):
+        # Declared extern in the model headers, a reference would change the type of the symbol
+        declaration = "const unsigned char {array}[300] = {{ {weights} }};\n"
+        self.write("a.cpp", model_source("a", "0x1c, " * 299 + "0x1c", declaration))
+        self.write("b.cpp", model_source("b", "0x1c, " * 299 + "0x1c", declaration))
+
+        self.assertEqual(share_identical_weights(self.target_dir), 0)
+
+    def test_second_run_keeps_the_shared_arrays(self):
+        # --incremental reuses the rewritten sources of the unchanged projects
+        self.write("a.cpp", model_source("a"))
+        self.write("b.cpp", model_source("b"))
+        share_identical_weights(self.target_dir)
+        first = (self.read("tflite-model/a.cpp"), self.read(SHARED_WEIGHTS_SOURCE))
+
+        # b changed and has its own copy again
+        self.write("b.cpp", model_source("b"))
+        self.assertEqual(share_identical_weights(self.target_dir), 300)
+        self.assertEqual((self.read("tflite-model/a.cpp"), self.read(SHARED_WEIGHTS_SOURCE)), first)
+        self.assertEqual(self.read("tflite-model/a.cpp").replace("a.h", "b.h").replace("a_init", "b_init"), self.read("tflite-model/b.cpp"))
+
+    def test_missing_definition_fails(self):
+        self.write("a.cpp", model_source("a"))
+        self.write("b.cpp", model_source("b"))
+        share_identical_weights(self.target_dir)
+        os.remove(os.path.join(self.target_dir, SHARED_WEIGHTS_SOURCE))
+        self.write("b.cpp", model_source("b", OTHER_WEIGHTS))
+
+        with self.assertRaisesRegex(Exception, "no longer defined"):
+            share_identical_weights(self.target_dir)
+
+if __name__ == '__main__':
+    unittest.main()
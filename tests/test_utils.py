@@ -0,0 +1,203 @@
+import os, shutil, tempfile, unittest
+from utils import (rewrite_text, rewrite_file_to, edit_files, MacroTable, merge_all_model_metadata,
+                   merge_all_model_ops, merge_all_tflite_resolvers, merge_all_model_variables)
+
+MODEL_VARIABLES_PATTERNS = [r"tflite_learn_\d+", r"tflite_graph_\d+", "ei_dsp_blocks", "ei_object_detection_nms(?!_config)"]
+
+FFT_SIZES = [32, 64, 128, 256, 512, 1024, 2048, 4096]
+
+def metadata_h(defines, version = (1, 60, 2)):
+    lines = ["#ifndef _EI_CLASSIFIER_MODEL_METADATA_H_", "#define _EI_CLASSIFIER_MODEL_METADATA_H_", ""]
+    lines += [f"#define {name} {value}" for name, value in defines.items()]
+    lines += [f"#define EI_STUDIO_VERSION_{part} {v}" for part, v in zip(["MAJOR", "MINOR", "PATCH"], version)]
+    lines += ["", "#endif // _EI_CLASSIFIER_MODEL_METADATA_H_"]
+    return "\n".join(lines) + "\n"
+
+def base_defines(**overrides):
+    defines = {
+        "EI_CLASSIFIER_LABEL_COUNT": 2,
+        "EI_CLASSIFIER_SINGLE_FEATURE_INPUT": 1,
+        "EI_CLASSIFIER_OBJECT_DETECTION_LAST_LAYER": "EI_CLASSIFIER_LAST_LAYER_UNKNOWN",
+        "EI_CLASSIFIER_HAS_ANOMALY": "EI_ANOMALY_TYPE_UNKNOWN",
+    }
+    defines.update({f"EI_CLASSIFIER_LOAD_FFT_{size}": 0 for size in FFT_SIZES})
+    defines.update(overrides)
+    return defines
+
+def resolver_h(ops):
+    entries = [f"    resolver.Add{op}();" for op in ops]
+    entries = [line + " \\" for line in entries[:-1]] + entries[-1:]
+    return ("#ifndef EI_TFLITE_RESOLVER_H\n#define EI_TFLITE_RESOLVER_H\n\n"
+            f"#define EI_TFLITE_RESOLVER static tflite::MicroMutableOpResolver<{len(ops)}> resolver; \\\n"
+            + "\n".join(entries) + "\n\n#endif\n")
+
+class RewriteTest(unittest.TestCase):
+
+    def test_suffix_and_counts(self):
+        text = ('#include "tflite-model/tflite_learn_5_compiled.h"\n'
+                "ei_config_tflite_graph_5 = { .model_init = &tflite_learn_5_init };\n"
+                "ei_object_detection_nms_config_t ei_object_detection_nms = { };\n"
+                ".dsp_blocks = ei_dsp_blocks,\n")
+        text, counts = rewrite_text(text, MODEL_VARIABLES_PATTERNS, "_222")
+        self.assertEqual(text,
+                         '#include "tflite-model/tflite_learn_5_222_compiled.h"\n'
+                         "ei_config_tflite_graph_5_222 = { .model_init = &tflite_learn_5_222_init };\n"
+                         "ei_object_detection_nms_config_t ei_object_detection_nms_222 = { };\n"
+                         ".dsp_blocks = ei_dsp_blocks_222,\n")
+        self.assertEqual(counts, {r"tflite_learn_\d+": 2, r"tflite_graph_\d+": 1, "ei_dsp_blocks": 1, "ei_object_detection_nms(?!_config)": 1})
+
+    def test_include_pattern_suffixes_the_header(self):
+        text, counts = rewrite_text('#include "model_variables.h"\n', [r'#include "\w+\.h"'], "_7")
+        self.assertEqual(text, '#include "model_variables_7.h"\n')
+        self.assertEqual(counts, {r'#include "\w+\.h"': 1})
+
+    def test_numeric_array_bodies_are_skipped(self):
+        # 1234 would match \d+ patterns if the body was scanned
+        body = "{ " + ", ".join(["1234"] * 100) + " }"
+        text = f"const int8_t tflite_learn_5_data[400] = {body};\n"
+        rewritten, counts = rewrite_text(text, [r"tflite_learn_\d+", r"\d{4}"], "_2")
+        self.assertEqual(rewritten, f"const int8_t tflite_learn_5_2_data[400] = {body};\n")
+        self.assertEqual(counts, {r"tflite_learn_\d+": 1, r"\d{4}": 0})
+
+    def test_file_rewrite_matches_text_rewrite(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            text = ('#include "tflite_learn_5_compiled.h"\nconst uint8_t w[3] = { 1, 2, 3 };\n'
+                    + "TfLiteStatus tflite_learn_5_init();\n" * 50 + "static ei_dsp_blocks x;\n")
+            paths = []
+            for i in range(3):
+                paths.append(os.path.join(tmp_dir, f"{i}.cpp"))
+                with open(paths[-1], 'w') as file:
+                    file.write(text)
+            expected, expected_counts = rewrite_text(text, MODEL_VARIABLES_PATTERNS, "_9")
+
+            # Memory-mapped bytes path
+            dest = os.path.join(tmp_dir, "out.cpp")
+            self.assertEqual(rewrite_file_to(paths[0], dest, MODEL_VARIABLES_PATTERNS, "_9"), expected_counts)
+            with open(dest, 'r') as file:
+                self.assertEqual(file.read(), expected)
+
+            # In place, on worker processes, counts in the order of the files
+            counts = edit_files(paths[1:], [MODEL_VARIABLES_PATTERNS] * 2, ["_9", "_9"], workers=2)
+            self.assertEqual(counts, [expected_counts, expected_counts])
+            for path in paths[1:]:
+                with open(path, 'r') as file:
+                    self.assertEqual(file.read(), expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class MacroTableTest(unittest.TestCase):
+
+    def test_set_and_add(self):
+        table = MacroTable(["#ifndef A\n", "#define EI_X 1\n", "#define EI_X 2\n", "#endif\n"])
+        self.assertEqual(table.get("EI_X"), "1")
+        self.assertIsNone(table.get("EI_Y"))
+        table.set("EI_X", "3")
+        table.set("EI_Y", "4")
+        self.assertEqual(table.get("EI_Y"), "4")
+        # The first definition is the one updated, new macros go before the last line
+        self.assertEqual(table.render(), ["#ifndef A\n", "#define EI_X 3\n", "#define EI_X 2\n", "#define EI_Y 4\n", "#endif\n"])
+
+class MergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def read(self, name):
+        with open(os.path.join(self.tmp_dir, name), 'r') as file:
+            return file.read()
+
+    def merge_metadata(self, defines_list, **kwargs):
+        src_files = [self.write(f"metadata_{i}.h", metadata_h(defines, **kwargs)) for i, defines in enumerate(defines_list)]
+        dest_file = os.path.join(self.tmp_dir, "model_metadata.h")
+        merge_all_model_metadata(src_files, dest_file)
+        return MacroTable.from_file(dest_file)
+
+    def test_fft_tables_are_or_of_all_projects(self):
+        # Each FFT size is used by one project only, in the 1st, 2nd and 3rd one
+        table = self.merge_metadata([
+            base_defines(EI_CLASSIFIER_LOAD_FFT_64=1),
+            base_defines(EI_CLASSIFIER_LOAD_FFT_256=1),
+            base_defines(EI_CLASSIFIER_LOAD_FFT_4096=1),
+        ])
+        used = [size for size in FFT_SIZES if table.get(f"EI_CLASSIFIER_LOAD_FFT_{size}") == "1"]
+        self.assertEqual(used, [64, 256, 4096])
+
+    def test_metadata_limits(self):
+        table = self.merge_metadata([
+            base_defines(EI_CLASSIFIER_LABEL_COUNT=2),
+            base_defines(EI_CLASSIFIER_LABEL_COUNT=5, EI_CLASSIFIER_SINGLE_FEATURE_INPUT=0),
+            base_defines(EI_CLASSIFIER_LABEL_COUNT=3, EI_CLASSIFIER_TFLITE_LARGEST_ARENA_SIZE=8192),
+        ])
+        self.assertEqual(table.get("EI_CLASSIFIER_LABEL_COUNT"), "5")
+        self.assertEqual(table.get("EI_CLASSIFIER_SINGLE_FEATURE_INPUT"), "0")
+        # Defined by the last project only
+        self.assertEqual(table.get("EI_CLASSIFIER_TFLITE_LARGEST_ARENA_SIZE"), "8192")
+        self.assertTrue(self.read("model_metadata.h").endswith("#define EI_CLASSIFIER_TFLITE_LARGEST_ARENA_SIZE 8192\n#endif // _EI_CLASSIFIER_MODEL_METADATA_H_\n"))
+
+    def test_anomaly_type_of_any_project(self):
+        table = self.merge_metadata([
+            base_defines(),
+            base_defines(),
+            base_defines(EI_CLASSIFIER_HAS_ANOMALY="EI_ANOMALY_TYPE_KMEANS"),
+        ])
+        self.assertEqual(table.get("EI_CLASSIFIER_HAS_ANOMALY"), "EI_ANOMALY_TYPE_KMEANS")
+
+    def test_different_studio_versions_fail(self):
+        src_files = [self.write("a.h", metadata_h(base_defines())), self.write("b.h", metadata_h(base_defines(), version=(1, 61, 0)))]
+        with self.assertRaises(SystemExit):
+            merge_all_model_metadata(src_files, os.path.join(self.tmp_dir, "model_metadata.h"))
+
+    def test_ops_intersection(self):
+        src_files = [
+            self.write("ops_0.h", "#define EI_TFLITE_DISABLE_ADD_IN_U8 1\n#define EI_TFLITE_DISABLE_CONV_2D_IN_U8 1\n#define EI_TFLITE_DISABLE_SOFTMAX_IN_U8 1\n"),
+            self.write("ops_1.h", "#define EI_TFLITE_DISABLE_SOFTMAX_IN_U8 1\n#define EI_TFLITE_DISABLE_ADD_IN_U8 1\n"),
+            self.write("ops_2.h", "#define EI_TFLITE_DISABLE_ADD_IN_U8 1\n#define EI_TFLITE_DISABLE_RESHAPE_IN_U8 1\n#define EI_TFLITE_DISABLE_SOFTMAX_IN_U8 1\n"),
+        ]
+        merge_all_model_ops(src_files, os.path.join(self.tmp_dir, "ops.h"))
+        # An op stays disabled only if no project uses it, in the order of the first file
+        self.assertEqual(self.read("ops.h"), "#define EI_TFLITE_DISABLE_ADD_IN_U8 1\n#define EI_TFLITE_DISABLE_SOFTMAX_IN_U8 1\n")
+
+    def test_resolver_union(self):
+        src_files = [
+            self.write("resolver_0.h", resolver_h(["Conv2D", "Softmax"])),
+            self.write("resolver_1.h", resolver_h(["Softmax", "FullyConnected"])),
+            self.write("resolver_2.h", resolver_h(["Add", "Conv2D"])),
+        ]
+        merge_all_tflite_resolvers(src_files, os.path.join(self.tmp_dir, "resolver.h"))
+        self.assertEqual(self.read("resolver.h"),
+                         "#ifndef EI_TFLITE_RESOLVER_H\n#define EI_TFLITE_RESOLVER_H\n\n"
+                         "#define EI_TFLITE_RESOLVER static tflite::MicroMutableOpResolver<4> resolver; \\\n"
+                         "resolver.AddConv2D(); \\\nresolver.AddSoftmax(); \\\nresolver.AddFullyConnected(); \\\nresolver.AddAdd();\n"
+                         "\n#endif\n")
+
+    def test_variables_of_an_anomaly_only_base_project(self):
+        # Without a tflite_learn include in the base project, the includes go after its last include
+        dest_file = self.write("model_variables.h",
+                               '#include <stdint.h>\n#include "model_metadata.h"\n#include "edge-impulse-sdk/anomaly/anomaly.h"\n\n'
+                               'const char* ei_classifier_inferencing_categories[] = { "a" };\n'
+                               'ei_impulse_handle_t& ei_default_impulse = impulse_handle_111_1;\n')
+        src_file = self.write("model_variables_222.h",
+                              '#include <stdint.h>\n#include "tflite-model/tflite_learn_5_222_compiled.h"\n\n'
+                              'const char* ei_classifier_inferencing_categories_222[] = { "b" };\n'
+                              'const ei_impulse_t impulse_222_1 = { };\n'
+                              'ei_impulse_handle_t& ei_default_impulse = impulse_handle_222_1;\n')
+        merge_all_model_variables([src_file], dest_file)
+        self.assertEqual(self.read("model_variables.h"),
+                         '#include <stdint.h>\n#include "model_metadata.h"\n#include "edge-impulse-sdk/anomaly/anomaly.h"\n'
+                         '#include "tflite-model/tflite_learn_5_222_compiled.h"\n\n'
+                         'const char* ei_classifier_inferencing_categories[] = { "a" };\n'
+                         '\nconst char* ei_classifier_inferencing_categories_222[] = { "b" };\nconst ei_impulse_t impulse_222_1 = { };\n\n'
+                         'ei_impulse_handle_t& ei_default_impulse = impulse_handle_111_1;\n')
+
+if __name__ == '__main__':
+    unittest.main()
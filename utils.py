@@ -1,6 +1,16 @@
 import logging
 import sys
 import re
+import hashlib
+import functools
+import os
+import shutil
+import mmap
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile
+from instrumentation import metrics
 
 logging.basicConfig()
 logger = logging.getLogger("utils")
@@ -131,84 +141,259 @@ def remove_line(file_path, search_string):
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
 
+# SHA-256 of a file, read in chunks
+def sha256_file(file_path, chunk_size = 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Hard link when possible (same file system), copy otherwise
+def link_or_copy(src, dst):
+    # dst may be left by a previous run in the same output directory
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return dst
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+# Extract a zip archive, optionally only the members under the given directory prefixes
+def extract_zip(zip_path, out_directory, member_prefixes = None):
+    with ZipFile(zip_path, 'r') as zObject:
+        if member_prefixes is None:
+            members = zObject.infolist()
+        else:
+            members = [m for m in zObject.infolist() if m.filename.startswith(tuple(member_prefixes))]
+        zObject.extractall(out_directory, members)
+        metrics.count("bytes_extracted", sum(m.file_size for m in members))
+        logger.debug(f"Extracted {len(members)} of {len(zObject.namelist())} members from {zip_path}")
+
+# Copy a project tree, hard linking the files under the read-only directories instead of copying them
+def copytree_linked(src, dst, linked_dirs):
+    shutil.copytree(src, dst, dirs_exist_ok=True, ignore=shutil.ignore_patterns(*linked_dirs))
+    for d in linked_dirs:
+        if os.path.isdir(os.path.join(src, d)):
+            shutil.copytree(os.path.join(src, d), os.path.join(dst, d), dirs_exist_ok=True, copy_function=link_or_copy)
+
 ## GENERIC FUNCTIONS TO EDIT FILES
 
+# Long initializer bodies made only of numeric literals (weights, DSP tables). They can never
+# contain a symbol name, so the rewrite engine consumes them in one step instead of scanning them.
+NUMERIC_ARRAY_BODY = r"\{[0-9a-fA-FxXuUlL.,+\-\s]{256,}\}"
+
+# Compile all patterns into a single alternation, so a file is scanned once whatever the number of patterns.
+# Each pattern gets its own named group (p0, p1, ...) to count substitutions per pattern.
+# binary=True compiles a bytes regex, to scan files without decoding them.
+@functools.lru_cache(maxsize=None)
+def compile_rewrite_patterns(patterns, binary = False):
+    alternatives = [f"(?P<skip>{NUMERIC_ARRAY_BODY})"]
+    alternatives += [f"(?P<p{i}>{pattern})" for i, pattern in enumerate(patterns)]
+    regex = "|".join(alternatives)
+    return re.compile(regex.encode() if binary else regex)
+
+# Add suffix to every match of patterns in text, in a single pass.
+# Returns the new text and the number of substitutions for each pattern.
+def rewrite_text(text, patterns, suffix):
+    patterns = tuple(patterns)
+    regex = compile_rewrite_patterns(patterns)
+    counts = [0] * len(patterns)
+
+    # function to add suffix to search patterns
+    def add_suffix(term):
+        if term.lastgroup == "skip":
+            return term.group(0)
+        counts[int(term.lastgroup[1:])] += 1
+        matched_text = term.group(0)
+        # Check if the pattern contains 'include'
+        if "include" in matched_text:
+            # Special handling for include statements
+            return re.sub(r'(\w+)(\.h)', rf'\1{suffix}\2', matched_text)
+        else:
+            # General case: simply add suffix to the matched pattern
+            return matched_text + suffix
+
+    text = regex.sub(add_suffix, text)
+    return text, dict(zip(patterns, counts))
+
+# Add the per-pattern substitution counts returned by edit_file to total
+def add_counts(total, counts):
+    for pattern, count in (counts or {}).items():
+        total[pattern] = total.get(pattern, 0) + count
+    return total
+
 # Generic function to add suffix to search patterns in a file
+# Returns the number of substitutions for each pattern, None if the file could not be edited
 def edit_file(file_path, patterns, suffix):
     logger.info("Editing " + file_path)
     try:
         with open(file_path, 'r') as file:
             file_content = file.read()
 
-        # function to add suffix to search patterns
-        def add_suffix(term):
-            matched_text = term.group(0)
-            # Check if the pattern contains 'include'
-            if "include" in matched_text:
-                # Special handling for include statements
-                return re.sub(r'(\w+)(\.h)', rf'\1{suffix}\2', matched_text)
-            else:
-                # General case: simply add suffix to the matched pattern
-                return matched_text + suffix
-
-        # Search each pattern in file and call add_suffix
-        for pattern in patterns:
-            logger.debug("pattern: " + pattern)
-            file_content = re.sub(pattern, add_suffix, file_content)
+        file_content, counts = rewrite_text(file_content, patterns, suffix)
+        for pattern, count in counts.items():
+            logger.debug(f"pattern: {pattern}, {count} substitution(s)")
+        if not any(counts.values()):
+            logger.warning(f"No pattern matched in {file_path}")
 
         with open(file_path, 'w') as file:
             file.write(file_content)
 
         logger.debug(f"{file_path} edited")
+        return counts
     except FileNotFoundError:
         logger.error(f"File not found: {file_path}")
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
-
-def find_highest_fft_string(src_file_contents, dest_file_contents):
-    fft_macros_list = [f"EI_CLASSIFIER_LOAD_FFT_{32*num}" for num in [1, 2, 4, 8, 16, 32, 64, 128]]
-    logger.debug(f'{fft_macros_list}')
-    src_fft_values = []
-    dest_fft_values = []
-
-    for macro in fft_macros_list:
-        num1, line_num1, str1 = find_value(src_file_contents, macro)
-        num2, line_num2, str2 = find_value(dest_file_contents, macro)
-
-        src_file_contents.pop(line_num1)
-        dest_file_contents.pop(line_num2)
-        src_fft_values.append((num1))
-        dest_fft_values.append((num2))
-
-    logger.debug(f'{src_fft_values}, {dest_fft_values}')
-    logger.debug(f'{line_num1}, {line_num2}')
-
-    # find the highest value
-    try:
-        # Ensure the list is reversed to get the highest value (in case multiple FFT are in one metadata file)
-        src_fft_value = len(src_fft_values) - 1 - src_fft_values[::-1].index('1')
-    except ValueError: # If no FFT in the impulse
-        src_fft_value = 0
-
+    return None
+
+# Fast path for large model sources: add suffix to the patterns of file_path and write the
+# result straight to dest_path. The source is memory-mapped and scanned as bytes, only the
+# matches are rewritten and the byte ranges between them are copied without being decoded.
+# Returns the number of substitutions for each pattern, None if the file could not be written
+def rewrite_file_to(file_path, dest_path, patterns, suffix):
+    logger.info(f"Rewriting {file_path} to {dest_path}")
     try:
-        dest_fft_value = len(dest_fft_values) - 1 - dest_fft_values[::-1].index('1')
-    except ValueError:
-        dest_fft_value = 0
-
-    logger.debug(f'{src_fft_value}, {dest_fft_value}')
-
-    max_fft_macro = fft_macros_list[max(src_fft_value, dest_fft_value)]
-
-    logger.info(f"Highest FFT value: {max_fft_macro}")
-    tmp = dest_file_contents[-1]
-    dest_file_contents[-1] = f"#define {fft_macros_list[max(src_fft_value, dest_fft_value)]} 1\n"
-    dest_file_contents.append(tmp)
-
-    return dest_file_contents
-
-def find_common_type(src_file_contents, dest_file_contents, macro_string, type_dict):
-    src_val, line_num1, str1 = find_value(src_file_contents, macro_string)
-    dest_val, line_num2, str2 = find_value(dest_file_contents, macro_string)
+        patterns = tuple(patterns)
+        regex = compile_rewrite_patterns(patterns, binary=True)
+        counts = [0] * len(patterns)
+        suffix_bytes = suffix.encode()
+
+        with open(file_path, 'rb') as src, open(dest_path, 'wb') as dest:
+            if os.fstat(src.fileno()).st_size == 0:
+                return dict(zip(patterns, counts))
+
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                last = 0
+                for term in regex.finditer(mm):
+                    if term.lastgroup == "skip":
+                        continue
+                    counts[int(term.lastgroup[1:])] += 1
+                    matched_text = term.group(0)
+                    dest.write(view[last:term.start()])
+                    if b"include" in matched_text:
+                        # Special handling for include statements
+                        dest.write(re.sub(rb'(\w+)(\.h)', rb'\1' + suffix_bytes + rb'\2', matched_text))
+                    else:
+                        dest.write(matched_text + suffix_bytes)
+                    last = term.end()
+                dest.write(view[last:])
+                view.release()
+
+        counts = dict(zip(patterns, counts))
+        for pattern, count in counts.items():
+            logger.debug(f"pattern: {pattern}, {count} substitution(s)")
+        if not any(counts.values()):
+            logger.warning(f"No pattern matched in {file_path}")
+        return counts
+    except FileNotFoundError:
+        logger.error(f"File not found: {file_path}")
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+    return None
+
+# Edit file_path in place, or write the result to dest_path if it is set
+def rewrite_file(file_path, patterns, suffix, dest_path = None):
+    if dest_path is None:
+        return edit_file(file_path, patterns, suffix)
+    return rewrite_file_to(file_path, dest_path, patterns, suffix)
+
+# rewrite_file plus what the instrumentation needs, as worker processes cannot record it themselves
+def _timed_rewrite_file(file_path, patterns, suffix, dest_path = None):
+    start = time.perf_counter()
+    counts = rewrite_file(file_path, patterns, suffix, dest_path)
+    out_path = dest_path if dest_path is not None else file_path
+    bytes_written = os.path.getsize(out_path) if counts is not None and os.path.exists(out_path) else 0
+    return counts, start, time.perf_counter(), os.getpid(), bytes_written
+
+# Run rewrite_file on many independent files in a process pool.
+# Returns the substitution counts in the same order as file_paths, so the result does not
+# depend on scheduling. workers=1 edits the files serially in this process.
+def edit_files(file_paths, patterns_list, suffixes, workers = None, dest_paths = None):
+    if dest_paths is None:
+        dest_paths = [None] * len(file_paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(file_paths))
+
+    # Worker processes must not re-import the calling script, only fork is safe here
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        results = [_timed_rewrite_file(f, patterns, suffix, dest) for f, patterns, suffix, dest in zip(file_paths, patterns_list, suffixes, dest_paths)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            results = list(executor.map(_timed_rewrite_file, file_paths, patterns_list, suffixes, dest_paths))
+
+    # Record the work of the workers in this process
+    for file_path, (counts, start, end, pid, bytes_written) in zip(file_paths, results):
+        metrics.add_span("rewrite " + os.path.basename(file_path), start, end, category="file", pid=pid, tid=pid, file=file_path)
+        metrics.count("bytes_rewritten", bytes_written)
+        for pattern, count in (counts or {}).items():
+            metrics.count("substitutions", count)
+            metrics.count(f"substitutions {pattern}", count)
+    return [counts for counts, _, _, _, _ in results]
+
+# #define lines of model_metadata.h: macro name and value
+DEFINE_PATTERN = re.compile(r'^\s*#define\s+(\w+)\s+(\w+)')
+
+# model_metadata.h parsed once: its lines plus an index from macro name to (value, line number).
+# Merge rules update the index, the file is rendered once at the end.
+class MacroTable:
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.index = {}
+        # Macros missing from this file, inserted before its last line when rendering
+        self.added = {}
+        for i, line in enumerate(self.lines):
+            m = DEFINE_PATTERN.match(line)
+            if m and m.group(1) not in self.index:
+                self.index[m.group(1)] = (m.group(2), i)
+
+    @classmethod
+    def from_file(cls, file_path):
+        with open(file_path, 'r') as file:
+            return cls(file.readlines())
+
+    def get(self, name):
+        if name in self.added:
+            return DEFINE_PATTERN.match(self.added[name]).group(2)
+        return self.index.get(name, (None, None))[0]
+
+    # Line defining name, None if it is not defined
+    def get_line(self, name):
+        if name in self.added:
+            return self.added[name]
+        if name in self.index:
+            return self.lines[self.index[name][1]]
+        return None
+
+    def set(self, name, value):
+        if name in self.added:
+            self.added[name] = replace_define_value(self.added[name], value)
+        elif name in self.index:
+            line_num = self.index[name][1]
+            self.lines[line_num] = replace_define_value(self.lines[line_num], value)
+            self.index[name] = (value, line_num)
+        else:
+            self.added[name] = f"#define {name} {value}\n"
+
+    # Add the definition line of a macro missing from this file
+    def add_line(self, name, line):
+        self.added[name] = line if line.endswith('\n') else line + '\n'
+
+    def render(self):
+        if not self.lines:
+            return list(self.added.values())
+        return self.lines[:-1] + list(self.added.values()) + self.lines[-1:]
+
+def find_common_type(src_table, dest_table, macro_string, type_dict):
+    src_val = src_table.get(macro_string)
+    dest_val = dest_table.get(macro_string)
 
     logger.debug(f"Comparing {macro_string} values: {src_val}, {dest_val}")
 
@@ -224,55 +409,43 @@ def find_common_type(src_file_contents, dest_file_contents, macro_string, type_d
         logger.error(f"Unknown type {macro_string}, not found in the type dictionary")
         sys.exit(1)
 
-    # types match, nothing to do here
-    if (src_type == dest_type):
+    # types match or only the destination has a type, nothing to do here
+    if (src_type == dest_type or src_type == 0):
         pass
     # if one has type and the other does not
     elif (dest_type == 0):
-        dest_file_contents[line_num2] = re.sub(dest_val, src_val, str2)
+        dest_table.set(macro_string, src_val)
     # both have types of different values
     else:
         logger.error(f"Error: {macro_string} type mismatch, can only merge projects with the same type")
         sys.exit(1)
 
-    return dest_file_contents
+    return dest_table
 
-def compare_values(val1, val2):
-    pattern = r'#define\s+[A-Z_]+\s+(\d+)'
-    num1 = re.findall(pattern, val1)
-    num2 = re.findall(pattern, val2)
-    print(num1, num2)
-
-def replace_value(src_file_contents, dest_file_contents, macro_sting, choose_high_value = True):
-    num1, line_num1, str1 = find_value(src_file_contents, macro_sting)
-    num2, line_num2, str2 = find_value(dest_file_contents, macro_sting)
+def replace_value(src_table, dest_table, macro_sting, choose_high_value = True):
+    num1 = src_table.get(macro_sting)
+    num2 = dest_table.get(macro_sting)
     logger.debug(f'{num1}, {num2}')
 
     if num1 is None:
         logger.debug(f"{macro_sting} not found in source file")
-        return dest_file_contents
+        return dest_table
 
     if num2 is None:
         logger.debug(f"{macro_sting} not found in destination file")
-        tmp = dest_file_contents[-1]
-        dest_file_contents[-1] = str1
-        dest_file_contents.append(tmp)
-        return dest_file_contents
+        dest_table.add_line(macro_sting, src_table.get_line(macro_sting))
+        return dest_table
 
     # replace the value in the dest_file
     correct_num = max(int(num1), int(num2)) if choose_high_value else min(int(num1), int(num2))
-    dest_file_contents[line_num2] = re.sub(num2, str(correct_num), str2)
-
-    return dest_file_contents
+    dest_table.set(macro_sting, str(correct_num))
 
-def compare_version(src_file_contents, dest_file_contents):
-    major_src, _, _ = find_value(src_file_contents, "EI_STUDIO_VERSION_MAJOR")
-    minor_src, _, _ = find_value(src_file_contents, "EI_STUDIO_VERSION_MINOR")
-    patch_src, _, _ = find_value(src_file_contents, "EI_STUDIO_VERSION_PATCH")
+    return dest_table
 
-    major_dest, _, _ = find_value(dest_file_contents, "EI_STUDIO_VERSION_MAJOR")
-    minor_dest, _, _ = find_value(dest_file_contents, "EI_STUDIO_VERSION_MINOR")
-    patch_dest, _, _ = find_value(dest_file_contents, "EI_STUDIO_VERSION_PATCH")
+def compare_version(src_table, dest_table):
+    version_macros = ["EI_STUDIO_VERSION_MAJOR", "EI_STUDIO_VERSION_MINOR", "EI_STUDIO_VERSION_PATCH"]
+    major_src, minor_src, patch_src = [src_table.get(macro) for macro in version_macros]
+    major_dest, minor_dest, patch_dest = [dest_table.get(macro) for macro in version_macros]
 
     if major_src != major_dest or minor_src != minor_dest or patch_src != patch_dest:
         logger.error("Error: Version mismatch, rebuild the projects with --force-build")
@@ -280,154 +453,195 @@ def compare_version(src_file_contents, dest_file_contents):
         logger.error(f"Destination version: {major_dest}.{minor_dest}.{patch_dest}")
         sys.exit(1)
 
-def find_value(file_content, macro_string):
-    for i, line in enumerate(file_content):
-        if macro_string in line:
-            val = re.findall(r'#define\s+[A-Z_0-9]+\s+([A-Z_0-9]+)', line)
-            return val[0], i, line
-    return None, None, None
+# Replace the value of a #define line, leaving the macro name untouched
+def replace_define_value(line, value):
+    return re.sub(r'(#define\s+\w+\s+)\w+', lambda m: m.group(1) + value, line, count=1)
+
+# Merge rules of model_metadata.h, applied to the macro tables of two projects
+def merge_metadata_contents(src_table, dest_table):
+    compare_version(src_table, dest_table)
+
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_LABEL_COUNT")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_HAS_VISUAL_ANOMALY")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_SINGLE_FEATURE_INPUT", choose_high_value = False)
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_QUANTIZATION_ENABLED")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_LOAD_IMAGE_SCALING")
+    dest_table = replace_value(src_table, dest_table, "EI_DSP_PARAMS_SPECTRAL_ANALYSIS_ANALYSIS_TYPE_FFT")
+    dest_table = replace_value(src_table, dest_table, "EI_DSP_PARAMS_SPECTRAL_ANALYSIS_ANALYSIS_TYPE_WAVELET")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_OBJECT_DETECTION")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_OBJECT_DETECTION_COUNT")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_HAS_FFT_INFO")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_NON_STANDARD_FFT_SIZES")
+    # The tflite engine allocates one static arena for all models, it must fit the largest one
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_TFLITE_LARGEST_ARENA_SIZE")
+    dest_table = replace_value(src_table, dest_table, "EI_CLASSIFIER_TFLITE_ARENA_SIZE")
+    fft_macros_list = [f"EI_CLASSIFIER_LOAD_FFT_{32*num}" for num in [1, 2, 4, 8, 16, 32, 64, 128]]
+    # Logical OR to select each used FFT in both impulses (see edge-impulse-sdk/dsp/numpy.hpp | line 2067)
+    for macro in fft_macros_list:
+        dest_table = replace_value(src_table, dest_table, macro)
+    dest_table = find_common_type(src_table, dest_table, "EI_CLASSIFIER_OBJECT_DETECTION_LAST_LAYER", object_detection_types)
+    dest_table = find_common_type(src_table, dest_table, "EI_CLASSIFIER_HAS_ANOMALY", anomaly_types)
 
-def merge_model_metadata(src_file, dest_file):
+    return dest_table
+
+# Merge model_metadata.h of all projects into dest_file, written once.
+# The first file is the base, the merged macros are reduced across all of them.
+def merge_all_model_metadata(src_files, dest_file):
     try:
-        # Open the first file for reading
-        with open(src_file, 'r') as file1:
-            src_file_contents = file1.readlines()
-        with open(dest_file, 'r') as file2:
-            dest_file_contents = file2.readlines()
-
-        compare_version(src_file_contents, dest_file_contents)
-
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_LABEL_COUNT")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_HAS_VISUAL_ANOMALY")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_SINGLE_FEATURE_INPUT", choose_high_value = False)
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_QUANTIZATION_ENABLED")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_LOAD_IMAGE_SCALING")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_DSP_PARAMS_SPECTRAL_ANALYSIS_ANALYSIS_TYPE_FFT")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_DSP_PARAMS_SPECTRAL_ANALYSIS_ANALYSIS_TYPE_WAVELET")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_OBJECT_DETECTION")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_OBJECT_DETECTION_COUNT")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_HAS_FFT_INFO")
-        dest_file_contents = replace_value(src_file_contents, dest_file_contents, "EI_CLASSIFIER_NON_STANDARD_FFT_SIZES")
-        fft_macros_list = [f"EI_CLASSIFIER_LOAD_FFT_{32*num}" for num in [1, 2, 4, 8, 16, 32, 64, 128]]
-        # Logical OR to select each used FFT in both impulses (see edge-impulse-sdk/dsp/numpy.hpp | line 2067)
-        for macro in fft_macros_list:
-            dest_file_contents = replace_value(src_file_contents, dest_file_contents, macro)
-        dest_file_contents = find_common_type(src_file_contents, dest_file_contents, "EI_CLASSIFIER_OBJECT_DETECTION_LAST_LAYER", object_detection_types)
-        dest_file_contents = find_common_type(src_file_contents, dest_file_contents, "EI_CLASSIFIER_HAS_ANOMALY", anomaly_types)
-
-        with open(dest_file, 'w') as file2:
-            file2.writelines("".join(dest_file_contents))
+        tables = [MacroTable.from_file(src_file) for src_file in src_files]
+
+        dest_table = tables[0]
+        for src_table in tables[1:]:
+            dest_table = merge_metadata_contents(src_table, dest_table)
+
+        with open(dest_file, 'w') as file:
+            file.writelines(dest_table.render())
+
+        logger.info(f"Merge model_metadata done ({len(src_files)} projects)")
 
     except FileNotFoundError as e:
         logger.error(f"Error: {e}")
 
-# Function to merge model_variables.h
-def merge_model_variables(src_file, dest_file):
-    start_str = "const char* ei_classifier_inferencing_categories"
-    end_str = "ei_impulse_handle_t& ei_default_impulse"
-    insert_line_str = "ei_impulse_handle_t& ei_default_impulse"
-    include_line_str = '#include "tflite-model/tflite_learn'
-    try:
-        # Open the first file for reading
-        with open(src_file, 'r') as file1:
-            file1_contents = file1.readlines()
-
-        start_line = None
-        end_line = None
-        include_lines = []
-        for i, line in enumerate(file1_contents):
-            if include_line_str in line:
+def merge_model_metadata(src_file, dest_file):
+    merge_all_model_metadata([dest_file, src_file], dest_file)
+
+MODEL_VARIABLES_START_STR = "const char* ei_classifier_inferencing_categories"
+MODEL_VARIABLES_END_STR = "ei_impulse_handle_t& ei_default_impulse"
+MODEL_VARIABLES_INCLUDE_STR = '#include "tflite-model/tflite_learn'
+
+# Read the tflite_learn includes and the impulse block (from the categories to the line
+# before ei_default_impulse) of a suffixed model_variables.h, in one pass over the file
+def extract_model_variables_block(src_file):
+    include_lines = []
+    block = None
+    with open(src_file, 'r') as file:
+        for line in file:
+            if MODEL_VARIABLES_INCLUDE_STR in line:
                 include_lines += [line]
-            if start_str in line:
-                start_line = i
-            if end_str in line:
-                end_line = i-1
+            if MODEL_VARIABLES_START_STR in line:
+                block = []
+            if MODEL_VARIABLES_END_STR in line:
                 break
+            if block is not None:
+                block += [line]
+        else:
+            block = None
 
-        if start_line is None or end_line is None:
-            raise ValueError("Start or end string not found model_variables.h")
+    if block is None:
+        raise ValueError(f"Start or end string not found in {src_file}")
 
-        # Open the second file for reading
-        with open(dest_file, 'r') as file2:
-            file2_contents = file2.readlines()
+    return include_lines, block
 
-        # Find the line number for the insertion string in the second file
+# Function to merge the model_variables.h of all other projects into the one of the 1st project.
+# Each source is read once and dest_file is written once, with the includes and
+# impulse blocks of all sources in order.
+def merge_all_model_variables(src_files, dest_file):
+    try:
+        blocks = [extract_model_variables_block(src_file) for src_file in src_files]
+
+        with open(dest_file, 'r') as file:
+            dest_contents = file.readlines()
+
+        # Insert includes after the last tflite_learn include (or last include), blocks before ei_default_impulse
+        learn_include_line = None
+        last_include_line = None
         insert_line = None
-        insert_include_line = None
-        for i, line in enumerate(file2_contents):
-            if include_line_str in line:
-                insert_include_line = i
-            if insert_line_str in line:
+        for i, line in enumerate(dest_contents):
+            if MODEL_VARIABLES_INCLUDE_STR in line:
+                learn_include_line = i + 1
+            if line.startswith('#include'):
+                last_include_line = i + 1
+            if MODEL_VARIABLES_END_STR in line:
                 insert_line = i
                 break
+        insert_include_line = learn_include_line if learn_include_line is not None else last_include_line
 
-        if insert_line is None:
+        if insert_line is None or insert_include_line is None:
             raise ValueError("Insertion string not found in model_variables.h")
 
-        # Extract the portion between start and end lines from the first file
-        portion_to_copy = file1_contents[start_line:end_line + 1]
-        portion_to_copy[0:0] = ["\n"]
-        portion_to_copy += ["\n"]
-
-        # Insert the extracted portions into the second file at the specified lines
-        file2_contents[insert_include_line:insert_include_line] = include_lines
-        file2_contents[insert_line:insert_line] = portion_to_copy
-
-        # Open the second file for writing and overwrite its contents
-        with open(dest_file, 'w') as file2:
-            file2.writelines(file2_contents)
-
-        logger.info("Portion copied and inserted successfully!")
+        with open(dest_file, 'w') as file:
+            file.writelines(dest_contents[:insert_include_line])
+            for include_lines, _ in blocks:
+                file.writelines(include_lines)
+            file.writelines(dest_contents[insert_include_line:insert_line])
+            for _, block in blocks:
+                file.write("\n")
+                file.writelines(block)
+                file.write("\n")
+            file.writelines(dest_contents[insert_line:])
+
+        logger.info(f"Merge model_variables done ({len(src_files)} projects inserted)")
 
     except FileNotFoundError as e:
         logger.error(f"Error: {e}")
 
-# Function to keep intersection of model_ops_define.h
-def merge_model_ops(src_file, dest_file):
-    try:
-        with open(src_file, 'r') as file1:
-            lines_file1 = [line.strip() for line in file1.readlines()]
+# Function to merge model_variables.h
+def merge_model_variables(src_file, dest_file):
+    merge_all_model_variables([src_file], dest_file)
 
-        with open(dest_file, 'r') as file2:
-            lines_file2 = [line.strip() for line in file2.readlines()]
+# Function to keep intersection of model_ops_define.h of all projects, in the order of the first file
+def merge_all_model_ops(src_files, dest_file):
+    try:
+        all_lines = []
+        for src_file in src_files:
+            with open(src_file, 'r') as file:
+                all_lines.append([line.strip() for line in file.readlines()])
 
         # Find the intersection of lines
-        intersection = [line for line in lines_file1 if line in lines_file2]
+        other_lines = [set(lines) for lines in all_lines[1:]]
+        intersection = [line for line in all_lines[0] if all(line in lines for lines in other_lines)]
 
-        # Write the intersection back to src_file
         with open(dest_file, 'w') as file:
             for line in intersection:
                 file.write(line + '\n')
 
-        logger.info("Merge model_ops done")
+        logger.info(f"Merge model_ops done ({len(src_files)} projects)")
 
     except FileNotFoundError as e:
         logger.error(f"Error: {e}")
 
-def merge_tflite_resolver(src_file, dest_file):
+def merge_model_ops(src_file, dest_file):
+    merge_all_model_ops([src_file, dest_file], dest_file)
+
+# Split tflite-resolver.h into the lines before the resolver entries, the entries
+# (without continuation backslash) and the lines after them
+def parse_tflite_resolver(lines):
+    entry_idx = [i for i, line in enumerate(lines) if line.startswith('resolver.')]
+    if not entry_idx:
+        return lines, [], []
+    entries = [lines[i].rstrip('\\').strip() for i in entry_idx]
+    return lines[:entry_idx[0]], entries, lines[entry_idx[-1] + 1:]
+
+# Union of the resolver entries of all projects, the rest of the file comes from the first one
+def merge_all_tflite_resolvers(src_files, dest_file):
     try:
-        with open(src_file, 'r') as file1:
-            lines_file1 = [line.strip() for line in file1.readlines()]
-
-        with open(dest_file, 'r') as file2:
-            lines_file2 = [line.strip() for line in file2.readlines()]
-
-        # Find the union of lines
         union = []
-        for line1, line2 in zip(lines_file1, lines_file2):
-            if line1 in lines_file2:
-                union.append(line1)
-            if not line2 in union:
-                union.append(line2)
+        header = footer = None
+        for src_file in src_files:
+            with open(src_file, 'r') as file:
+                lines = [line.strip() for line in file.readlines()]
+            file_header, entries, file_footer = parse_tflite_resolver(lines)
+            if header is None:
+                header, footer = file_header, file_footer
+            union += [entry for entry in entries if entry not in union]
+
+        # The op resolver is sized by its number of ops
+        header = [re.sub(r'MicroMutableOpResolver<\d+>', f'MicroMutableOpResolver<{len(union)}>', line) for line in header]
 
-        # Write the union back to src_file
         with open(dest_file, 'w') as file:
-            for line in union:
-                if line.startswith('resolver.') and not line.endswith('\\'):
+            for line in header:
+                file.write(line + '\n')
+            for i, line in enumerate(union):
+                if i < len(union) - 1:
                     line = line + ' \\'
                 file.write(line + '\n')
+            for line in footer:
+                file.write(line + '\n')
 
-        logger.info("Merge tflite resolver done")
+        logger.info(f"Merge tflite resolver done ({len(src_files)} projects)")
 
     except FileNotFoundError as e:
-        logger.error(f"Error: {e}")
\ No newline at end of file
+        logger.error(f"Error: {e}")
+
+def merge_tflite_resolver(src_file, dest_file):
+    merge_all_tflite_resolvers([src_file, dest_file], dest_file)